@@ -1,16 +1,19 @@
 from typing import Optional
 from app.schemas.Post import (
+    CommentPagination,
     PostCommentSchema,
     PostCreateSchema,
     PostFilters,
     PostPagination,
     PostPartialUpdateSchema,
     PostSchema,
+    SearchPagination,
 )
 from app.service.Social import SocialService
 from fastapi import HTTPException, status, Response
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
+from app.utils.json_response import PydanticJSONResponse
 from app.schemas.SocialUser import (
     SocialUserCreateSchema,
     SocialUserSchema,
@@ -19,6 +22,20 @@ from app.schemas.SocialUser import (
 )
 
 
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def next_cursor_headers(
+    pagination: PostPagination | CommentPagination | SearchPagination, posts: list
+) -> dict:
+    """
+    The cursor of the next page travels in a header, so the body of the listings
+    stays the same for the clients still paginating with `page`.
+    """
+    cursor = pagination.next_cursor(posts)
+    return {NEXT_CURSOR_HEADER: cursor} if cursor else {}
+
+
 class SocialController:
 
     def __init__(self, social_service: SocialService):
@@ -58,8 +75,8 @@ class SocialController:
             detail=f"Could not found a post with id {id_post}",
         )
 
-    def handle_delete_post(self, id_post: str) -> JSONResponse:
-        row_count = self.social_service.delete_post(id_post)
+    async def handle_delete_post(self, id_post: str) -> JSONResponse:
+        row_count = await self.social_service.delete_post(id_post)
         if row_count == 0:
             return Response(status_code=status.HTTP_204_NO_CONTENT)
 
@@ -72,8 +89,30 @@ class SocialController:
         self, user_id: int, pagination: PostPagination
     ) -> JSONResponse:
         list = await self.social_service.get_my_feed(user_id, pagination)
-        return JSONResponse(
-            status_code=status.HTTP_200_OK, content=jsonable_encoder(list)
+        return PydanticJSONResponse(
+            status_code=status.HTTP_200_OK,
+            content=list,
+            headers=next_cursor_headers(pagination, list),
+        )
+
+    async def handle_get_for_you_feed(
+        self, user_id: int, pagination: PostPagination
+    ) -> JSONResponse:
+        list = await self.social_service.get_for_you_feed(user_id, pagination)
+        return PydanticJSONResponse(
+            status_code=status.HTTP_200_OK,
+            content=list,
+            headers=next_cursor_headers(pagination, list),
+        )
+
+    async def handle_search_posts(
+        self, user_id: int, query: str, pagination: SearchPagination
+    ) -> JSONResponse:
+        posts = await self.social_service.search_posts(query, pagination, user_id)
+        return PydanticJSONResponse(
+            status_code=status.HTTP_200_OK,
+            content=posts,
+            headers=next_cursor_headers(pagination, posts),
         )
 
     async def handle_create_social_user(
@@ -89,8 +128,10 @@ class SocialController:
     async def handle_get_all(
             self, requestor_id: int, filters: PostFilters) -> JSONResponse:
         list = await self.social_service._get_all(filters, requestor_id)
-        return JSONResponse(
-            status_code=status.HTTP_200_OK, content=jsonable_encoder(list)
+        return PydanticJSONResponse(
+            status_code=status.HTTP_200_OK,
+            content=list,
+            headers=next_cursor_headers(filters.pagination, list),
         )
 
     async def handle_get_social_user(self, user_id: int) -> JSONResponse:
@@ -106,7 +147,11 @@ class SocialController:
         user_to_follow_id: str,
     ) -> JSONResponse:
 
-        await self.social_service.follow_social_user(user_id, user_to_follow_id)
+        followed = await self.social_service.follow_social_user(
+            user_id, user_to_follow_id
+        )
+        if not followed:
+            return Response(status_code=status.HTTP_204_NO_CONTENT)
 
         return JSONResponse(status_code=status.HTTP_200_OK,
                             content="User followed successfully")
@@ -117,7 +162,11 @@ class SocialController:
         user_to_unfollow_id: str,
     ) -> JSONResponse:
 
-        await self.social_service.unfollow_social_user(user_id, user_to_unfollow_id)
+        unfollowed = await self.social_service.unfollow_social_user(
+            user_id, user_to_unfollow_id
+        )
+        if not unfollowed:
+            return Response(status_code=status.HTTP_204_NO_CONTENT)
 
         return JSONResponse(status_code=status.HTTP_200_OK,
                             content="User unfollowed successfully")
@@ -148,6 +197,10 @@ class SocialController:
         return JSONResponse(status_code=status.HTTP_200_OK,
                             content="Tag unsubscribed successfully")
 
+    async def handle_get_trending_tags(self, limit: int, hours: int) -> JSONResponse:
+        tags = await self.social_service.get_trending_tags(limit, hours)
+        return PydanticJSONResponse(status_code=status.HTTP_200_OK, content=tags)
+
     async def handle_get_subscribed_tags(self, user_id: int) -> JSONResponse:
         result = await self.social_service.get_subscribed_tags(user_id)
         return JSONResponse(status_code=status.HTTP_200_OK,
@@ -182,6 +235,17 @@ class SocialController:
             content="Post unliked successfully"
         )
 
+    async def handle_get_post_likers(
+        self,
+        post_id: str,
+        query_params: dict,
+    ) -> JSONResponse:
+        likers = await self.social_service.get_post_likers(post_id, query_params)
+        return JSONResponse(
+            status_code=status.HTTP_200_OK,
+            content=jsonable_encoder(likers)
+        )
+
     async def handle_comment_post(
         self,
         post_id: str,
@@ -198,6 +262,18 @@ class SocialController:
         return JSONResponse(status_code=status.HTTP_200_OK,
                             content=jsonable_encoder(comment))
 
+    async def handle_get_post_comments(
+        self,
+        post_id: str,
+        pagination: CommentPagination,
+    ) -> JSONResponse:
+        comments = await self.social_service.get_post_comments(post_id, pagination)
+        return PydanticJSONResponse(
+            status_code=status.HTTP_200_OK,
+            content=comments,
+            headers=next_cursor_headers(pagination, comments),
+        )
+
     async def handle_delete_post_comment(
         self,
         user_id: int,
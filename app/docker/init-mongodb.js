@@ -2,7 +2,12 @@ db = db.getSiblingDB('social_service');
 
 db.createCollection('posts');
 db.createCollection('users');
-db.posts.insertMany([
+db.createCollection('follows');
+db.createCollection('likes');
+db.createCollection('comments');
+db.createCollection('tag_buckets');
+db.createCollection('post_terms');
+const posts = db.posts.insertMany([
   {
     "author_user_id": 17,
     "content": "Mi Primera Publicacion :D",
@@ -39,26 +44,65 @@ db.posts.insertMany([
 db.users.insertMany([
   {
     "_id": 1,
-    "followers": [],
-    "following": [],
-    "tags": []
+    "tags": [],
+    "following_count": 1,
+    "followers_count": 0
   },
   {
     "_id": 2,
-    "followers": [],
-    "following": [],
-    "tags": []
+    "tags": [],
+    "following_count": 1,
+    "followers_count": 0
   },
   {
     "_id": 3,
-    "followers": [],
-    "following": [],
     "tags": []
   },
   {
     "_id": 4,
-    "followers": [],
-    "following": [],
     "tags": []
   }
-])
\ No newline at end of file
+])
+
+// The author of the posts, followed by users 1 and 2
+db.users.insertOne({
+  "_id": 17,
+  "tags": [],
+  "following_count": 0,
+  "followers_count": 2
+});
+db.follows.insertMany([
+  {
+    "follower_id": 1,
+    "followee_id": 17,
+    "created_at": ISODate("2024-04-14T10:00:00.000Z")
+  },
+  {
+    "follower_id": 2,
+    "followee_id": 17,
+    "created_at": ISODate("2024-04-14T11:00:00.000Z")
+  }
+]);
+
+// Every comment is in the comments collection; the posts embed the newest ones
+db.comments.insertOne({
+  "_id": "fdfe6218-64f7-4f89-af36-42b8b035f4c8",
+  "post_id": posts.insertedIds[0],
+  "author": 11,
+  "content": "bien ahi!!",
+  "created_at": ISODate("2024-04-16T05:35:30.127Z")
+});
+
+// Home timelines of the author and its followers, as filled by fan-out on write
+const seededPosts = [
+  { "_id": posts.insertedIds[0], "created_at": ISODate("2024-04-15T05:33:33.127Z") },
+  { "_id": posts.insertedIds[1], "created_at": ISODate("2024-04-19T02:15:30.217Z") }
+];
+db.timelines.insertMany(
+  [17, 1, 2].flatMap((ownerId) => seededPosts.map((post) => ({
+    "owner_id": ownerId,
+    "created_at": post.created_at,
+    "post_id": post._id,
+    "author_id": 17
+  })))
+);
@@ -1,9 +1,17 @@
+import asyncio
 import logging
-from httpx import AsyncClient, HTTPStatusError, Response, AsyncHTTPTransport
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Set
+from httpx import AsyncClient, HTTPStatusError, Limits, Response, AsyncHTTPTransport
 from os import environ
+from pydantic import TypeAdapter
 from app.exceptions.InternalServerErrorException import InternalServerErrorException
 from app.exceptions.NotFoundException import ItemNotFound
 from app.schemas.RealUser import GetUserSchema
+from app.utils.cache import MISSING, TTLCache
+from app.utils.metrics import REGISTRY
+from app.utils.request_stats import record_users_call
 
 logger = logging.getLogger("users")
 logger.setLevel("DEBUG")
@@ -16,18 +24,172 @@ USERS_SERVICE_URL = environ["USERS_SERVICE_URL"]
 NUMBER_OF_RETRIES = 3
 TIMEOUT = 10
 
+# Connection pool shared by every request to the users service
+MAX_CONNECTIONS = int(environ.get("USERS_SERVICE_MAX_CONNECTIONS", 100))
+MAX_KEEPALIVE_CONNECTIONS = int(
+    environ.get("USERS_SERVICE_MAX_KEEPALIVE_CONNECTIONS", 20)
+)
+KEEPALIVE_EXPIRY = float(environ.get("USERS_SERVICE_KEEPALIVE_EXPIRY", 30))
+# HTTP/2 needs the optional "h2" package (poetry install -E http2)
+HTTP2 = environ.get("USERS_SERVICE_HTTP2", "false").lower() == "true"
+
+# Validates a whole list of users in one call into pydantic-core
+USERS_ADAPTER = TypeAdapter(List[GetUserSchema])
+
+# Maximum number of ids asked for in a single /users?ids= request
+USERS_BATCH_SIZE = int(environ.get("USERS_BATCH_SIZE", 100))
+
+# Profiles fetched from the users service, by user id
+USERS_CACHE = TTLCache(
+    "users",
+    maxsize=int(environ.get("USERS_CACHE_MAX_SIZE", 10000)),
+    ttl=float(environ.get("USERS_CACHE_TTL", 60)),
+)
+
+REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "social_users_service_requests_in_flight",
+    "Requests to the users service using (or waiting for) a pooled connection",
+)
+CONNECTIONS_OPENED = REGISTRY.counter(
+    "social_users_service_connections_opened_total",
+    "Connections opened to the users service (the rest of the requests reuse one)",
+)
+POOL_WAIT = REGISTRY.histogram(
+    "social_users_service_pool_wait_seconds",
+    "Time a request to the users service waited for a free pooled connection",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+REQUEST_DURATION = REGISTRY.histogram(
+    "social_users_service_request_duration_seconds",
+    "Time to get a response from the users service",
+    ["endpoint"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+REQUEST_ERRORS = REGISTRY.counter(
+    "social_users_service_errors_total",
+    "Requests to the users service that failed or got a 5xx, by error",
+    ["endpoint", "error"],
+)
+
+
+def endpoint_of(path: str) -> str:
+    """
+    Endpoint of the users service a path belongs to, without ids or query
+    string, to label the metrics of the request.
+    """
+    path = path.split("?", 1)[0]
+    return re.sub(r"/\d+(?=/|$)", "/{user_id}", path)
+
+
+class PoolTrace:
+    """
+    httpcore trace callback of a single request. The time until the request
+    headers start being sent, minus the time spent opening a connection, is
+    the time the request waited for a free connection of the pool.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.connecting_since = None
+        self.connecting_time = 0.0
+        self.recorded = False
+
+    async def __call__(self, event_name: str, info: dict):
+        now = time.perf_counter()
+        if event_name == "connection.connect_tcp.started":
+            CONNECTIONS_OPENED.inc()
+            self.connecting_since = now
+        elif event_name.startswith("connection.") and event_name.endswith(
+            (".complete", ".failed")
+        ) and self.connecting_since is not None:
+            self.connecting_time += now - self.connecting_since
+            self.connecting_since = now
+        elif event_name.endswith("send_request_headers.started") \
+                and not self.recorded:
+            self.recorded = True
+            POOL_WAIT.observe(
+                max(now - self.started_at - self.connecting_time, 0.0)
+            )
+
 
 class UserService:
+    client: Optional[AsyncClient] = None
+
+    @classmethod
+    async def startup(cls):
+        """
+        Open the client shared by every request, so the connections to the
+        users service are kept alive and reused. Bound to the app start up.
+        """
+        if cls.client is None:
+            cls.client = AsyncClient(
+                transport=AsyncHTTPTransport(
+                    retries=NUMBER_OF_RETRIES,
+                    limits=Limits(
+                        max_connections=MAX_CONNECTIONS,
+                        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=KEEPALIVE_EXPIRY,
+                    ),
+                    http2=HTTP2,
+                ),
+                timeout=TIMEOUT,
+            )
+
+    @classmethod
+    async def shutdown(cls):
+        if cls.client is not None:
+            await cls.client.aclose()
+            cls.client = None
+
     @staticmethod
     async def get(path: str) -> Response:
-        async with AsyncClient(
-            transport=AsyncHTTPTransport(retries=NUMBER_OF_RETRIES), timeout=TIMEOUT
-        ) as client:
-            response = await client.get(USERS_SERVICE_URL + path)
-            return response
+        if UserService.client is None:
+            await UserService.startup()
+
+        endpoint = endpoint_of(path)
+        record_users_call()
+        REQUESTS_IN_FLIGHT.inc()
+        started_at = time.perf_counter()
+        try:
+            response = await UserService.client.get(
+                USERS_SERVICE_URL + path, extensions={"trace": PoolTrace()}
+            )
+        except Exception as err:
+            REQUEST_ERRORS.labels(endpoint, type(err).__name__).inc()
+            raise
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUEST_DURATION.labels(endpoint).observe(
+                time.perf_counter() - started_at
+            )
+        if response.status_code >= 500:
+            REQUEST_ERRORS.labels(endpoint, response.status_code).inc()
+        return response
 
     @staticmethod
     async def get_user(author_user_id: int) -> GetUserSchema:
+        """
+        Get a user, from the cache if it was fetched less than USERS_CACHE_TTL
+        seconds ago. Concurrent lookups of the same user share one request.
+        """
+        return await USERS_CACHE.get_or_load(
+            author_user_id, lambda: UserService.fetch_user(author_user_id)
+        )
+
+    @staticmethod
+    def invalidate_user(user_id: Optional[int] = None):
+        """
+        Forget the cached profile of a user (of every user if no id is given),
+        e.g. after it was updated.
+        """
+        if user_id is None:
+            USERS_CACHE.invalidate()
+        else:
+            USERS_CACHE.invalidate(user_id)
+
+    @staticmethod
+    async def fetch_user(author_user_id: int) -> GetUserSchema:
         try:
             response = await UserService.get(f"/users/{author_user_id}")
             if response.status_code == 200:
@@ -53,7 +215,7 @@ class UserService:
             response = await UserService.get(path)
             if response.status_code == 200:
                 users = response.json()["message"]
-                return [GetUserSchema(**user) for user in users]
+                return USERS_ADAPTER.validate_python(users)
             elif response.status_code == 204:
                 return []
             else:
@@ -62,11 +224,37 @@ class UserService:
             print(f"Unexpected error: {e}")
             raise InternalServerErrorException("User service")
 
+    @staticmethod
+    async def get_users_by_ids(users_ids: List[int]) -> List[GetUserSchema]:
+        """
+        Get the users with the given ids, with one /users?ids= request. The
+        ones that do not exist are left out: the users service answers 404
+        when none of them does.
+        """
+        try:
+            response = await UserService.get(
+                f"/users?ids={','.join(map(str, users_ids))}"
+            )
+        except Exception as e:
+            print(f"Unexpected error: {e}")
+            raise InternalServerErrorException("User service")
+        if response.status_code == 200:
+            return USERS_ADAPTER.validate_python(response.json()["message"])
+        if response.status_code in (204, 404):
+            return []
+        raise InternalServerErrorException("User service")
+
     @staticmethod
     async def user_exists(user_id: int) -> bool:
+        if USERS_CACHE.get(user_id) is not MISSING:
+            return True
         try:
             response = await UserService.get(f"/users/{user_id}")
-            return response.status_code == 200
+            if response.status_code != 200:
+                return False
+            # The profile is usually needed right after the check
+            USERS_CACHE.set(user_id, GetUserSchema(**response.json()["message"]))
+            return True
         except HTTPStatusError as e:
             if e.response.status_code == 404:
                 return False
@@ -76,3 +264,100 @@ class UserService:
         except Exception as e:
             print(f"Unexpected error: {e}")
             raise InternalServerErrorException("User service")
+
+
+class UserLoader:
+    """
+    Batch loader of the users needed to render a response. Every `load` issued
+    in the same iteration of the event loop is resolved together: from the
+    profiles cache when possible, and the rest with one /users?ids= request
+    per USERS_BATCH_SIZE ids. Create one per response, so a user is never
+    asked for twice while rendering it.
+    """
+
+    def __init__(self, batch_size: int = USERS_BATCH_SIZE):
+        self.batch_size = batch_size
+        self._futures: Dict[int, asyncio.Future] = {}
+        self._queue: List[int] = []
+        # The event loop only keeps weak references to its tasks: without
+        # these, a batch could be garbage collected while in flight
+        self._dispatches: Set[asyncio.Task] = set()
+
+    def load(self, user_id: int) -> asyncio.Future:
+        future = self._futures.get(user_id)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._futures[user_id] = future
+            if not self._queue:
+                loop.call_soon(self._start_dispatch)
+            self._queue.append(user_id)
+        return future
+
+    async def load_many(
+        self, users_ids: Iterable[int], ignore_missing: bool = False
+    ) -> Dict[int, GetUserSchema]:
+        """
+        Load users by id. Unless `ignore_missing` is set, a user that does not
+        exist raises ItemNotFound; otherwise it is left out of the result.
+        """
+        users_ids = list(dict.fromkeys(users_ids))
+        users = await asyncio.gather(
+            *[self.load(user_id) for user_id in users_ids], return_exceptions=True
+        )
+        loaded = {}
+        for user_id, user in zip(users_ids, users):
+            if isinstance(user, ItemNotFound) and ignore_missing:
+                continue
+            if isinstance(user, BaseException):
+                raise user
+            loaded[user_id] = user
+        return loaded
+
+    def _start_dispatch(self):
+        task = asyncio.ensure_future(self._dispatch())
+        self._dispatches.add(task)
+        task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self):
+        users_ids, self._queue = self._queue, []
+        misses = []
+        for user_id in users_ids:
+            user = USERS_CACHE.get(user_id)
+            if user is MISSING:
+                misses.append(user_id)
+            else:
+                self._resolve(user_id, user)
+        if not misses:
+            return
+
+        chunks = [
+            misses[i:i + self.batch_size]
+            for i in range(0, len(misses), self.batch_size)
+        ]
+        fetched_chunks = await asyncio.gather(
+            *[UserService.get_users_by_ids(chunk) for chunk in chunks],
+            return_exceptions=True,
+        )
+        for chunk, fetched_chunk in zip(chunks, fetched_chunks):
+            # A failed request only fails the users of its chunk
+            if isinstance(fetched_chunk, BaseException):
+                for user_id in chunk:
+                    self._fail(user_id, fetched_chunk)
+                continue
+            fetched = {user.id: user for user in fetched_chunk}
+            for user_id in chunk:
+                if user_id in fetched:
+                    USERS_CACHE.set(user_id, fetched[user_id])
+                    self._resolve(user_id, fetched[user_id])
+                else:
+                    self._fail(user_id, ItemNotFound("User", user_id))
+
+    def _resolve(self, user_id: int, user: GetUserSchema):
+        # Cancelled if every caller waiting for it was
+        if not self._futures[user_id].done():
+            self._futures[user_id].set_result(user)
+
+    def _fail(self, user_id: int, err: BaseException):
+        if not self._futures[user_id].done():
+            self._futures[user_id].set_exception(err)
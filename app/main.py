@@ -1,20 +1,35 @@
 from datetime import datetime
 import logging
-from fastapi import Depends, FastAPI, Query, Request, Body
+from fastapi import Depends, FastAPI, Query, Request, Body, Response
 from app.controller.Social import SocialController
 from app.service.Social import SocialService
-from typing import Annotated
+from typing import Annotated, Literal
+from pydantic import Field
 from app.repository.SocialMongo import SocialMongoDB
+from app.external.Users import UserService
 from app.schemas.Post import (
+    CommentCursor,
+    CommentPagination,
     CreatePostCommentSchema,
     DeletePostCommentSchema,
     PostCreateSchema,
+    PostCursor,
     PostFilters,
     PostPagination,
     PostPartialUpdateSchema,
+    SearchCursor,
+    SearchPagination,
     TagType,
 )
 from app.security.JWTBearer import get_current_user_id
+from app.service.Trending import (
+    TRENDING_MAX_TAGS,
+    TRENDING_MAX_WINDOW_HOURS,
+    TRENDING_WINDOW_HOURS,
+)
+from app.utils.http_metrics import HTTPMetricsMiddleware
+from app.utils.metrics import CONTENT_TYPE, REGISTRY
+from app.utils.request_stats import RequestStatsMiddleware
 from app.schemas.SocialUser import (
     SocialUserCreateSchema,
     FollowUserSchema,
@@ -22,6 +37,7 @@ from app.schemas.SocialUser import (
 )
 from app.query_params.QueryParams import (
     SocialFollowersQueryParams,
+    SocialPostLikesQueryParams,
     SocialUsersQueryParams
 )
 
@@ -31,11 +47,17 @@ app = FastAPI(
     version="0.1.0",
     summary="Microservice for social network management",
 )
+app.add_middleware(RequestStatsMiddleware)
+app.add_middleware(HTTPMetricsMiddleware)
 
 social_repository = SocialMongoDB()
 social_service = SocialService(social_repository)
 social_controller = SocialController(social_service)
 
+# Maximum tags and authors the posts can be filtered by in one request
+MAX_TAGS_FILTER = 10
+MAX_AUTHORS_FILTER = 100
+
 logger = logging.getLogger("social")
 logger.setLevel("DEBUG")
 
@@ -50,18 +72,51 @@ async def start_up():
         app.logger.error(e)
         app.logger.error("Could not connect to Postgres client")
 
+    await UserService.startup()
+
+    try:
+        await social_repository.ensure_indexes()
+    except Exception as e:
+        app.logger.error(e)
+        app.logger.error("Could not ensure MongoDB indexes")
+
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await UserService.shutdown()
+    await social_repository.flush_counters()
     social_repository.shutdown()
     app.logger.info("Postgres shutdown succesfully")
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(REGISTRY.exposition(), media_type=CONTENT_TYPE)
+
+
 @app.post("/social/posts", tags=["Posts"])
 async def create_post(item: PostCreateSchema):
     return await social_controller.handle_create_post(item)
 
 
+# Declared before /social/posts/{id_post}, which would match it too
+@app.get("/social/posts/search", tags=["Posts"])
+async def search_posts(
+    user_id: Annotated[int, Depends(get_current_user_id)],
+    q: Annotated[str, Query(min_length=2, max_length=256)],
+    per_page: Annotated[int | None, Query(ge=1, le=100)] = 30,
+    cursor: Annotated[str | None, Query()] = None,
+):
+    return await social_controller.handle_search_posts(
+        user_id,
+        q,
+        SearchPagination(
+            per_page=per_page,
+            cursor=SearchCursor.decode(cursor) if cursor else None,
+        ),
+    )
+
+
 @app.get("/social/posts/{id_post}", tags=["Posts"])
 async def get_one_post(
     req: Request,
@@ -88,8 +143,8 @@ async def update_fields_in_post(
     "/social/posts/{id_post}",
     tags=["Posts"],
 )
-def delete_post(id_post: str):
-    return social_controller.handle_delete_post(id_post)
+async def delete_post(id_post: str):
+    return await social_controller.handle_delete_post(id_post)
 
 
 @app.get(
@@ -101,9 +156,38 @@ async def get_my_feed(
     time_offset: Annotated[datetime | None, Query(default_factory=datetime.today)],
     page: Annotated[int | None, Query(ge=1)] = 1,
     per_page: Annotated[int | None, Query(ge=1, le=100)] = 30,
+    cursor: Annotated[str | None, Query()] = None,
 ):
     return await social_controller.handle_get_my_feed(
-        user_id, PostPagination(time_offset=time_offset, page=page, per_page=per_page)
+        user_id,
+        PostPagination(
+            time_offset=time_offset,
+            page=page,
+            per_page=per_page,
+            cursor=PostCursor.decode(cursor) if cursor else None,
+        ),
+    )
+
+
+@app.get(
+    "/social/users/me/feed/for-you",
+    tags=["Social User"],
+)
+async def get_for_you_feed(
+    user_id: Annotated[int, Depends(get_current_user_id)],
+    time_offset: Annotated[datetime | None, Query(default_factory=datetime.today)],
+    page: Annotated[int | None, Query(ge=1)] = 1,
+    per_page: Annotated[int | None, Query(ge=1, le=100)] = 30,
+    cursor: Annotated[str | None, Query()] = None,
+):
+    return await social_controller.handle_get_for_you_feed(
+        user_id,
+        PostPagination(
+            time_offset=time_offset,
+            page=page,
+            per_page=per_page,
+            cursor=PostCursor.decode(cursor) if cursor else None,
+        ),
     )
 
 
@@ -126,21 +210,42 @@ async def get_all_posts(
     time_offset: Annotated[datetime | None, Query(default_factory=datetime.today)],
     page: Annotated[int | None, Query(ge=1)] = 1,
     per_page: Annotated[int | None, Query(ge=1, le=100)] = 30,
-    tag: Annotated[TagType | None, Query(default_factory=None)] = None,
-    author: Annotated[int | None, Query(ge=1)] = None,
+    tag: Annotated[list[TagType] | None, Query(max_length=MAX_TAGS_FILTER)] = None,
+    tag_mode: Annotated[Literal["any", "all"], Query()] = "any",
+    author: Annotated[
+        list[Annotated[int, Field(ge=1)]] | None,
+        Query(max_length=MAX_AUTHORS_FILTER),
+    ] = None,
+    cursor: Annotated[str | None, Query()] = None,
 ):
+    tags = sorted({tag.lower() for tag in tag}) if tag else []
     return await social_controller.handle_get_all(
         user_id,
         PostFilters(
             pagination=PostPagination(
-                time_offset=time_offset, page=page, per_page=per_page
+                time_offset=time_offset,
+                page=page,
+                per_page=per_page,
+                cursor=PostCursor.decode(cursor) if cursor else None,
             ),
-            tags=tag.lower() if tag else None,
-            users=[author] if author else None,
+            tags=tags[0] if len(tags) == 1 else None,
+            any_tags=tags if len(tags) > 1 and tag_mode == "any" else None,
+            all_tags=tags if len(tags) > 1 and tag_mode == "all" else None,
+            users=author or None,
         ),
     )
 
 
+@app.get("/social/tags/trending", tags=["Posts"])
+async def get_trending_tags(
+    limit: Annotated[int, Query(ge=1, le=TRENDING_MAX_TAGS)] = 10,
+    hours: Annotated[
+        int, Query(ge=1, le=TRENDING_MAX_WINDOW_HOURS)
+    ] = TRENDING_WINDOW_HOURS,
+):
+    return await social_controller.handle_get_trending_tags(limit, hours)
+
+
 @app.post(
     "/social/users/follow",
     tags=["Social User"],
@@ -219,6 +324,15 @@ async def unlike_post(
     return await social_controller.handle_unlike_post(user_id, post_id)
 
 
+@app.get("/social/posts/{post_id}/likes", tags=["Posts"])
+async def get_post_likers(
+    post_id: str,
+    query_params: SocialPostLikesQueryParams = Depends(SocialPostLikesQueryParams)
+):
+    return await social_controller.handle_get_post_likers(
+        post_id, query_params.get_query_params())
+
+
 @app.post(
     "/social/posts/{post_id}/comments",
     tags=["Posts"],
@@ -235,6 +349,24 @@ async def comment_post(
     )
 
 
+@app.get(
+    "/social/posts/{post_id}/comments",
+    tags=["Posts"],
+)
+async def get_post_comments(
+    post_id: str,
+    per_page: Annotated[int | None, Query(ge=1, le=100)] = 30,
+    cursor: Annotated[str | None, Query()] = None,
+):
+    return await social_controller.handle_get_post_comments(
+        post_id,
+        CommentPagination(
+            per_page=per_page,
+            cursor=CommentCursor.decode(cursor) if cursor else None,
+        ),
+    )
+
+
 @app.delete(
     "/social/posts/{post_id}/comments",
     tags=["Posts"],
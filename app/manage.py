@@ -0,0 +1,187 @@
+"""
+Maintenance commands for the social service database.
+
+Usage:
+    python -m app.manage indexes build [--background]
+    python -m app.manage indexes check
+    python -m app.manage timelines rebuild [--user USER_ID]
+    python -m app.manage follows migrate
+    python -m app.manage likes migrate
+    python -m app.manage comments migrate
+    python -m app.manage trending compact
+    python -m app.manage search reindex
+"""
+import argparse
+import asyncio
+import sys
+from datetime import datetime
+from app.repository.SocialMongo import SocialMongoDB
+from app.service.Social import SocialService
+from app.service.Trending import TrendingTags
+
+
+async def build_indexes(repository: SocialMongoDB, args) -> int:
+    ensured = await repository.ensure_indexes(background=args.background)
+    for collection, names in ensured.items():
+        print(f"{collection}: {', '.join(names)}")
+    return 0
+
+
+async def check_indexes(repository: SocialMongoDB, args) -> int:
+    drift = await repository.detect_index_drift()
+    print(drift.model_dump_json(indent=2))
+    return 1 if drift.has_drift() else 0
+
+
+async def rebuild_timelines(repository: SocialMongoDB, args) -> int:
+    service = SocialService(repository)
+    if args.user is not None:
+        users_ids = [args.user]
+    else:
+        users = repository.users_collection.find({}, {"_id": 1})
+        users_ids = [user["_id"] async for user in users]
+
+    for user_id in users_ids:
+        created = await service.rebuild_timeline(user_id)
+        print(f"user {user_id}: {created} timeline entries created")
+    return 0
+
+
+async def migrate_follows(repository: SocialMongoDB, args) -> int:
+    """
+    Move the "following"/"followers" arrays embedded in the users documents
+    to the "follows" collection, and recompute the follow counters of the
+    users. Idempotent: can be resumed if interrupted.
+    """
+    users = repository.users_collection.find(
+        {"$or": [{"following": {"$exists": True}}, {"followers": {"$exists": True}}]},
+        {"following": 1, "followers": 1},
+    )
+    # The arrays do not record when each follow happened
+    migrated_at = datetime.now()
+    async for user in users:
+        user_id = user["_id"]
+        edges = {(user_id, followee_id) for followee_id in user.get("following", [])}
+        edges |= {(follower_id, user_id) for follower_id in user.get("followers", [])}
+        created = await repository.import_follows(sorted(edges), migrated_at)
+        await repository.users_collection.update_one(
+            {"_id": user_id}, {"$unset": {"following": "", "followers": ""}}
+        )
+        print(f"user {user_id}: {created} follows created")
+
+    updated = await repository.recount_follows()
+    print(f"{updated} users with follows recounted")
+    return 0
+
+
+async def migrate_likes(repository: SocialMongoDB, args) -> int:
+    migrated = await repository.migrate_embedded_likes()
+    print(f"{migrated} posts with likes migrated")
+    return 0
+
+
+async def migrate_comments(repository: SocialMongoDB, args) -> int:
+    migrated = await repository.migrate_embedded_comments()
+    print(f"{migrated} posts with comments migrated")
+    return 0
+
+
+async def compact_trending(repository: SocialMongoDB, args) -> int:
+    compacted = await TrendingTags(repository).compact()
+    print(f"{compacted} hourly tag buckets rolled into daily ones")
+    return 0
+
+
+async def reindex_search(repository: SocialMongoDB, args) -> int:
+    indexed = await repository.reindex_posts()
+    print(f"{indexed} posts indexed for search")
+    return 0
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    indexes = commands.add_parser("indexes", help="Manage MongoDB indexes")
+    indexes_commands = indexes.add_subparsers(dest="action", required=True)
+    build = indexes_commands.add_parser(
+        "build", help="Create the declared indexes (idempotent)"
+    )
+    build.add_argument(
+        "--background",
+        action="store_true",
+        help="Build without blocking the collections (useful on large ones)",
+    )
+    build.set_defaults(handler=build_indexes)
+    check = indexes_commands.add_parser(
+        "check",
+        help="Report missing, mismatched, undeclared and unused indexes. "
+        "Exits with 1 if a declared index is missing or mismatched",
+    )
+    check.set_defaults(handler=check_indexes)
+
+    timelines = commands.add_parser("timelines", help="Manage home timelines")
+    timelines_commands = timelines.add_subparsers(dest="action", required=True)
+    rebuild = timelines_commands.add_parser(
+        "rebuild",
+        help="Backfill the timelines with the latest posts of the followed users",
+    )
+    rebuild.add_argument("--user", type=int, help="Only rebuild this user")
+    rebuild.set_defaults(handler=rebuild_timelines)
+
+    follows = commands.add_parser("follows", help="Manage the follow graph")
+    follows_commands = follows.add_subparsers(dest="action", required=True)
+    migrate = follows_commands.add_parser(
+        "migrate",
+        help="Move the following/followers arrays of the users to the "
+        "follows collection",
+    )
+    migrate.set_defaults(handler=migrate_follows)
+
+    likes = commands.add_parser("likes", help="Manage the likes of the posts")
+    likes_commands = likes.add_subparsers(dest="action", required=True)
+    migrate = likes_commands.add_parser(
+        "migrate",
+        help="Move the users_who_gave_like arrays of the posts to the likes "
+        "collection",
+    )
+    migrate.set_defaults(handler=migrate_likes)
+
+    comments = commands.add_parser("comments", help="Manage the comments of the posts")
+    comments_commands = comments.add_subparsers(dest="action", required=True)
+    migrate = comments_commands.add_parser(
+        "migrate",
+        help="Move the comments embedded in the posts to the comments collection",
+    )
+    migrate.set_defaults(handler=migrate_comments)
+
+    trending = commands.add_parser("trending", help="Manage the trending tags")
+    trending_commands = trending.add_subparsers(dest="action", required=True)
+    compact = trending_commands.add_parser(
+        "compact",
+        help="Roll the old hourly tag buckets into daily ones and delete the "
+        "expired ones (also done hourly by the service)",
+    )
+    compact.set_defaults(handler=compact_trending)
+
+    search = commands.add_parser("search", help="Manage the search index of the posts")
+    search_commands = search.add_subparsers(dest="action", required=True)
+    reindex = search_commands.add_parser(
+        "reindex",
+        help="Rebuild the post_terms postings of every post (idempotent)",
+    )
+    reindex.set_defaults(handler=reindex_search)
+
+    return parser
+
+
+async def run(args) -> int:
+    repository = SocialMongoDB()
+    try:
+        return await args.handler(repository, args)
+    finally:
+        repository.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run(get_parser().parse_args())))
@@ -13,8 +13,8 @@ class Post(Base):
     id: PyObjectId = Field(default_factory=PyObjectId, alias="_id")
     author_user_id: int = Field(...)
     content: str = Field(..., max_length=512)
+    # Who liked the post is kept in the "likes" collection
     likes_count: int = Field(default=0)
-    users_who_gave_like: list[int] = Field(default=[])
     created_at: Optional[datetime]
     updated_at: Optional[datetime]
     tags: list[str] = []
@@ -13,8 +13,7 @@ class SocialUser(Base):
 
     # id of real user in the microservice!
     id: int = Field(strict=False, alias="_id")
-    followers: list[int] = []
-    following: list[int] = []
+    # Who follows whom is kept in the "follows" collection
     tags: list[str] = []
 
     class Config:
@@ -23,8 +22,7 @@ class SocialUser(Base):
 
     def __repr__(self) -> str:
         return (
-            f"Post(id={self.id!r}, followers={self.followers!r}, "
-            f"following={self.following!r}, tags={self.tags!r}"
+            f"SocialUser(id={self.id!r}, tags={self.tags!r}"
         )
 
     @classmethod
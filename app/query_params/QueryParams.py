@@ -14,7 +14,7 @@ class SocialFollowersQueryParams:
     def __init__(
         self,
         offset: Optional[int] = Query(0, ge=0),
-        limit: Optional[int] = Query(200, le=200),
+        limit: Optional[int] = Query(200, ge=1, le=200),
         user_id: Optional[int] = None,
         query: Optional[str] = None
     ):
@@ -33,7 +33,7 @@ class SocialUsersQueryParams:
     def __init__(
         self,
         offset: Optional[int] = Query(0, ge=0),
-        limit: Optional[int] = Query(200, le=200),
+        limit: Optional[int] = Query(200, ge=1, le=200),
         query: Optional[str] = None
     ):
         self.query_params = {
@@ -44,3 +44,18 @@ class SocialUsersQueryParams:
 
     def get_query_params(self):
         return get_query_params(self.query_params)
+
+
+class SocialPostLikesQueryParams:
+    def __init__(
+        self,
+        offset: Optional[int] = Query(0, ge=0),
+        limit: Optional[int] = Query(200, ge=1, le=200),
+    ):
+        self.query_params = {
+            'offset': offset,
+            'limit': limit,
+        }
+
+    def get_query_params(self):
+        return get_query_params(self.query_params)
@@ -0,0 +1,114 @@
+import logging
+from os import environ
+from typing import Any, Dict, Hashable, Tuple
+from pymongo import monitoring
+from app.utils.metrics import REGISTRY
+from app.utils.request_stats import RequestStats, current_request
+
+logger = logging.getLogger("app")
+logger.setLevel("DEBUG")
+
+# Commands that take longer are logged with the shape of their filter
+MONGO_SLOW_COMMAND_MS = float(environ.get("MONGO_SLOW_COMMAND_MS", 100))
+
+MONGO_COMMAND_DURATION = REGISTRY.histogram(
+    "social_mongo_command_duration_seconds",
+    "Round trip of each command sent to Mongo",
+    ["command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+MONGO_COMMAND_FAILURES = REGISTRY.counter(
+    "social_mongo_command_failures_total",
+    "Commands sent to Mongo that failed",
+    ["command"],
+)
+MONGO_SLOW_COMMANDS = REGISTRY.counter(
+    "social_mongo_slow_commands_total",
+    "Commands that took longer than MONGO_SLOW_COMMAND_MS",
+    ["command"],
+)
+
+# Where each command keeps the documents it selects
+FILTER_FIELDS = {
+    "find": ("filter", "sort"),
+    "aggregate": ("pipeline",),
+    "count": ("query",),
+    "distinct": ("key", "query"),
+    "findAndModify": ("query", "sort"),
+    "update": ("updates",),
+    "delete": ("deletes",),
+}
+
+
+class CommandMonitor(monitoring.CommandListener):
+    """
+    Listener of the commands the Mongo driver sends. Records the duration of
+    each one, attributes it to the request that issued it (see
+    app.utils.request_stats) and logs the slow ones with their filter shape.
+
+    The driver calls it from its own threads, in the context of the request.
+    """
+
+    def __init__(self, slow_command_ms: float = MONGO_SLOW_COMMAND_MS):
+        self.slow_command_seconds = slow_command_ms / 1000
+        self._started: Dict[Hashable, Tuple[Any, RequestStats]] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        self._started[(event.connection_id, event.request_id)] = (
+            event.command, current_request()
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._finished(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        MONGO_COMMAND_FAILURES.labels(event.command_name).inc()
+        self._finished(event)
+
+    def _finished(self, event):
+        command, stats = self._started.pop(
+            (event.connection_id, event.request_id), (None, None)
+        )
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMAND_DURATION.labels(event.command_name).observe(seconds)
+        collection = ""
+        if command is not None:
+            collection = command.get(event.command_name, "")
+            if not isinstance(collection, str):
+                collection = ""
+        if stats is not None:
+            stats.mongo_commands.append((event.command_name, collection, seconds))
+
+        if seconds >= self.slow_command_seconds and command is not None:
+            MONGO_SLOW_COMMANDS.labels(event.command_name).inc()
+            logger.warning(
+                f"[MONGO]: slow {event.command_name} on {collection} "
+                f"({seconds * 1000:.1f} ms)"
+                f"{f' in {stats.name}' if stats is not None else ''}: "
+                f"{filter_shape(event.command_name, command)}"
+            )
+
+
+def filter_shape(command_name: str, command: dict) -> dict:
+    """
+    The parts of a command that select documents, with the values replaced
+    by "?", so commands that only differ in their values look the same.
+    """
+    return {
+        field: shape_of(command[field])
+        for field in FILTER_FIELDS.get(command_name, ())
+        if field in command
+    }
+
+
+def shape_of(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: shape_of(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)) and any(
+        isinstance(item, dict) for item in value
+    ):
+        return [shape_of(item) for item in value]
+    return "?"
+
+
+COMMAND_MONITOR = CommandMonitor()
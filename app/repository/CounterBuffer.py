@@ -0,0 +1,134 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Dict, Hashable, Optional
+from pymongo import UpdateOne
+from app.utils.metrics import REGISTRY
+
+logger = logging.getLogger("app")
+logger.setLevel("DEBUG")
+
+COUNTER_EVENTS = REGISTRY.counter(
+    "social_counter_buffer_events_total",
+    "Counter increments received by a write-behind buffer",
+    ["collection"],
+)
+COUNTER_WRITES = REGISTRY.counter(
+    "social_counter_buffer_writes_total",
+    "Document updates flushed by a write-behind buffer",
+    ["collection"],
+)
+COUNTER_WRITES_SAVED = REGISTRY.counter(
+    "social_counter_buffer_writes_saved_total",
+    "Updates avoided by coalescing counter increments of the same document",
+    ["collection"],
+)
+
+
+class CounterBuffer:
+    """
+    Write-behind buffer of counter increments ($inc) of a collection.
+    Increments of the same document are coalesced in memory and written with
+    a single bulk_write every `flush_interval` seconds, or as soon as
+    `max_events` increments are pending, so a burst of likes on a viral post
+    becomes one update instead of thousands contending on the document.
+
+    The counters lag behind by at most `flush_interval`, and the pending
+    increments are lost if the process dies without calling `close`.
+    With `upsert`, the documents that do not exist yet are created.
+    """
+
+    def __init__(self, collection, flush_interval: float, max_events: int,
+                 upsert: bool = False):
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        self.upsert = upsert
+        self._pending: Dict[Hashable, Dict[str, int]] = defaultdict(
+            lambda: defaultdict(int)
+        )
+        self._events = 0
+        self._flusher: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Task] = None
+        name = collection.name
+        self._events_metric = COUNTER_EVENTS.labels(name)
+        self._writes_metric = COUNTER_WRITES.labels(name)
+        self._saved_metric = COUNTER_WRITES_SAVED.labels(name)
+
+    def inc(self, document_id: Any, field: str, amount: int = 1):
+        self._pending[document_id][field] += amount
+        self._events += 1
+        self._events_metric.inc()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush_periodically())
+        if self._events >= self.max_events and (
+            self._flushing is None or self._flushing.done()
+        ):
+            self._flushing = asyncio.ensure_future(self._flush_in_background())
+
+    def pending(self, document_id: Any, field: str) -> int:
+        """
+        Increment of a counter not written yet.
+        """
+        return self._pending.get(document_id, {}).get(field, 0)
+
+    async def flush(self) -> int:
+        """
+        Write the pending increments.
+        Returns:
+            int: number of documents updated
+        """
+        if not self._pending:
+            return 0
+        pending, events = self._pending, self._events
+        self._pending = defaultdict(lambda: defaultdict(int))
+        self._events = 0
+
+        updates = [
+            UpdateOne(
+                {"_id": document_id}, {"$inc": dict(fields)}, upsert=self.upsert
+            )
+            for document_id, fields in pending.items()
+            if any(fields.values())
+        ]
+        try:
+            if updates:
+                await self.collection.bulk_write(updates, ordered=False)
+        except Exception as err:
+            logger.error(f"[COUNTER BUFFER]: could not flush "
+                         f"{self.collection.name}, retrying later: {err}")
+            self._restore(pending, events)
+            raise
+
+        self._writes_metric.inc(len(updates))
+        self._saved_metric.inc(events - len(updates))
+        return len(updates)
+
+    async def close(self):
+        """
+        Stop flushing periodically and write what is pending.
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        await self.flush()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush_in_background()
+
+    async def _flush_in_background(self):
+        try:
+            await self.flush()
+        except Exception:
+            # Already logged, the increments are retried on the next flush
+            pass
+
+    def _restore(self, pending: Dict[Hashable, Dict[str, int]], events: int):
+        for document_id, fields in pending.items():
+            for field, amount in fields.items():
+                self._pending[document_id][field] += amount
+        self._events += events
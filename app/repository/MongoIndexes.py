@@ -0,0 +1,234 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+from pydantic import BaseModel
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger("app")
+logger.setLevel("DEBUG")
+
+IndexKeys = List[Tuple[str, int]]
+
+
+class DeclaredIndex(BaseModel):
+    keys: IndexKeys
+    unique: bool = False
+
+
+# Indexes the service relies on, by collection and index name.
+# Keep them in sync with the queries in SocialMongoDB: every $match/$sort
+# of a hot path should be served by one of these.
+DECLARED_INDEXES: Dict[str, Dict[str, DeclaredIndex]] = {
+    # "_id" breaks ties between posts created at the same time, so the
+    # (created_at, _id) cursors of the feed are served by these too.
+    "posts": {
+        "created_at_id": DeclaredIndex(
+            keys=[("created_at", DESCENDING), ("_id", DESCENDING)]
+        ),
+        "author_user_id_created_at_id": DeclaredIndex(
+            keys=[
+                ("author_user_id", ASCENDING),
+                ("created_at", DESCENDING),
+                ("_id", DESCENDING),
+            ]
+        ),
+        "tags_created_at_id": DeclaredIndex(
+            keys=[
+                ("tags", ASCENDING),
+                ("created_at", DESCENDING),
+                ("_id", DESCENDING),
+            ]
+        ),
+    },
+    # Users are looked up by "_id", which MongoDB always indexes. The authors
+    # pulled by the feed (see SocialMongoDB.get_pulled_authors) are the few
+    # at the top of the followers count or marked with feed_pulled.
+    "users": {
+        "followers_count": DeclaredIndex(keys=[("followers_count", DESCENDING)]),
+        "feed_pulled": DeclaredIndex(keys=[("feed_pulled", ASCENDING)]),
+    },
+    "timelines": {
+        "owner_id_created_at_post_id": DeclaredIndex(
+            keys=[
+                ("owner_id", ASCENDING),
+                ("created_at", DESCENDING),
+                ("post_id", DESCENDING),
+            ]
+        ),
+        "owner_id_post_id": DeclaredIndex(
+            keys=[("owner_id", ASCENDING), ("post_id", ASCENDING)], unique=True
+        ),
+        "owner_id_author_id": DeclaredIndex(
+            keys=[("owner_id", ASCENDING), ("author_id", ASCENDING)]
+        ),
+        "post_id": DeclaredIndex(keys=[("post_id", ASCENDING)]),
+    },
+    # Comments are listed most recent first; "_id" is the id of the comment.
+    "comments": {
+        "post_id_created_at_id": DeclaredIndex(
+            keys=[
+                ("post_id", ASCENDING),
+                ("created_at", DESCENDING),
+                ("_id", DESCENDING),
+            ]
+        ),
+    },
+    # One document per (post, user) like. "Who liked this" lists the most
+    # recent likes first; liked_by_me looks up a user's likes in a page.
+    "likes": {
+        "post_id_user_id": DeclaredIndex(
+            keys=[("post_id", ASCENDING), ("user_id", ASCENDING)], unique=True
+        ),
+        "post_id_created_at_user_id": DeclaredIndex(
+            keys=[
+                ("post_id", ASCENDING),
+                ("created_at", DESCENDING),
+                ("user_id", DESCENDING),
+            ]
+        ),
+        "user_id_post_id": DeclaredIndex(
+            keys=[("user_id", ASCENDING), ("post_id", ASCENDING)]
+        ),
+    },
+    # One document per (follower, followee) edge. Following and followers
+    # are listed in the order they were followed.
+    "follows": {
+        "follower_id_followee_id": DeclaredIndex(
+            keys=[("follower_id", ASCENDING), ("followee_id", ASCENDING)],
+            unique=True,
+        ),
+        "follower_id_created_at_followee_id": DeclaredIndex(
+            keys=[
+                ("follower_id", ASCENDING),
+                ("created_at", ASCENDING),
+                ("followee_id", ASCENDING),
+            ]
+        ),
+        "followee_id_created_at_follower_id": DeclaredIndex(
+            keys=[
+                ("followee_id", ASCENDING),
+                ("created_at", ASCENDING),
+                ("follower_id", ASCENDING),
+            ]
+        ),
+    },
+    # Inverted index of the posts, one document per (term, post). A search
+    # for one term reads its most relevant postings in order; a search for
+    # several is covered by the same index. Reindexing a post deletes its
+    # postings by post_id.
+    "post_terms": {
+        "term_weight_created_at_post_id": DeclaredIndex(
+            keys=[
+                ("term", ASCENDING),
+                ("weight", DESCENDING),
+                ("created_at", DESCENDING),
+                ("post_id", DESCENDING),
+            ]
+        ),
+        "post_id_term": DeclaredIndex(
+            keys=[("post_id", ASCENDING), ("term", ASCENDING)], unique=True
+        ),
+    },
+}
+
+
+class IndexDrift(BaseModel):
+    """
+    Differences between the declared indexes and the ones found in the database.
+    `unused` is None when the server could not report index usage.
+    """
+
+    missing: Dict[str, List[str]] = {}
+    mismatched: Dict[str, List[str]] = {}
+    undeclared: Dict[str, List[str]] = {}
+    unused: Optional[Dict[str, List[str]]] = None
+
+    def has_drift(self) -> bool:
+        return any(self.missing.values()) or any(self.mismatched.values())
+
+
+class MongoIndexManager:
+
+    def __init__(
+        self,
+        database,
+        declared: Dict[str, Dict[str, DeclaredIndex]] = DECLARED_INDEXES,
+    ):
+        self.database = database
+        self.declared = declared
+
+    async def ensure_indexes(self, background: bool = False) -> Dict[str, List[str]]:
+        """
+        Create every declared index. createIndexes is a no-op for indexes that
+        already exist with the same name and keys, so this is safe to run on
+        every start up.
+        Args:
+            background (bool): ask the server to build without blocking the
+            collection (only honoured by servers older than 4.2)
+        Returns:
+            dict: index names ensured, by collection
+        """
+        ensured = {}
+        for collection_name, indexes in self.declared.items():
+            if not indexes:
+                continue
+            models = [
+                IndexModel(
+                    index.keys,
+                    name=name,
+                    unique=index.unique,
+                    background=background,
+                )
+                for name, index in indexes.items()
+            ]
+            collection = self.database[collection_name]
+            ensured[collection_name] = await collection.create_indexes(models)
+            logger.info(f"Indexes ensured on {collection_name}: "
+                        f"{ensured[collection_name]}")
+        return ensured
+
+    async def detect_drift(self) -> IndexDrift:
+        drift = IndexDrift(unused={})
+        for collection_name, declared in self.declared.items():
+            collection = self.database[collection_name]
+            existing = {
+                name: DeclaredIndex(
+                    keys=[tuple(key) for key in info["key"]],
+                    unique=info.get("unique", False),
+                )
+                for name, info in (await collection.index_information()).items()
+                if name != "_id_"
+            }
+            drift.missing[collection_name] = [
+                name for name in declared if name not in existing
+            ]
+            drift.mismatched[collection_name] = [
+                name for name, index in declared.items()
+                if name in existing and existing[name] != index
+            ]
+            drift.undeclared[collection_name] = [
+                name for name in existing if name not in declared
+            ]
+
+            unused = await self._get_unused_indexes(collection)
+            if unused is None:
+                drift.unused = None
+            elif drift.unused is not None:
+                drift.unused[collection_name] = unused
+        return drift
+
+    async def _get_unused_indexes(self, collection) -> Optional[List[str]]:
+        """
+        Indexes with no recorded accesses since the last server restart,
+        according to $indexStats.
+        """
+        try:
+            stats = collection.aggregate([{"$indexStats": {}}])
+            return [
+                stat["name"] async for stat in stats
+                if stat["name"] != "_id_" and stat["accesses"]["ops"] == 0
+            ]
+        except (OperationFailure, NotImplementedError) as err:
+            logger.warning(f"Could not read $indexStats of "
+                           f"{collection.name}: {err}")
+            return None
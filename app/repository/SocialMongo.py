@@ -1,24 +1,86 @@
+import asyncio
+from collections import defaultdict
 from datetime import datetime
 import json
 from bson import ObjectId
 import pymongo
+from pymongo import ReturnDocument, UpdateOne
+from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from os import environ
 from app.models.base import Base
 from app.models.Post import Post
 from typing import List, Optional
 from app.repository.SocialRepository import SocialRepository
+from app.repository.CommandMonitor import COMMAND_MONITOR
+from app.repository.CounterBuffer import CounterBuffer
+from app.repository.MongoIndexes import IndexDrift, MongoIndexManager
 from app.exceptions.NotFoundException import ItemNotFound
 from app.utils.mongo_exception_handling import withMongoExceptionsHandle
 from app.utils.update_at_trigger import updatedAtTrigger
-from app.schemas.Post import PostFilters
+from app.utils.metrics import REGISTRY, timed_methods
+from app.utils.text_search import index_terms
+from app.schemas.Post import (
+    CommentPagination,
+    PostCursor,
+    PostFilters,
+    PostPagination,
+    SearchCursor,
+    SearchPagination,
+)
 
 load_dotenv()
 
+DUPLICATE_KEY_ERROR = 11000
 
+# Coalesce the likes_count increments of the posts in memory and write them
+# every COUNTER_FLUSH_INTERVAL_MS, or after COUNTER_FLUSH_MAX_EVENTS of them.
+COUNTER_BUFFER_ENABLED = environ.get("COUNTER_BUFFER_ENABLED", "false") == "true"
+COUNTER_FLUSH_INTERVAL_MS = int(environ.get("COUNTER_FLUSH_INTERVAL_MS", 200))
+COUNTER_FLUSH_MAX_EVENTS = int(environ.get("COUNTER_FLUSH_MAX_EVENTS", 1000))
+
+# Newest comments of each post kept in the post document. All of them are
+# in the comments collection.
+POST_COMMENTS_PREVIEW = int(environ.get("POST_COMMENTS_PREVIEW", 10))
+
+# Newest comments of each post included in the feed cards (0 for none).
+FEED_COMMENTS_PREVIEW = min(
+    int(environ.get("FEED_COMMENTS_PREVIEW", 3)), POST_COMMENTS_PREVIEW
+)
+
+# First followers and followed users (in follow order) returned with a user.
+# The totals are in its followers_count and following_count.
+USER_FOLLOWS_PREVIEW = int(environ.get("USER_FOLLOWS_PREVIEW", 200))
+
+# Postings of each term read to rank a search of several terms. Bounds the
+# work of searches with common terms, at the cost of not counting a term in
+# the posts past its limit.
+SEARCH_MAX_POSTINGS_PER_TERM = int(environ.get("SEARCH_MAX_POSTINGS_PER_TERM", 1000))
+
+# Tag activity (posts and likes) is counted in one document per tag and hour,
+# "hour:<%Y-%m-%dT%H>:<tag>", and older hours are rolled into one document per
+# tag and day, "day:<%Y-%m-%d>:<tag>". Both kinds of buckets of a window are
+# read with two range scans of the _id index.
+HOUR_BUCKET_FORMAT = "%Y-%m-%dT%H"
+DAY_BUCKET_FORMAT = "%Y-%m-%d"
+
+MONGO_OPERATION_DURATION = REGISTRY.histogram(
+    "social_mongo_operation_duration_seconds",
+    "Time spent in each method of the Mongo repository",
+    ["method"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+MONGO_OPERATION_ERRORS = REGISTRY.counter(
+    "social_mongo_operation_errors_total",
+    "Exceptions raised by each method of the Mongo repository",
+    ["method"],
+)
+
+
+@timed_methods(MONGO_OPERATION_DURATION, MONGO_OPERATION_ERRORS)
 class SocialMongoDB(SocialRepository):
     db_url = environ.get("MONGO_URL")
-    client = pymongo.MongoClient(db_url)
+    client = AsyncIOMotorClient(db_url, event_listeners=[COMMAND_MONITOR])
 
     def get_client(self):
         return self.client
@@ -27,6 +89,42 @@ class SocialMongoDB(SocialRepository):
         self.database = self.get_client()["social_service"]
         self.posts_collection = self.database["posts"]
         self.users_collection = self.database["users"]
+        self.timelines_collection = self.database["timelines"]
+        self.follows_collection = self.database["follows"]
+        self.likes_collection = self.database["likes"]
+        self.comments_collection = self.database["comments"]
+        self.tag_buckets_collection = self.database["tag_buckets"]
+        self.post_terms_collection = self.database["post_terms"]
+        self.index_manager = MongoIndexManager(self.database)
+        self.posts_counters = None
+        self.tags_counters = None
+        if COUNTER_BUFFER_ENABLED:
+            self.posts_counters = CounterBuffer(
+                self.posts_collection,
+                COUNTER_FLUSH_INTERVAL_MS / 1000,
+                COUNTER_FLUSH_MAX_EVENTS,
+            )
+            self.tags_counters = CounterBuffer(
+                self.tag_buckets_collection,
+                COUNTER_FLUSH_INTERVAL_MS / 1000,
+                COUNTER_FLUSH_MAX_EVENTS,
+                upsert=True,
+            )
+
+    async def ensure_indexes(self, background: bool = False):
+        return await self.index_manager.ensure_indexes(background)
+
+    async def detect_index_drift(self) -> IndexDrift:
+        return await self.index_manager.detect_drift()
+
+    async def flush_counters(self):
+        """
+        Write the buffered counter increments, if any. Call it on shutdown.
+        """
+        if self.posts_counters is not None:
+            await self.posts_counters.close()
+        if self.tags_counters is not None:
+            await self.tags_counters.close()
 
     def shutdown(self):
         self.client.close()
@@ -34,31 +132,39 @@ class SocialMongoDB(SocialRepository):
     def rollback(self):
         pass
 
-    def clean_table(self, table: Base):
-        self.database.drop_collection(table.__collectionname__)
+    async def clean_table(self, table: Base):
+        await self.database.drop_collection(table.__collectionname__)
 
-    @withMongoExceptionsHandle()
-    def add_post(self, record: Base) -> Optional[str]:
+    @withMongoExceptionsHandle(async_mode=True)
+    async def add_post(self, record: Base) -> Optional[str]:
         now = datetime.now()
         record_dump = record.model_dump(by_alias=True, exclude=["id"])
         record_dump["created_at"] = now
         record_dump["updated_at"] = now
-        result = self.posts_collection.insert_one(record_dump)
+        result = await self.posts_collection.insert_one(record_dump)
         if result.inserted_id:
+            await asyncio.gather(
+                self._bump_tags(record_dump.get("tags"), "posts", now),
+                self._index_posts([{"_id": result.inserted_id, **record_dump}]),
+            )
             return str(result.inserted_id)
 
-    @withMongoExceptionsHandle()
-    def get_post(self, id_post: str) -> Post:
-        result = self.posts_collection.find_one({"_id": ObjectId(id_post)})
+    @withMongoExceptionsHandle(async_mode=True)
+    async def get_post(self, id_post: str) -> Post:
+        result = await self.posts_collection.find_one({"_id": ObjectId(id_post)})
         if result is None:
             raise ItemNotFound("Post", id_post)
+        if self.posts_counters is not None:
+            result["likes_count"] = result.get("likes_count", 0) + (
+                self.posts_counters.pending(result["_id"], "likes_count")
+            )
 
         result["id"] = str(result.pop("_id"))
         return result
 
     @updatedAtTrigger(collection_name="posts")
-    @withMongoExceptionsHandle()
-    def update_post(self, id_post: str, update_post_set: str) -> Optional[int]:
+    @withMongoExceptionsHandle(async_mode=True)
+    async def update_post(self, id_post: str, update_post_set: str) -> Optional[int]:
         """
         Delete a post by id and its logs
         Args:
@@ -74,23 +180,30 @@ class SocialMongoDB(SocialRepository):
         if not update_post_set:
             return
 
-        result = self.posts_collection.update_one(
-            {"_id": ObjectId(id_post)}, {"$set": json.loads(update_post_set)}
+        update = json.loads(update_post_set)
+        result = await self.posts_collection.update_one(
+            {"_id": ObjectId(id_post)}, {"$set": update}
         )
+        if result.modified_count and ("content" in update or "tags" in update):
+            post = await self.posts_collection.find_one(
+                {"_id": ObjectId(id_post)}, {"content": 1, "tags": 1, "created_at": 1}
+            )
+            if post is not None:
+                await self._index_posts([post], replace=True)
         return result.modified_count
 
-    @withMongoExceptionsHandle()
-    def update_user(self, id_user: str, update_user_set: str) -> Optional[int]:
+    @withMongoExceptionsHandle(async_mode=True)
+    async def update_user(self, id_user: str, update_user_set: str) -> Optional[int]:
         if not update_user_set:
             return
 
-        result = self.users_collection.update_one(
+        result = await self.users_collection.update_one(
             {"_id": id_user}, {"$set": json.loads(update_user_set)}
         )
         return result.modified_count
 
-    @withMongoExceptionsHandle()
-    def delete_post(self, id_received: str) -> int:
+    @withMongoExceptionsHandle(async_mode=True)
+    async def delete_post(self, id_received: str) -> int:
         """
         Delete a post by id and its logs
         Args:
@@ -98,104 +211,965 @@ class SocialMongoDB(SocialRepository):
         Returns:
             int: number of rows affected. 0 if no rows were affected
         """
-        result = self.posts_collection.delete_one({"_id": ObjectId(id_received)})
+        result = await self.posts_collection.delete_one(
+            {"_id": ObjectId(id_received)}
+        )
+        if result.deleted_count:
+            await asyncio.gather(
+                self.likes_collection.delete_many({"post_id": ObjectId(id_received)}),
+                self.comments_collection.delete_many(
+                    {"post_id": ObjectId(id_received)}
+                ),
+                self.post_terms_collection.delete_many(
+                    {"post_id": ObjectId(id_received)}
+                ),
+            )
         return result.deleted_count
 
-    @withMongoExceptionsHandle()
-    def get_posts_by(self, filters: PostFilters) -> List[Post]:
-        pipeline = [
-            {"$match": {"created_at": {"$lte": filters.pagination.time_offset}}}
-        ]
-        if filters.tags:
-            pipeline.append({"$match": {"tags": filters.tags}})
-        if filters.users:
-            pipeline.append({"$match": {"author_user_id": {"$in": filters.users}}})
-
-        pipeline += [
-            {"$sort": {"created_at": -1}},  # sort by updated_at desc
-            {"$skip": (filters.pagination.page - 1) * filters.pagination.per_page},
-            {"$limit": filters.pagination.per_page},
-        ]
-        cursor = self.posts_collection.aggregate(pipeline)
+    @withMongoExceptionsHandle(async_mode=True)
+    async def get_posts_by(self, filters: PostFilters) -> List[Post]:
+        """
+        Get a page of posts, most recent first, as feed cards (see
+        feed_card_projection).
+        If the pagination has a cursor, the page is found by seeking right
+        after it on the (created_at, _id) index, so every page costs the same.
+        Otherwise, falls back to the time_offset + page (skip) pagination.
+        """
+        cursor = self.posts_collection.aggregate(posts_page_pipeline(filters))
         posts = []
-        for post in cursor:
+        async for post in cursor:
             post["id"] = str(post.pop("_id"))
             posts.append(post)
         return posts
 
-    @withMongoExceptionsHandle()
-    def get_following_of(self, user_id: int) -> List[int]:
-        following = list(
-            self.users_collection.find({"_id": user_id}, {"following": 1, "_id": 0})
-        )
-        if not following:
+    @withMongoExceptionsHandle(async_mode=True)
+    async def get_subscribed_tags(self, user_id: int) -> List[str]:
+        result = await self.users_collection.find_one({"_id": user_id}, {"tags": 1})
+        if result is None:
+            raise ItemNotFound("User", user_id)
+        return result.get("tags", [])
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def get_following_of(self, user_id: int, offset: int = 0,
+                               limit: Optional[int] = None) -> List[int]:
+        if not await self._social_user_exists(user_id):
             raise ItemNotFound("Social User", user_id)
-        following = following[0].get("following", [])
-        return following
+        # A limit of 0 would be no limit for MongoDB
+        if limit is not None and limit <= 0:
+            return []
+        cursor = self.follows_collection.find(
+            {"follower_id": user_id}, {"followee_id": 1, "_id": 0}
+        ).sort([("created_at", 1), ("followee_id", 1)]).skip(offset or 0)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return [follow["followee_id"] async for follow in cursor]
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def get_followers_of(self, user_id: int, offset: int = 0,
+                               limit: Optional[int] = 200) -> List[int]:
+        if limit is not None and limit <= 0:
+            return []
+        cursor = self.follows_collection.find(
+            {"followee_id": user_id}, {"follower_id": 1, "_id": 0}
+        ).sort([("created_at", 1), ("follower_id", 1)]).skip(offset or 0)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return [follow["follower_id"] async for follow in cursor]
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def count_followers_of(self, user_id: int) -> int:
+        user = await self.users_collection.find_one(
+            {"_id": user_id}, {"followers_count": 1}
+        )
+        return user.get("followers_count", 0) if user else 0
 
-    @withMongoExceptionsHandle()
-    def get_followers_of(self, user_id: int, offset: int = 0,
-                         limit: int = 200) -> List[int]:
-        followers = list(
-            self.users_collection.find({"_id": user_id}, {"followers": 1, "_id": 0})
+    @withMongoExceptionsHandle(async_mode=True)
+    async def get_pulled_authors(
+        self, users_ids: Optional[List[int]], followers_threshold: int
+    ) -> List[int]:
+        """
+        Get the users, among the given ones (or among all of them if None),
+        with more than `followers_threshold` followers or marked as pulled
+        before. Getting all of them only reads the few pulled ones (see
+        pulled_authors_query).
+        """
+        query = pulled_authors_query(followers_threshold)
+        if users_ids is not None:
+            if not users_ids:
+                return []
+            query["_id"] = {"$in": users_ids}
+        cursor = self.users_collection.find(query, {"_id": 1})
+        return [user["_id"] async for user in cursor]
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def mark_pulled_author(self, user_id: int) -> bool:
+        """
+        Mark the posts of the user as pulled from now on, whatever its
+        followers count: its posts since then are not in the timelines of
+        its followers.
+        Returns:
+            bool: False if the user was already marked
+        """
+        result = await self.users_collection.update_one(
+            {"_id": user_id, "feed_pulled": {"$ne": True}},
+            {"$set": {"feed_pulled": True}},
         )
-        if not followers:
+        return result.modified_count == 1
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def get_followed_among(
+        self, user_id: int, users_ids: List[int]
+    ) -> List[int]:
+        """
+        Get the users, among the given ones, followed by the user: a lookup
+        of each of them in the (follower_id, followee_id) index, without
+        reading the rest of its follows.
+        """
+        if not users_ids:
             return []
-        followers = followers[0].get("followers", [])
-        return followers[offset:offset + limit]
+        cursor = self.follows_collection.find(
+            {"follower_id": user_id, "followee_id": {"$in": users_ids}},
+            {"followee_id": 1, "_id": 0},
+        )
+        return [follow["followee_id"] async for follow in cursor]
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def add_follow(self, follower_id: int, followee_id: int) -> bool:
+        """
+        Create the follow edge (an upsert, so following twice is a no-op) and,
+        only if it is new, bump the counters of both users in one bulk write.
+        Returns:
+            bool: False if the follower was already following the followee
+        """
+        try:
+            result = await self.follows_collection.update_one(
+                {"follower_id": follower_id, "followee_id": followee_id},
+                {"$setOnInsert": {"created_at": datetime.now()}},
+                upsert=True,
+            )
+        except pymongo.errors.DuplicateKeyError:
+            # A concurrent follow of the same user inserted it first
+            return False
+        if result.upserted_id is None:
+            return False
+
+        if not await self._update_follow_counters(follower_id, followee_id, 1):
+            await self.follows_collection.delete_one({"_id": result.upserted_id})
+            await self.users_collection.update_one(
+                {"_id": followee_id}, {"$inc": {"followers_count": -1}}
+            )
+            raise ItemNotFound("Social User", follower_id)
+        return True
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def remove_follow(self, follower_id: int, followee_id: int) -> bool:
+        """
+        Returns:
+            bool: False if the follower was not following the followee
+        """
+        result = await self.follows_collection.delete_one(
+            {"follower_id": follower_id, "followee_id": followee_id}
+        )
+        if result.deleted_count == 0:
+            if not await self._social_user_exists(follower_id):
+                raise ItemNotFound("Social User", follower_id)
+            return False
+
+        await self._update_follow_counters(follower_id, followee_id, -1)
+        return True
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def recount_follows(self) -> int:
+        """
+        Recompute the following_count and followers_count of every user from
+        the follows collection.
+        Returns:
+            int: number of users updated
+        """
+        counts = {}
+        for field, counter in [("follower_id", "following_count"),
+                               ("followee_id", "followers_count")]:
+            cursor = self.follows_collection.aggregate([
+                {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+            ])
+            async for user in cursor:
+                counts.setdefault(user["_id"], {})[counter] = user["count"]
 
-    @withMongoExceptionsHandle()
-    def add_social_user(self, record: Base) -> Optional[int]:
+        await self.users_collection.update_many(
+            {}, {"$set": {"following_count": 0, "followers_count": 0}}
+        )
+        if not counts:
+            return 0
+        result = await self.users_collection.bulk_write(
+            [UpdateOne({"_id": id}, {"$set": c}) for id, c in counts.items()],
+            ordered=False,
+        )
+        return result.matched_count
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def import_follows(self, edges: List[tuple], created_at: datetime) -> int:
+        """
+        Insert (follower_id, followee_id) edges, skipping the existing ones.
+        Used to migrate the graph from the "following"/"followers" arrays
+        the users documents used to embed.
+        Returns:
+            int: number of edges created
+        """
+        follows = [
+            {
+                "follower_id": follower_id,
+                "followee_id": followee_id,
+                "created_at": created_at,
+            }
+            for follower_id, followee_id in edges
+        ]
+        return await self._insert_ignoring_duplicates(
+            self.follows_collection, follows
+        )
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def add_social_user(self, record: Base) -> Optional[int]:
         record_dump = record.model_dump(by_alias=True)
         print(f"[RECORD DUMP]: {record_dump}")
         if "_id" not in record_dump:
             raise Exception("Int id of user is required to add a social user")
         id = record_dump["_id"]
         try:
-            self.users_collection.insert_one(record_dump)
+            await self.users_collection.insert_one(record_dump)
             return id
         except pymongo.errors.DuplicateKeyError:
             return id
         except Exception as e:
             raise e
 
-    @withMongoExceptionsHandle()
-    def get_social_user(self, id_received: int) -> Base:
-        result = self.users_collection.find_one({"_id": id_received})
+    @withMongoExceptionsHandle(async_mode=True)
+    async def get_social_user(self, id_received: int) -> Base:
+        result = await self.users_collection.find_one({"_id": id_received})
         if result is None:
             raise ItemNotFound("User", id_received)
+        # Both can be too many to return them all: only the first ones are,
+        # with the totals in following_count and followers_count
+        result["following"] = await self.get_following_of(
+            id_received, 0, USER_FOLLOWS_PREVIEW
+        )
+        result["followers"] = await self.get_followers_of(
+            id_received, 0, USER_FOLLOWS_PREVIEW
+        )
         return result
 
-    @withMongoExceptionsHandle()
-    def like_post(self, user_id: int, post_id: str) -> Optional[int]:
-        result = self.posts_collection.update_one(
-            {"_id": ObjectId(post_id)}, {
-                "$addToSet": {"users_who_gave_like": user_id}
-            }
+    @withMongoExceptionsHandle(async_mode=True)
+    async def like_post(self, user_id: int, post_id: str) -> Optional[int]:
+        """
+        Add the like, unless the user already liked the post (the like is
+        keyed by (post_id, user_id)), and then bump the counter of the post
+        and the activity of its tags.
+        Returns:
+            int: 1 if the post was liked, 0 otherwise
+        """
+        like = {
+            "post_id": ObjectId(post_id),
+            "user_id": user_id,
+            "created_at": datetime.now(),
+        }
+        try:
+            result = await self.likes_collection.insert_one(like)
+        except pymongo.errors.DuplicateKeyError:
+            return 0
+
+        if self.posts_counters is not None:
+            post = await self.posts_collection.find_one(
+                {"_id": ObjectId(post_id)}, {"tags": 1}
+            )
+            if post is not None:
+                self.posts_counters.inc(post["_id"], "likes_count", 1)
+        else:
+            post = await self.posts_collection.find_one_and_update(
+                {"_id": ObjectId(post_id)},
+                {"$inc": {"likes_count": 1}},
+                projection={"tags": 1},
+            )
+        if post is not None:
+            await self._bump_tags(post.get("tags"), "likes", like["created_at"])
+            return 1
+
+        # The post does not exist (anymore)
+        await self.likes_collection.delete_one({"_id": result.inserted_id})
+        return 0
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def unlike_post(self, user_id: int, post_id: str) -> Optional[int]:
+        """
+        Returns:
+            int: 1 if the post was unliked, 0 if the user had not liked it
+        """
+        result = await self.likes_collection.delete_one(
+            {"post_id": ObjectId(post_id), "user_id": user_id}
+        )
+        if result.deleted_count == 0:
+            return 0
+
+        if self.posts_counters is not None:
+            self.posts_counters.inc(ObjectId(post_id), "likes_count", -1)
+            return 1
+        updated = await self.posts_collection.update_one(
+            {"_id": ObjectId(post_id)}, {"$inc": {"likes_count": -1}}
+        )
+        return updated.modified_count
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def add_comment(self, post_id: str, comment: dict):
+        """
+        Store the comment and push it to the newest comments embedded in the
+        post, bumping its counter, without reading the post.
+        """
+        result = await self.comments_collection.insert_one({
+            "_id": comment["id"],
+            "post_id": ObjectId(post_id),
+            "author": comment["author"],
+            "content": comment["content"],
+            "created_at": comment["created_at"],
+        })
+        updated = await self.posts_collection.update_one(
+            {"_id": ObjectId(post_id)},
+            {
+                "$push": {"comments": {
+                    "$each": [comment], "$slice": -POST_COMMENTS_PREVIEW
+                }},
+                "$inc": {"comments_count": 1},
+            },
         )
+        if updated.matched_count == 0:
+            await self.comments_collection.delete_one({"_id": result.inserted_id})
+            raise ItemNotFound("Post", post_id)
 
-        if result.modified_count == 1:
-            result = self.posts_collection.update_one(
-                {"_id": ObjectId(post_id)}, {
-                    "$inc": {"likes_count": 1}
+    @withMongoExceptionsHandle(async_mode=True)
+    async def delete_comment(self, post_id: str, comment_id: str) -> bool:
+        """
+        Returns:
+            bool: False if the post has no comment with that id
+        """
+        result = await self.comments_collection.delete_one(
+            {"_id": comment_id, "post_id": ObjectId(post_id)}
+        )
+        if result.deleted_count == 0:
+            if await self.posts_collection.count_documents(
+                {"_id": ObjectId(post_id)}, limit=1
+            ) == 0:
+                raise ItemNotFound("Post", post_id)
+            return False
+
+        post = await self.posts_collection.find_one_and_update(
+            {"_id": ObjectId(post_id)},
+            {
+                "$pull": {"comments": {"id": comment_id}},
+                "$inc": {"comments_count": -1},
+            },
+            projection={"comments": 1, "comments_count": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if post and len(post["comments"]) < min(
+            post["comments_count"], POST_COMMENTS_PREVIEW
+        ):
+            # The deleted comment was embedded: refill with the next older one
+            await self._refresh_embedded_comments(post_id)
+        return True
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def get_comments(
+        self, post_id: str, pagination: CommentPagination
+    ) -> List[dict]:
+        """
+        Get a page of the comments of a post, most recent first, seeking after
+        the cursor of the pagination if it has one.
+        """
+        match = {"post_id": ObjectId(post_id)}
+        if pagination.cursor:
+            match["$or"] = [
+                {"created_at": {"$lt": pagination.cursor.created_at}},
+                {
+                    "created_at": pagination.cursor.created_at,
+                    "_id": {"$lt": pagination.cursor.id},
+                },
+            ]
+        cursor = self.comments_collection.find(match, {"post_id": 0}).sort(
+            [("created_at", -1), ("_id", -1)]
+        ).limit(pagination.per_page)
+        comments = []
+        async for comment in cursor:
+            comment["id"] = comment.pop("_id")
+            comments.append(comment)
+        return comments
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def migrate_embedded_comments(self) -> int:
+        """
+        Copy the comments embedded in the posts to the comments collection,
+        then keep only the newest POST_COMMENTS_PREVIEW embedded and recount.
+        Returns:
+            int: number of posts migrated
+        """
+        migrated = 0
+        posts = self.posts_collection.find(
+            {"comments.0": {"$exists": True}}, {"comments": 1}
+        )
+        async for post in posts:
+            comments = [
+                {
+                    "_id": comment["id"],
+                    "post_id": post["_id"],
+                    "author": comment["author"],
+                    "content": comment["content"],
+                    "created_at": comment["created_at"],
                 }
+                for comment in post["comments"]
+            ]
+            await self._insert_ignoring_duplicates(self.comments_collection, comments)
+            await self._refresh_embedded_comments(str(post["_id"]))
+            migrated += 1
+        return migrated
+
+    async def _refresh_embedded_comments(self, post_id: str):
+        cursor = self.comments_collection.find(
+            {"post_id": ObjectId(post_id)}, {"post_id": 0}
+        ).sort([("created_at", -1), ("_id", -1)]).limit(POST_COMMENTS_PREVIEW)
+        newest = [
+            {
+                "id": comment["_id"],
+                "author": comment["author"],
+                "content": comment["content"],
+                "created_at": comment["created_at"],
+            }
+            async for comment in cursor
+        ]
+        comments_count = await self.comments_collection.count_documents(
+            {"post_id": ObjectId(post_id)}
+        )
+        await self.posts_collection.update_one(
+            {"_id": ObjectId(post_id)},
+            {"$set": {
+                "comments": newest[::-1],
+                "comments_count": comments_count,
+            }},
+        )
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def get_liked_posts(self, user_id: int, posts_ids: List[str]) -> List[str]:
+        """
+        Get which of the given posts the user liked, with a single query.
+        """
+        if not posts_ids:
+            return []
+        cursor = self.likes_collection.find(
+            {
+                "user_id": user_id,
+                "post_id": {"$in": [ObjectId(id) for id in posts_ids]},
+            },
+            {"post_id": 1, "_id": 0},
+        )
+        return [str(like["post_id"]) async for like in cursor]
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def get_likers_of(self, post_id: str, offset: int = 0,
+                            limit: Optional[int] = 200) -> List[int]:
+        """
+        Get the users that liked a post, most recent likes first. A limit of
+        None gets all of them.
+        """
+        # A limit of 0 would be no limit for MongoDB
+        if limit is not None and limit <= 0:
+            return []
+        cursor = self.likes_collection.find(
+            {"post_id": ObjectId(post_id)}, {"user_id": 1, "_id": 0}
+        ).sort([("created_at", -1), ("user_id", -1)]).skip(offset or 0)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        return [like["user_id"] async for like in cursor]
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def migrate_embedded_likes(self) -> int:
+        """
+        Move the "users_who_gave_like" arrays the posts used to embed to the
+        likes collection, and recount the likes of those posts.
+        Returns:
+            int: number of posts migrated
+        """
+        migrated = 0
+        posts = self.posts_collection.find(
+            {"users_who_gave_like": {"$exists": True}},
+            {"users_who_gave_like": 1, "created_at": 1},
+        )
+        async for post in posts:
+            likes = [
+                {"post_id": post["_id"], "user_id": user_id,
+                 "created_at": post["created_at"]}
+                for user_id in set(post["users_who_gave_like"])
+            ]
+            await self._insert_ignoring_duplicates(self.likes_collection, likes)
+            likes_count = await self.likes_collection.count_documents(
+                {"post_id": post["_id"]}
+            )
+            await self.posts_collection.update_one(
+                {"_id": post["_id"]},
+                {
+                    "$set": {"likes_count": likes_count},
+                    "$unset": {"users_who_gave_like": ""},
+                },
             )
+            migrated += 1
+        return migrated
 
-        return result.modified_count
+    @withMongoExceptionsHandle(async_mode=True)
+    async def get_posts_by_ids(
+        self, ids: List[str], projection: Optional[dict] = None
+    ) -> List[Post]:
+        """
+        Get the posts with the given ids, in the same order as `ids`.
+        Ids of posts that no longer exist are skipped.
+        """
+        pipeline = [{"$match": {"_id": {"$in": [ObjectId(id) for id in ids]}}}]
+        if projection:
+            pipeline.append({"$project": projection})
+        cursor = self.posts_collection.aggregate(pipeline)
+        posts_by_id = {}
+        async for post in cursor:
+            post["id"] = str(post.pop("_id"))
+            posts_by_id[post["id"]] = post
+        return [posts_by_id[id] for id in ids if id in posts_by_id]
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def add_to_timelines(self, owners_ids: List[int], post: Post) -> int:
+        """
+        Fan out a post to the home timeline of every owner.
+        Returns:
+            int: number of timeline entries created
+        """
+        if not owners_ids:
+            return 0
+        entries = [
+            {
+                "owner_id": owner_id,
+                "created_at": post["created_at"],
+                "post_id": ObjectId(post["id"]),
+                "author_id": post["author_user_id"],
+            }
+            for owner_id in owners_ids
+        ]
+        return await self._insert_ignoring_duplicates(
+            self.timelines_collection, entries
+        )
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def remove_from_timelines(self, post_id: str) -> int:
+        result = await self.timelines_collection.delete_many(
+            {"post_id": ObjectId(post_id)}
+        )
+        return result.deleted_count
 
-    @withMongoExceptionsHandle()
-    def unlike_post(self, user_id: int, post_id: str) -> Optional[int]:
-        result = self.posts_collection.update_one(
-            {"_id": ObjectId(post_id)}, {
-                "$pull": {"users_who_gave_like": {"$eq": user_id}}
+    @withMongoExceptionsHandle(async_mode=True)
+    async def backfill_timeline(
+        self, owner_id: int, authors_ids: List[int], limit: int
+    ) -> int:
+        """
+        Copy the latest `limit` posts of the authors to the timeline of the
+        owner. Posts already in the timeline are skipped.
+        Returns:
+            int: number of timeline entries created
+        """
+        cursor = self.posts_collection.find(
+            {"author_user_id": {"$in": authors_ids}},
+            {"created_at": 1, "author_user_id": 1},
+        ).sort([("created_at", -1), ("_id", -1)]).limit(limit)
+        entries = [
+            {
+                "owner_id": owner_id,
+                "created_at": post["created_at"],
+                "post_id": post["_id"],
+                "author_id": post["author_user_id"],
             }
+            async for post in cursor
+        ]
+        return await self._insert_ignoring_duplicates(
+            self.timelines_collection, entries
         )
 
-        if result.modified_count == 1:
-            result = self.posts_collection.update_one(
-                {"_id": ObjectId(post_id)}, {
-                    "$inc": {"likes_count": -1}
-                }
+    @withMongoExceptionsHandle(async_mode=True)
+    async def evict_from_timeline(self, owner_id: int, author_id: int) -> int:
+        result = await self.timelines_collection.delete_many(
+            {"owner_id": owner_id, "author_id": author_id}
+        )
+        return result.deleted_count
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def get_timeline(
+        self, owner_id: int, pagination: PostPagination
+    ) -> List[Post]:
+        """
+        Get a page of the home timeline of the owner, most recent first:
+        a range scan over its timeline entries plus one batched fetch of the
+        posts, as feed cards. Paginates like get_posts_by.
+        """
+        match = {"owner_id": owner_id}
+        if pagination.cursor:
+            match.update(seek_after(pagination.cursor, id_field="post_id"))
+            skip = 0
+        else:
+            match["created_at"] = {"$lte": pagination.time_offset}
+            skip = (pagination.page - 1) * pagination.per_page
+
+        cursor = self.timelines_collection.find(match, {"post_id": 1}).sort(
+            [("created_at", -1), ("post_id", -1)]
+        ).skip(skip).limit(pagination.per_page)
+        posts_ids = [str(entry["post_id"]) async for entry in cursor]
+        if not posts_ids:
+            return []
+        return await self.get_posts_by_ids(posts_ids, feed_card_projection())
+
+    async def _update_follow_counters(
+        self, follower_id: int, followee_id: int, amount: int
+    ) -> bool:
+        """
+        Returns:
+            bool: False if the follower is not a social user
+        """
+        result = await self.users_collection.bulk_write(
+            [
+                UpdateOne({"_id": follower_id}, {"$inc": {"following_count": amount}}),
+                UpdateOne({"_id": followee_id}, {"$inc": {"followers_count": amount}}),
+            ],
+            ordered=False,
+        )
+        if result.matched_count == 2:
+            return True
+        # Only in the unusual case, find out which user is missing
+        return await self._social_user_exists(follower_id)
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def get_tag_activity(self, since: datetime) -> List[dict]:
+        """
+        Posts and likes of each tag since the given time: the hourly buckets
+        from its hour on, plus the daily buckets from its day on (so the first
+        day of a window that reaches the daily buckets is counted whole).
+        """
+        hours_from = f"hour:{since.strftime(HOUR_BUCKET_FORMAT)}"
+        days_from = f"day:{since.strftime(DAY_BUCKET_FORMAT)}"
+        pipeline = [
+            {"$match": {"$or": [
+                # ";" is the character after ":", the end of each range
+                {"_id": {"$gte": hours_from, "$lt": "hour;"}},
+                {"_id": {"$gte": days_from, "$lt": "day;"}},
+            ]}},
+            {"$group": {
+                "_id": {"$arrayElemAt": [{"$split": ["$_id", ":"]}, 2]},
+                "posts": {"$sum": "$posts"},
+                "likes": {"$sum": "$likes"},
+            }},
+        ]
+        return [
+            {"tag": bucket["_id"], "posts": bucket["posts"], "likes": bucket["likes"]}
+            async for bucket in self.tag_buckets_collection.aggregate(pipeline)
+        ]
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def compact_tag_activity(
+        self, hourly_before: datetime, expire_before: datetime
+    ) -> int:
+        """
+        Roll the hourly tag buckets older than `hourly_before` into daily
+        buckets, and delete the buckets older than `expire_before`. Each hourly
+        bucket is deleted before being added to its day, so compactions running
+        at the same time in several instances count it once.
+        Returns:
+            int: number of hourly buckets rolled into daily ones
+        """
+        hourly = self.tag_buckets_collection.find(
+            {"_id": {
+                "$gte": f"hour:{expire_before.strftime(HOUR_BUCKET_FORMAT)}",
+                "$lt": f"hour:{hourly_before.strftime(HOUR_BUCKET_FORMAT)}",
+            }},
+            {"_id": 1},
+        )
+        daily = defaultdict(lambda: defaultdict(int))
+        compacted = 0
+        async for bucket in hourly:
+            bucket = await self.tag_buckets_collection.find_one_and_delete(
+                {"_id": bucket["_id"]}
             )
+            if bucket is None:
+                continue
+            _, hour, tag = bucket.pop("_id").split(":", 2)
+            day = hour[:len("YYYY-MM-DD")]
+            for field, amount in bucket.items():
+                daily[f"day:{day}:{tag}"][field] += amount
+            compacted += 1
+        if daily:
+            await self.tag_buckets_collection.bulk_write([
+                UpdateOne({"_id": bucket_id}, {"$inc": dict(fields)}, upsert=True)
+                for bucket_id, fields in daily.items()
+            ], ordered=False)
 
-        return result.modified_count
+        await self.tag_buckets_collection.delete_many({"$or": [
+            {"_id": {
+                "$gte": "hour:",
+                "$lt": f"hour:{expire_before.strftime(HOUR_BUCKET_FORMAT)}",
+            }},
+            {"_id": {
+                "$gte": "day:",
+                "$lt": f"day:{expire_before.strftime(DAY_BUCKET_FORMAT)}",
+            }},
+        ]})
+        return compacted
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def search_posts(
+        self, terms: List[str], pagination: SearchPagination
+    ) -> List[Post]:
+        """
+        Get a page of the posts with any of the terms, as feed cards with
+        their "score": the sum of the weights of the terms in the post (see
+        index_terms). Most relevant first, then most recent.
+
+        One term is read in order from the (term, weight, created_at, post_id)
+        index of post_terms, stopping at the end of the page. For several
+        terms, the SEARCH_MAX_POSTINGS_PER_TERM most relevant postings of each
+        one are read the same way, concurrently, and summed by post: a post
+        past that limit for a common term does not get its weight.
+        """
+        if not terms:
+            return []
+        if len(terms) == 1:
+            postings = await self._get_term_postings(
+                terms[0], pagination.cursor, pagination.per_page
+            )
+            scores = {
+                str(posting["post_id"]): posting["weight"] for posting in postings
+            }
+        else:
+            terms_postings = await asyncio.gather(*(
+                self._get_term_postings(term, None, SEARCH_MAX_POSTINGS_PER_TERM)
+                for term in terms
+            ))
+            hits = {}
+            for postings in terms_postings:
+                for posting in postings:
+                    hit = hits.setdefault(
+                        posting["post_id"],
+                        [0, posting["created_at"], posting["post_id"]],
+                    )
+                    hit[0] += posting["weight"]
+            ranked = sorted(map(tuple, hits.values()), reverse=True)
+            if pagination.cursor:
+                cursor = pagination.cursor
+                after = (cursor.score, cursor.created_at, ObjectId(cursor.id))
+                ranked = [hit for hit in ranked if hit < after]
+            scores = {
+                str(post_id): score
+                for score, _, post_id in ranked[:pagination.per_page]
+            }
+
+        if not scores:
+            return []
+        posts = await self.get_posts_by_ids(list(scores), feed_card_projection())
+        for post in posts:
+            post["score"] = scores[post["id"]]
+        return posts
+
+    @withMongoExceptionsHandle(async_mode=True)
+    async def reindex_posts(self, batch_size: int = 1000) -> int:
+        """
+        Rebuild the search postings of every post. Idempotent.
+        Returns:
+            int: number of posts indexed
+        """
+        posts = self.posts_collection.find(
+            {}, {"content": 1, "tags": 1, "created_at": 1}, batch_size=batch_size
+        )
+        batch = []
+        indexed = 0
+        async for post in posts:
+            batch.append(post)
+            if len(batch) == batch_size:
+                await self._index_posts(batch, replace=True)
+                indexed += len(batch)
+                batch = []
+        await self._index_posts(batch, replace=True)
+        return indexed + len(batch)
+
+    async def _get_term_postings(
+        self, term: str, cursor: Optional[SearchCursor], limit: int
+    ) -> List[dict]:
+        match, sort = term_postings_query(term, cursor)
+        # Covered by the index: the postings themselves are not read
+        postings = self.post_terms_collection.find(
+            match, {"_id": 0, "post_id": 1, "weight": 1, "created_at": 1}
+        ).sort(sort).limit(limit)
+        return await postings.to_list(None)
+
+    async def _index_posts(self, posts: List[dict], replace: bool = False):
+        """
+        Store the search postings of the posts, one per term of their content
+        and tags, replacing the ones they had.
+        """
+        if replace and posts:
+            await self.post_terms_collection.delete_many(
+                {"post_id": {"$in": [post["_id"] for post in posts]}}
+            )
+        postings = [
+            {
+                "term": term,
+                "post_id": post["_id"],
+                "weight": weight,
+                "created_at": post["created_at"],
+            }
+            for post in posts
+            for term, weight in index_terms(
+                post.get("content"), post.get("tags")
+            ).items()
+        ]
+        await self._insert_ignoring_duplicates(self.post_terms_collection, postings)
+
+    async def _bump_tags(self, tags: Optional[List[str]], field: str,
+                         at: datetime):
+        if not tags:
+            return
+        hour = at.strftime(HOUR_BUCKET_FORMAT)
+        buckets_ids = sorted({f"hour:{hour}:{tag.lower()}" for tag in tags})
+        if self.tags_counters is not None:
+            for bucket_id in buckets_ids:
+                self.tags_counters.inc(bucket_id, field, 1)
+            return
+        await self.tag_buckets_collection.bulk_write([
+            UpdateOne({"_id": bucket_id}, {"$inc": {field: 1}}, upsert=True)
+            for bucket_id in buckets_ids
+        ], ordered=False)
+
+    async def _social_user_exists(self, user_id: int) -> bool:
+        return await self.users_collection.count_documents(
+            {"_id": user_id}, limit=1
+        ) == 1
+
+    async def _insert_ignoring_duplicates(
+        self, collection, documents: List[dict]
+    ) -> int:
+        if not documents:
+            return 0
+        try:
+            result = await collection.insert_many(documents, ordered=False)
+            return len(result.inserted_ids)
+        except pymongo.errors.BulkWriteError as err:
+            # Documents already inserted violate a unique index (e.g. timeline
+            # entries or follows): ignore them, but not any other error.
+            errors = err.details.get("writeErrors", [])
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in errors):
+                raise err
+            return err.details.get("nInserted", 0)
+
+
+def posts_page_pipeline(filters: PostFilters) -> List[dict]:
+    """
+    Pipeline of get_posts_by. The tags and authors are matched with equality,
+    $in and $all predicates followed by a sort on (created_at, _id), so the
+    planner serves them with the (tags, created_at, _id) and (author_user_id,
+    created_at, _id) indexes without a blocking sort: an $in becomes one index
+    scan per value merged in order, and an $all scans the entries of one of
+    its tags and filters the rest.
+    """
+    pagination = filters.pagination
+    match = {}
+    tags = {}
+    if filters.tags:
+        tags["$eq"] = filters.tags
+    if filters.any_tags:
+        tags["$in"] = filters.any_tags
+    if filters.all_tags:
+        tags["$all"] = filters.all_tags
+    if tags:
+        match["tags"] = tags
+    if filters.users:
+        match["author_user_id"] = {"$in": filters.users}
+
+    if pagination.cursor:
+        match.update(seek_after(pagination.cursor))
+        skip = 0
+    else:
+        match["created_at"] = {"$lte": pagination.time_offset}
+        skip = (pagination.page - 1) * pagination.per_page
+
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"created_at": -1, "_id": -1}},
+    ]
+    if skip:
+        pipeline.append({"$skip": skip})
+    pipeline.append({"$limit": pagination.per_page})
+    pipeline.append({"$project": feed_card_projection()})
+    return pipeline
+
+
+def seek_after(cursor: PostCursor, id_field: str = "_id") -> dict:
+    """
+    Range predicate matching the posts that come after `cursor` in
+    (created_at desc, id desc) order.
+    """
+    return {
+        "$or": [
+            {"created_at": {"$lt": cursor.created_at}},
+            {
+                "created_at": cursor.created_at,
+                id_field: {"$lt": ObjectId(cursor.id)},
+            },
+        ]
+    }
+
+
+def term_postings_query(term: str, cursor: Optional[SearchCursor] = None):
+    """
+    Filter and sort of the postings of a term in search order, (weight desc,
+    created_at desc, post_id desc), starting after the cursor if any. Served
+    by the (term, weight, created_at, post_id) index without a blocking sort.
+    """
+    match = {"term": term}
+    if cursor:
+        match["$or"] = [
+            {"weight": {"$lt": cursor.score}},
+            {"weight": cursor.score, "created_at": {"$lt": cursor.created_at}},
+            {
+                "weight": cursor.score,
+                "created_at": cursor.created_at,
+                "post_id": {"$lt": ObjectId(cursor.id)},
+            },
+        ]
+    return match, [("weight", -1), ("created_at", -1), ("post_id", -1)]
+
+
+def pulled_authors_query(followers_threshold: int) -> dict:
+    """
+    Filter of the users whose posts the feed pulls. Each branch of the $or is
+    served by its own index of "users" (followers_count and feed_pulled).
+    """
+    return {
+        "$or": [
+            {"followers_count": {"$gt": followers_threshold}},
+            {"feed_pulled": True},
+        ],
+    }
+
+
+def feed_card_projection(comments_preview: int = FEED_COMMENTS_PREVIEW) -> dict:
+    """
+    Fields of a post rendered in a feed (PostInFeedSchema), computed by the
+    server so the photo links and the comments are not sent over the wire:
+    only the first photo and the newest `comments_preview` comments.
+    """
+    projection = {
+        "author_user_id": 1,
+        "content": 1,
+        "likes_count": 1,
+        "comments_count": 1,
+        "created_at": 1,
+        "updated_at": 1,
+        "tags": 1,
+        "main_photo_link": {"$arrayElemAt": ["$photo_links", 0]},
+    }
+    if comments_preview > 0:
+        projection["comments"] = {"$slice": ["$comments", -comments_preview]}
+    return projection
@@ -1,7 +1,13 @@
 from abc import ABC, abstractmethod
+from datetime import datetime
 from typing import List, Optional
 from app.models.base import Base
-from app.schemas.Post import PostFilters
+from app.schemas.Post import (
+    CommentPagination,
+    PostFilters,
+    PostPagination,
+    SearchPagination,
+)
 
 
 class SocialRepository(ABC):
@@ -11,19 +17,46 @@ class SocialRepository(ABC):
         pass
 
     @abstractmethod
-    def add_post(self, record: Base) -> Optional[str]:
+    async def add_post(self, record: Base) -> Optional[str]:
         pass
 
     @abstractmethod
-    def get_post(self, id_received: int) -> Base:
+    async def get_post(self, id_received: int) -> Base:
         pass
 
     @abstractmethod
-    def get_posts_by(self, filters: PostFilters) -> List[Base]:
+    async def get_posts_by(self, filters: PostFilters) -> List[Base]:
         pass
 
     @abstractmethod
-    def update_post(
+    async def add_comment(self, post_id: str, comment: dict):
+        pass
+
+    @abstractmethod
+    async def delete_comment(self, post_id: str, comment_id: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def get_comments(
+        self, post_id: str, pagination: CommentPagination
+    ) -> List[dict]:
+        pass
+
+    @abstractmethod
+    async def get_liked_posts(self, user_id: int, posts_ids: List[str]) -> List[str]:
+        pass
+
+    @abstractmethod
+    async def get_likers_of(self, post_id: str, offset: int = 0,
+                            limit: int = 200) -> List[int]:
+        pass
+
+    @abstractmethod
+    async def get_posts_by_ids(self, ids: List[str]) -> List[Base]:
+        pass
+
+    @abstractmethod
+    async def update_post(
         self,
         id_post: str,
         update_post_set: str,
@@ -31,7 +64,7 @@ class SocialRepository(ABC):
         pass
 
     @abstractmethod
-    def update_user(
+    async def update_user(
         self,
         id_user: str,
         update_user_set: str,
@@ -39,25 +72,107 @@ class SocialRepository(ABC):
         pass
 
     @abstractmethod
-    def delete_post(self, id_received: str) -> int:
+    async def delete_post(self, id_received: str) -> int:
+        pass
+
+    @abstractmethod
+    async def get_subscribed_tags(self, user_id: int) -> List[str]:
+        pass
+
+    @abstractmethod
+    async def get_following_of(self, user_id: int, offset: int = 0,
+                               limit: Optional[int] = None) -> List[int]:
+        pass
+
+    @abstractmethod
+    async def get_followers_of(self, user_id: int, offset: int = 0,
+                               limit: int = 200) -> List[int]:
+        pass
+
+    @abstractmethod
+    async def count_followers_of(self, user_id: int) -> int:
+        pass
+
+    @abstractmethod
+    async def add_follow(self, follower_id: int, followee_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def remove_follow(self, follower_id: int, followee_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def get_pulled_authors(
+        self, users_ids: Optional[List[int]], followers_threshold: int
+    ) -> List[int]:
+        pass
+
+    @abstractmethod
+    async def mark_pulled_author(self, user_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def get_followed_among(
+        self, user_id: int, users_ids: List[int]
+    ) -> List[int]:
+        pass
+
+    @abstractmethod
+    async def add_social_user(self, record: Base) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    async def get_social_user(self, id_received: int) -> Base:
+        pass
+
+    @abstractmethod
+    async def like_post(self, user_id: int, post_id: str) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    async def unlike_post(self, user_id: int, post_id: str) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    async def add_to_timelines(self, owners_ids: List[int], post: Base) -> int:
+        pass
+
+    @abstractmethod
+    async def remove_from_timelines(self, post_id: str) -> int:
+        pass
+
+    @abstractmethod
+    async def backfill_timeline(
+        self, owner_id: int, authors_ids: List[int], limit: int
+    ) -> int:
+        pass
+
+    @abstractmethod
+    async def evict_from_timeline(self, owner_id: int, author_id: int) -> int:
         pass
 
     @abstractmethod
-    def get_following_of(self, user_id: int) -> List[int]:
+    async def get_timeline(
+        self, owner_id: int, pagination: PostPagination
+    ) -> List[Base]:
         pass
 
     @abstractmethod
-    def add_social_user(self, record: Base) -> Optional[int]:
+    async def get_tag_activity(self, since: datetime) -> List[dict]:
         pass
 
     @abstractmethod
-    def get_social_user(self, id_received: int) -> Base:
+    async def compact_tag_activity(
+        self, hourly_before: datetime, expire_before: datetime
+    ) -> int:
         pass
 
     @abstractmethod
-    def like_post(self, user_id: int, post_id: str) -> Optional[int]:
+    async def search_posts(
+        self, terms: List[str], pagination: SearchPagination
+    ) -> List[Base]:
         pass
 
     @abstractmethod
-    def unlike_post(self, user_id: int, post_id: str) -> Optional[int]:
+    async def reindex_posts(self) -> int:
         pass
@@ -1,5 +1,10 @@
-from pydantic import BaseModel, Field, AfterValidator, HttpUrl
+import base64
+import json
+import uuid
+from bson import ObjectId
+from pydantic import BaseModel, Field, AfterValidator, HttpUrl, TypeAdapter
 from typing import Annotated, Optional
+from app.exceptions.BadRequestException import BadRequestException
 from app.schemas.RealUser import ReducedUser
 from datetime import datetime
 
@@ -18,7 +23,7 @@ class PostCommentSchema(BaseModel):
 
 
 class CreatePostCommentSchema(BaseModel):
-    body: str
+    body: str = Field(..., max_length=512)
 
 
 class DeletePostCommentSchema(BaseModel):
@@ -67,7 +72,6 @@ class PostBaseModel(BaseModel):
 
 class PostSchema(PostBaseModel):
     photo_links: Optional[list[PhotoUrl]] = None
-    users_who_gave_like: list[int] = Field(default=[])
 
     class Config:
         arbitrary_types_allowed = True
@@ -132,12 +136,23 @@ class PostInFeedSchema(PostBaseModel):
         return cls(**dict)
 
 
+# Validates a whole page of the feed in one call into pydantic-core
+FEED_PAGE_ADAPTER = TypeAdapter(list[PostInFeedSchema])
+
+
+class PostSearchResultSchema(PostInFeedSchema):
+    # Relevance of the post for the query: the weight of the query terms in
+    # its content and tags
+    score: int
+
+
+SEARCH_PAGE_ADAPTER = TypeAdapter(list[PostSearchResultSchema])
+
+
 class PostPartialUpdateSchema(BaseModel):
     content: Optional[str] = Field(None, max_length=512)
     tags: Optional[list[TagType]] = None
     photo_links: Optional[list[PhotoUrl]] = None
-    comments: Optional[list[PostCommentSchema]] = None
-    comments_count: Optional[int] = None
 
     class Config:
         json_schema_extra = {
@@ -170,7 +185,6 @@ class GetPostSchema(BaseModel):
     photo_links: Optional[list[PhotoUrl]] = None
     likes_count: int = Field(default=0)
     liked_by_me: bool = Field(default=False)
-    users_who_gave_like: list[int] = Field(default=[])
     created_at: datetime
     updated_at: datetime
     tags: Optional[list[TagType]] = None
@@ -178,13 +192,137 @@ class GetPostSchema(BaseModel):
     comments_count: int = Field(default=0)
 
 
+class TrendingTagSchema(BaseModel):
+    tag: str
+    score: int
+    posts: int
+    likes: int
+
+
+TRENDING_TAGS_ADAPTER = TypeAdapter(list[TrendingTagSchema])
+
+
+class PostCursor(BaseModel):
+    """
+    Position of the last post of a page, sent to the clients as an opaque token.
+    The next page starts right after it in (created_at desc, _id desc) order.
+    """
+    created_at: datetime
+    id: str
+
+    def encode(self) -> str:
+        raw = json.dumps([self.created_at.isoformat(), self.id])
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    @staticmethod
+    def is_valid_id(id: str) -> bool:
+        return ObjectId.is_valid(id)
+
+    @classmethod
+    def decode(cls, token: str):
+        try:
+            padding = "=" * (-len(token) % 4)
+            created_at, id = json.loads(base64.urlsafe_b64decode(token + padding))
+            if not cls.is_valid_id(id):
+                raise ValueError(f"invalid id {id}")
+            return cls(created_at=datetime.fromisoformat(created_at), id=id)
+        except Exception:
+            raise BadRequestException("Invalid cursor")
+
+
 class PostPagination(BaseModel):
     time_offset: datetime
     page: int
     per_page: int
+    cursor: Optional[PostCursor] = None
+
+    def next_cursor(self, posts: list[PostBaseModel]) -> Optional[str]:
+        """
+        Cursor of the page that follows `posts`, or None if it was the last one.
+        """
+        if len(posts) < self.per_page:
+            return None
+        last = posts[-1]
+        return PostCursor(created_at=last.created_at, id=last.id).encode()
+
+
+class CommentCursor(PostCursor):
+    """
+    Position of the last comment of a page. The next page starts right after
+    it in (created_at desc, id desc) order.
+    """
+
+    @staticmethod
+    def is_valid_id(id: str) -> bool:
+        try:
+            uuid.UUID(id)
+            return True
+        except (TypeError, ValueError):
+            return False
+
+
+class CommentPagination(BaseModel):
+    per_page: int
+    cursor: Optional[CommentCursor] = None
+
+    def next_cursor(self, comments: list[GetPostCommentSchema]) -> Optional[str]:
+        """
+        Cursor of the page that follows `comments`, or None if it was the last one.
+        """
+        if len(comments) < self.per_page:
+            return None
+        last = comments[-1]
+        return CommentCursor(created_at=last.created_at, id=last.id).encode()
+
+
+class SearchCursor(PostCursor):
+    """
+    Position of the last post of a page of search results. The next page
+    starts right after it in (score desc, created_at desc, _id desc) order.
+    """
+    score: int
+
+    def encode(self) -> str:
+        raw = json.dumps([self.score, self.created_at.isoformat(), self.id])
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    @classmethod
+    def decode(cls, token: str):
+        try:
+            padding = "=" * (-len(token) % 4)
+            score, created_at, id = json.loads(
+                base64.urlsafe_b64decode(token + padding)
+            )
+            if not cls.is_valid_id(id):
+                raise ValueError(f"invalid id {id}")
+            return cls(
+                score=score, created_at=datetime.fromisoformat(created_at), id=id
+            )
+        except Exception:
+            raise BadRequestException("Invalid cursor")
+
+
+class SearchPagination(BaseModel):
+    per_page: int
+    cursor: Optional[SearchCursor] = None
+
+    def next_cursor(self, posts: list[PostSearchResultSchema]) -> Optional[str]:
+        """
+        Cursor of the page that follows `posts`, or None if it was the last one.
+        """
+        if len(posts) < self.per_page:
+            return None
+        last = posts[-1]
+        return SearchCursor(
+            score=last.score, created_at=last.created_at, id=last.id
+        ).encode()
 
 
 class PostFilters(BaseModel):
     pagination: PostPagination
     users: Optional[list[int]] = None
     tags: Optional[str] = Field(..., min_length=2, max_length=128)
+    # Posts with any of these tags
+    any_tags: Optional[list[str]] = None
+    # Posts with all of these tags
+    all_tags: Optional[list[str]] = None
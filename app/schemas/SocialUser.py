@@ -11,6 +11,8 @@ class SocialUserSchema(BaseModel):
     id: int = Field(..., alias="_id")
     followers: list[int] = []
     following: list[int] = []
+    following_count: int = 0
+    followers_count: int = 0
     tags: list[str] = []
 
     class Config:
@@ -32,6 +34,4 @@ class FollowUserSchema(BaseModel):
 
 
 class UserPartialUpdateSchema(BaseModel):
-    followers: Optional[list[int]] = None
-    following: Optional[list[int]] = None
     tags: Optional[list[str]] = None
@@ -1,35 +1,78 @@
-from typing import Annotated
+import hashlib
+import time
+from typing import Annotated, Optional
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi import Request, Depends, HTTPException, status
-from jose import JWTError, jwt
+from jose import jwt
 from pydantic import BaseModel
 from os import environ
+from app.utils.cache import MISSING, TTLCache
 
 JWT_SECRET = environ.get("JWT_SECRET")
 HASH_ALGORITHM = environ.get("HASH_ALGORITHM")
 TOKEN_FIELD_NAME = "x-access-token"
 
+# Claims of the tokens already verified, keyed by the hash of the token.
+# An entry expires at the `exp` of its token, or after the ttl if sooner.
+CLAIMS_CACHE = TTLCache(
+    "jwt_claims",
+    maxsize=int(environ.get("JWT_CACHE_MAX_SIZE", 10000)),
+    ttl=float(environ.get("JWT_CACHE_TTL", 300)),
+)
+
+
+def decode_claims(jwtoken: str) -> Optional[dict]:
+    """
+    Verify a token and return its claims, or None if it is not valid.
+    Clients send the same token on many requests, so the claims of the valid
+    ones are cached until the token expires.
+    """
+    key = hashlib.sha256(jwtoken.encode()).digest()
+    claims = CLAIMS_CACHE.get(key)
+    if claims is not MISSING:
+        return claims
+
+    try:
+        claims = jwt.decode(jwtoken, JWT_SECRET, algorithms=[HASH_ALGORITHM])
+    except Exception:
+        return None
+    if not claims:
+        return None
+
+    ttl = CLAIMS_CACHE.ttl
+    if isinstance(claims.get("exp"), (int, float)):
+        ttl = min(ttl, claims["exp"] - time.time())
+    if ttl > 0:
+        CLAIMS_CACHE.set(key, claims, expires_at=CLAIMS_CACHE.clock() + ttl)
+    return claims
+
 
 class JWTBearer(HTTPBearer):
     def __init__(self, auto_error: bool = True):
         super().__init__(auto_error=auto_error)
 
-    async def __call__(self, request: Request):
+    async def __call__(self, request: Request) -> dict:
+        """
+        Returns:
+            dict: the verified claims of the token
+        """
         try:
             credentials: HTTPAuthorizationCredentials = await super().__call__(request)
-            if credentials.scheme != "Bearer" or not self.verify_jwt(
-                credentials.credentials
-            ):
+            claims = None
+            if credentials.scheme == "Bearer":
+                claims = decode_claims(credentials.credentials)
+            if claims is None:
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="(Bearer) Invalid scheme or token.",
                 )
-            return credentials.credentials
+            return claims
 
         except Exception:
             access_token = request.headers.get(TOKEN_FIELD_NAME)
-            if access_token and self.verify_jwt(access_token):
-                return access_token
+            claims = decode_claims(access_token) if access_token else None
+            if claims is not None:
+                return claims
 
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -37,33 +80,25 @@ class JWTBearer(HTTPBearer):
             )
 
     def verify_jwt(self, jwtoken: str) -> bool:
-        isTokenValid: bool = False
-
-        try:
-            payload = jwt.decode(jwtoken, JWT_SECRET, algorithms=HASH_ALGORITHM)
-        except Exception:
-            payload = None
-        if payload:
-            isTokenValid = True
-        return isTokenValid
+        return decode_claims(jwtoken) is not None
 
 
 class TokenData(BaseModel):
     user_id: int | None = None
 
 
-async def get_current_user_id(token: Annotated[dict, Depends(JWTBearer())]):
+async def get_current_user_id(claims: Annotated[dict, Depends(JWTBearer())]):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    # The token was already verified (once) by JWTBearer
     try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[HASH_ALGORITHM])
-        user_id: int = payload.get("user_id")
+        user_id: int = claims.get("user_id")
         if user_id is None:
             raise credentials_exception
         token_data = TokenData(user_id=user_id)
-    except JWTError:
+    except ValueError:
         raise credentials_exception
     return token_data.user_id
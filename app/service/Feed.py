@@ -0,0 +1,224 @@
+import asyncio
+import heapq
+import logging
+from os import environ
+from typing import List, Tuple
+from bson import ObjectId
+from app.models.Post import Post
+from app.repository.SocialRepository import SocialRepository
+from app.schemas.Post import PostFilters, PostPagination
+from app.utils.cache import TTLCache
+from app.utils.metrics import REGISTRY
+
+logger = logging.getLogger("app")
+logger.setLevel("DEBUG")
+
+# Authors with more followers than this are not pushed to the timelines of
+# their followers when they post: their posts are pulled when the feed is read.
+FEED_PULL_FOLLOWERS_THRESHOLD = int(
+    environ.get("FEED_PULL_FOLLOWERS_THRESHOLD", 10000)
+)
+
+# Posts of a user copied to the timeline of someone who starts following them.
+TIMELINE_BACKFILL_LIMIT = int(environ.get("TIMELINE_BACKFILL_LIMIT", 200))
+
+# Seconds the set of pulled authors is served from memory before being read
+# again. Authors pulled by another instance of the service may take this long
+# to be merged into the feed.
+FEED_PULLED_AUTHORS_REFRESH_SECONDS = float(
+    environ.get("FEED_PULLED_AUTHORS_REFRESH_SECONDS", 60)
+)
+
+FEED_PAGE_AUTHORS = REGISTRY.histogram(
+    "social_feed_page_authors",
+    "Authors contributing posts to a feed page, by how their posts were delivered",
+    ["delivery"],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100),
+)
+FEED_PAGES = REGISTRY.counter(
+    "social_feed_pages_total",
+    "Feed pages served, by whether pulled authors had to be merged in",
+    ["mode"],
+)
+
+
+class HybridFeed:
+    """
+    Home feed that mixes fan-out on write and fan-out on read:
+    - posts of regular authors are pushed to the timelines of their followers
+      when they are created, so reading them is a single range scan.
+    - posts of authors with more than `pull_threshold` followers are only
+      pushed to the timeline of their author, and are pulled at read time
+      from the posts collection.
+    Both streams are merged by (created_at, id), so the cursors of the feed
+    keep working across them.
+
+    An author that crosses the threshold keeps its older posts in the
+    timelines of its followers; merging removes the duplicates. It is marked
+    as pulled and stays so even if it drops below the threshold again.
+    """
+
+    def __init__(
+        self,
+        repository: SocialRepository,
+        pull_threshold: int = FEED_PULL_FOLLOWERS_THRESHOLD,
+        backfill_limit: int = TIMELINE_BACKFILL_LIMIT,
+        pulled_refresh_seconds: float = FEED_PULLED_AUTHORS_REFRESH_SECONDS,
+    ):
+        self.repository = repository
+        self.pull_threshold = pull_threshold
+        self.backfill_limit = backfill_limit
+        self.pulled_authors = TTLCache(
+            "feed_pulled_authors", 4, pulled_refresh_seconds
+        )
+
+    async def fan_out(self, post: Post):
+        """
+        Push a new post to the timeline of its author and, unless the author
+        is pulled, to the timelines of its followers.
+        """
+        author_id = post["author_user_id"]
+        owners_ids = [author_id]
+        if await self._is_pushed(author_id):
+            owners_ids += await self.repository.get_followers_of(author_id, 0, None)
+        await self.repository.add_to_timelines(owners_ids, post)
+
+    async def follow(self, user_id: int, followed_id: int):
+        if await self._is_pushed(followed_id):
+            await self.repository.backfill_timeline(
+                user_id, [followed_id], self.backfill_limit
+            )
+
+    async def unfollow(self, user_id: int, unfollowed_id: int):
+        await self.repository.evict_from_timeline(user_id, unfollowed_id)
+
+    async def rebuild(self, user_id: int) -> int:
+        """
+        Fill the timeline of a user with its latest posts and the ones of the
+        pushed authors it follows.
+        """
+        following = await self.repository.get_following_of(user_id)
+        pulled = set(await self.repository.get_pulled_authors(
+            following, self.pull_threshold
+        ))
+        authors_ids = [user_id] + [id for id in following if id not in pulled]
+        return await self.repository.backfill_timeline(
+            user_id, authors_ids, self.backfill_limit
+        )
+
+    async def get_page(self, user_id: int, pagination: PostPagination) -> List[Post]:
+        # Not the whole following of the user: only which of the (few) pulled
+        # authors it follows
+        pulled_authors = await self.repository.get_followed_among(
+            user_id, await self._get_pulled_authors()
+        )
+        if not pulled_authors:
+            page = await self.repository.get_timeline(user_id, pagination)
+            self._record_page(page, set(), "push")
+            return page
+
+        stream_pagination, offset = paginate_streams(pagination)
+        pushed, pulled = await asyncio.gather(
+            self.repository.get_timeline(user_id, stream_pagination),
+            self.repository.get_posts_by(PostFilters(
+                pagination=stream_pagination, users=pulled_authors, tags=None
+            )),
+        )
+        merged = merge_posts(pushed, pulled)
+        page = merged[offset:offset + pagination.per_page]
+        self._record_page(page, {post["id"] for post in pushed}, "hybrid")
+        return page
+
+    async def get_for_you_page(
+        self, user_id: int, pagination: PostPagination
+    ) -> List[Post]:
+        """
+        The home feed merged with the posts tagged with any of the tags the
+        user subscribed to, without duplicates. The tagged posts are read
+        from the (tags, created_at, _id) index, one range scan per tag merged
+        by the server, in the same order and with the same cursors as the
+        home feed.
+        """
+        stream_pagination, offset = paginate_streams(pagination)
+
+        async def get_tagged():
+            tags = await self.repository.get_subscribed_tags(user_id)
+            if not tags:
+                return []
+            return await self.repository.get_posts_by(PostFilters(
+                pagination=stream_pagination, tags=None, any_tags=tags
+            ))
+
+        followed, tagged = await asyncio.gather(
+            self.get_page(user_id, stream_pagination), get_tagged()
+        )
+        return merge_posts(followed, tagged)[offset:offset + pagination.per_page]
+
+    async def _is_pushed(self, author_id: int) -> bool:
+        if not await self.repository.get_pulled_authors(
+            [author_id], self.pull_threshold
+        ):
+            return True
+        # Once pulled, always pulled: its posts from now on are only pushed to
+        # its own timeline, so they would be missing from the feeds of its
+        # followers if it went back to being pushed
+        if await self.repository.mark_pulled_author(author_id):
+            self.pulled_authors.invalidate()
+        return False
+
+    async def _get_pulled_authors(self) -> List[int]:
+        return await self.pulled_authors.get_or_load(
+            self.pull_threshold,
+            lambda: self.repository.get_pulled_authors(None, self.pull_threshold),
+        )
+
+    def _record_page(self, page: List[Post], pushed_ids: set, mode: str):
+        pushed_authors = set()
+        pulled_authors = set()
+        for post in page:
+            if mode == "push" or post["id"] in pushed_ids:
+                pushed_authors.add(post["author_user_id"])
+            else:
+                pulled_authors.add(post["author_user_id"])
+
+        FEED_PAGES.labels(mode).inc()
+        FEED_PAGE_AUTHORS.labels("push").observe(len(pushed_authors))
+        FEED_PAGE_AUTHORS.labels("pull").observe(len(pulled_authors))
+        logger.debug(f"[FEED PAGE]: {len(page)} posts, "
+                     f"{len(pushed_authors)} pushed authors, "
+                     f"{len(pulled_authors)} pulled authors")
+
+
+def paginate_streams(pagination: PostPagination) -> Tuple[PostPagination, int]:
+    """
+    Pagination to read each of the streams merged into a page, and the offset
+    of the page in the merged stream. With a cursor, every stream is read
+    right after it. Without one, the page offset only makes sense on the
+    merged stream, so every stream is read from the start up to that page.
+    """
+    if pagination.cursor:
+        return pagination, 0
+    offset = (pagination.page - 1) * pagination.per_page
+    return PostPagination(
+        time_offset=pagination.time_offset,
+        page=1,
+        per_page=offset + pagination.per_page,
+    ), offset
+
+
+def merge_posts(*streams: List[Post]) -> List[Post]:
+    """
+    Merge streams of posts sorted by (created_at desc, id desc) into one,
+    skipping the posts already seen in a previous stream.
+    """
+    merged = []
+    seen = set()
+    for post in heapq.merge(
+        *streams,
+        key=lambda post: (post["created_at"], ObjectId(post["id"])),
+        reverse=True,
+    ):
+        if post["id"] not in seen:
+            seen.add(post["id"])
+            merged.append(post)
+    return merged
@@ -1,11 +1,17 @@
+import asyncio
 from datetime import datetime
 import logging
 import uuid
 from typing import List, Optional, Dict, Any
+from pydantic import TypeAdapter
 from app.models.Post import Post
 from app.repository.SocialRepository import SocialRepository
-from app.external.Users import UserService
+from app.external.Users import UserLoader, UserService
+from app.service.Feed import HybridFeed
+from app.service.Trending import TrendingTags
 from app.schemas.Post import (
+    FEED_PAGE_ADAPTER,
+    CommentPagination,
     GetPostCommentSchema,
     GetPostSchema,
     PostCommentSchema,
@@ -15,6 +21,11 @@ from app.schemas.Post import (
     PostPagination,
     PostSchema,
     PostPartialUpdateSchema,
+    PostSearchResultSchema,
+    SEARCH_PAGE_ADAPTER,
+    SearchPagination,
+    TRENDING_TAGS_ADAPTER,
+    TrendingTagSchema,
 )
 from app.exceptions.NotFoundException import ItemNotFound
 from app.schemas.SocialUser import (
@@ -27,6 +38,7 @@ from app.schemas.SocialUser import (
 from app.exceptions.BadRequestException import BadRequestException
 from app.models.SocialUser import SocialUser
 from app.schemas.RealUser import GetUserSchema, ReducedUser
+from app.utils.text_search import query_terms
 
 logger = logging.getLogger("app")
 logger.setLevel("DEBUG")
@@ -36,6 +48,8 @@ class SocialService:
 
     def __init__(self, social_repository: SocialRepository):
         self.social_repository = social_repository
+        self.feed = HybridFeed(social_repository)
+        self.trending = TrendingTags(social_repository)
 
     async def create_post(self, input_post: PostCreateSchema) -> PostSchema:
         get_user: GetUserSchema = await UserService.get_user(
@@ -44,27 +58,36 @@ class SocialService:
 
         user: ReducedUser = ReducedUser.from_pydantic(get_user)
         post = Post.from_pydantic(input_post)
-        id_post = self.social_repository.add_post(post)
-        created_post = self.social_repository.get_post(id_post)
+        id_post = await self.social_repository.add_post(post)
+        created_post = await self.social_repository.get_post(id_post)
+        await self.feed.fan_out(created_post)
         print("created: ", created_post)
         map_author_user_id(user, created_post)
         print("created w user: ", created_post)
         return PostSchema.model_validate(created_post)
 
     async def get_post(self, id_post: int, user_id: int) -> PostSchema:
-        post: Post = self.social_repository.get_post(id_post)
+        post: Post = await self.social_repository.get_post(id_post)
         if post is None:
             raise ItemNotFound("Post", id_post)
 
-        get_user: GetUserSchema = await UserService.get_user(post["author_user_id"])
-        user: ReducedUser = ReducedUser.from_pydantic(get_user)
+        users, liked = await asyncio.gather(
+            UserLoader().load_many(
+                [post["author_user_id"]]
+                + [comment["author"] for comment in post["comments"]]
+            ),
+            self.social_repository.get_liked_posts(user_id, [post["id"]]),
+        )
+        users = {
+            user_id: ReducedUser.from_pydantic(user) for user_id, user in users.items()
+        }
+        user: ReducedUser = users[post["author_user_id"]]
         map_author_user_id(user, post)
-        check_if_user_liked_the_post(user_id, post)
+        post["liked_by_me"] = bool(liked)
         final_comments = []
 
         for comment in post['comments']:
-            get_user: GetUserSchema = await UserService.get_user(comment['author'])
-            author: ReducedUser = ReducedUser.from_pydantic(get_user)
+            author: ReducedUser = users[comment['author']]
             valid_comment = GetPostCommentSchema(id=comment['id'],
                                                  author=author,
                                                  content=comment['content'],
@@ -78,7 +101,6 @@ class SocialService:
                     content=post['content'],
                     likes_count=post['likes_count'],
                     liked_by_me=post['liked_by_me'],
-                    users_who_gave_like=post['users_who_gave_like'],
                     photo_links=post['photo_links'],
                     created_at=post['created_at'],
                     updated_at=post['updated_at'],
@@ -93,13 +115,15 @@ class SocialService:
         id_post: str,
         update_post_set: PostPartialUpdateSchema,
     ) -> Optional[PostSchema]:
-        self.social_repository.update_post(
+        await self.social_repository.update_post(
             id_post, update_post_set.model_dump_json(exclude_none=True)
         )
         return await self.get_post(id_post, user_id)
 
-    def delete_post(self, id_post: str):
-        row_count = self.social_repository.delete_post(id_post)
+    async def delete_post(self, id_post: str):
+        row_count = await self.social_repository.delete_post(id_post)
+        if row_count:
+            await self.social_repository.remove_from_timelines(id_post)
         return row_count
 
     async def create_social_user(
@@ -109,17 +133,19 @@ class SocialService:
             raise BadRequestException("User does not exist in the system!")
 
         user = SocialUser.from_pydantic(input_user)
-        user_id = self.social_repository.add_social_user(user)
-        crated_user = self.social_repository.get_social_user(user_id)
+        user_id = await self.social_repository.add_social_user(user)
+        crated_user = await self.social_repository.get_social_user(user_id)
 
         return SocialUserSchema.model_validate(crated_user)
 
     async def get_social_user(self, id_user: int) -> UserSchema:
-        social_user = self.social_repository.get_social_user(id_user)
+        social_user = await self.social_repository.get_social_user(id_user)
         get_user: GetUserSchema = await UserService.get_user(id_user)
         user = {'_id': id_user,
                 'following': social_user["following"],
                 'followers': social_user["followers"],
+                'following_count': social_user.get("following_count", 0),
+                'followers_count': social_user.get("followers_count", 0),
                 'tags': social_user["tags"],
                 'name': get_user.name,
                 'photo': get_user.photo,
@@ -127,111 +153,113 @@ class SocialService:
                 }
         return UserSchema.model_validate(user)
 
-    async def _update_social_user(
-        self,
-        id_user: str,
-        update_user_set: UserPartialUpdateSchema,
-    ) -> Optional[SocialUserSchema]:
-        update_user_obj = UserPartialUpdateSchema.parse_obj(update_user_set)
-        self.social_repository.update_user(
-            id_user,
-            update_user_obj.model_dump_json(exclude_none=True)
-        )
-        return await self.get_social_user(id_user)
-
     async def get_my_feed(
         self, user_id: int, pagination: PostPagination
     ) -> List[PostInFeedSchema]:
-        following = self.social_repository.get_following_of(user_id)
-        following.append(user_id)  # Add the user itself to the feed!
-        filters = PostFilters(pagination=pagination,
-                              users=following,
-                              tags=None)
-        print(f"[FILTERS]: {filters}")
-        return await self._get_all(filters, user_id)
+        """
+        The feed is read from the home timeline of the user, which is filled
+        when the posts are created and when the user follows someone, merged
+        with the posts of the popular users it follows (see HybridFeed).
+        """
+        posts = await self.feed.get_page(user_id, pagination)
+        return await self._build_feed(posts, user_id)
+
+    async def get_for_you_feed(
+        self, user_id: int, pagination: PostPagination
+    ) -> List[PostInFeedSchema]:
+        """
+        The feed of the user (see get_my_feed) plus the posts tagged with any
+        of the tags it subscribed to.
+        """
+        posts = await self.feed.get_for_you_page(user_id, pagination)
+        return await self._build_feed(posts, user_id)
+
+    async def search_posts(
+        self, query: str, pagination: SearchPagination, user_id: int
+    ) -> List[PostSearchResultSchema]:
+        posts = await self.social_repository.search_posts(
+            query_terms(query), pagination
+        )
+        return await self._build_feed(posts, user_id, SEARCH_PAGE_ADAPTER)
 
-    async def _get_all(self, filters: PostFilters, user_id: int) -> List[PostSchema]:
-        cursor = self.social_repository.get_posts_by(filters)
-        fetched_posts = []
-        users_ids_to_fetch = set()
+    async def rebuild_timeline(self, user_id: int) -> int:
+        """
+        Fill the timeline of a user with the latest posts of the users it
+        follows and its own. Used to backfill the timelines of existing users.
+        """
+        return await self.feed.rebuild(user_id)
 
-        for post in cursor:
-            author_id = post["author_user_id"]
-            users_ids_to_fetch.add(author_id)
-            fetched_posts.append(post)
+    async def _get_all(self, filters: PostFilters, user_id: int) -> List[PostSchema]:
+        posts = await self.social_repository.get_posts_by(filters)
+        return await self._build_feed(posts, user_id)
 
-        if fetched_posts == []:
+    async def _build_feed(
+        self, posts: List[Post], user_id: int, adapter: TypeAdapter = FEED_PAGE_ADAPTER
+    ) -> List[PostInFeedSchema]:
+        if not posts:
             return []
 
-        users_fetched_hash = {}
-        users_fetched_list = await UserService.get_users({
-            "ids": str(users_ids_to_fetch)[1:-1]
-            })
-
-        for user in users_fetched_list:
-            users_fetched_hash[user.id] = user
+        authors, liked = await asyncio.gather(
+            UserLoader().load_many(
+                (post["author_user_id"] for post in posts), ignore_missing=True
+            ),
+            self.social_repository.get_liked_posts(
+                user_id, [post["id"] for post in posts]
+            ),
+        )
+        liked = set(liked)
+        authors = {
+            author_id: ReducedUser.from_pydantic(author)
+            for author_id, author in authors.items()
+        }
 
-        final_posts = []
-        for post in fetched_posts:
-            author_id = post["author_user_id"]
-            get_user: GetUserSchema = await UserService.get_user(author_id)
-            user: ReducedUser = ReducedUser.from_pydantic(get_user)
-            map_author_user_id(user, post)
-            check_if_user_liked_the_post(user_id, post)
-            valid_post = PostInFeedSchema.from_post(PostSchema.model_validate(post))
-            final_posts.append(valid_post)
+        # The posts of deleted users are left out of the page
+        posts = [post for post in posts if post["author_user_id"] in authors]
+        for post in posts:
+            map_author_user_id(authors[post["author_user_id"]], post)
+            post["liked_by_me"] = post["id"] in liked
 
-        return final_posts
+        return adapter.validate_python(posts)
 
-    async def follow_social_user(self, user_id, user_to_follow_id):
+    async def follow_social_user(self, user_id, user_to_follow_id) -> bool:
+        """
+        Returns:
+            bool: False if the user was already following the other one
+        """
         if (user_id == user_to_follow_id):
             raise BadRequestException("Must follow another user")
-        following = self.social_repository.get_following_of(user_id)
         if not await UserService.user_exists(user_to_follow_id):
             raise BadRequestException("User does not exist in the system!")
-        if user_to_follow_id in following:
-            return
-        following.append(user_to_follow_id)
-        updates: UserPartialUpdateSchema = {"following":
-                                            [user_id for user_id in following]}
-        await self._update_social_user(user_id, updates)
-
-        followers = self.social_repository.get_followers_of(user_to_follow_id)
-        followers.append(user_id)
-        updates: UserPartialUpdateSchema = {"followers":
-                                            [user_id for user_id in followers]}
-        await self._update_social_user(user_to_follow_id, updates)
-
-    async def unfollow_social_user(self, user_id, user_to_unfollow_id):
+        if not await self.social_repository.add_follow(user_id, user_to_follow_id):
+            return False
+        await self.feed.follow(user_id, user_to_follow_id)
+        return True
+
+    async def unfollow_social_user(self, user_id, user_to_unfollow_id) -> bool:
+        """
+        Returns:
+            bool: False if the user was not following the other one
+        """
         if (user_id == user_to_unfollow_id):
             raise BadRequestException("Must unfollow another user")
-        following = self.social_repository.get_following_of(user_id)
         if not await UserService.user_exists(user_to_unfollow_id):
             raise BadRequestException("User does not exist in the system!")
-        if user_to_unfollow_id not in following:
-            return
-        following.remove(user_to_unfollow_id)
-        updates: UserPartialUpdateSchema = {"following":
-                                            [user_id for user_id in following]}
-        await self._update_social_user(user_id, updates)
-
-        followers = self.social_repository.get_followers_of(user_to_unfollow_id)
-        if user_id not in followers:
-            return
-        followers.remove(user_id)
-        updates: UserPartialUpdateSchema = {"followers":
-                                            [user_id for user_id in followers]}
-        await self._update_social_user(user_to_unfollow_id, updates)
+        if not await self.social_repository.remove_follow(
+            user_id, user_to_unfollow_id
+        ):
+            return False
+        await self.feed.unfollow(user_id, user_to_unfollow_id)
+        return True
 
     async def subscribe_to_tag(self,
                                user_id,
                                tag_schema: TagSchema) -> Optional[int]:
-        social_user = self.social_repository.get_social_user(user_id)
+        social_user = await self.social_repository.get_social_user(user_id)
         tags = social_user["tags"]
         if tag_schema.tag in tags:
             return None
         tags.append(tag_schema.tag.lower())
-        return self.social_repository.update_user(
+        return await self.social_repository.update_user(
             user_id,
             UserPartialUpdateSchema(tags=tags).model_dump_json(
                 exclude_none=True
@@ -241,12 +269,12 @@ class SocialService:
     async def unsubscribe_to_tag(self,
                                  user_id,
                                  tag_schema: TagSchema) -> Optional[int]:
-        social_user = self.social_repository.get_social_user(user_id)
+        social_user = await self.social_repository.get_social_user(user_id)
         tags = social_user["tags"]
         if tag_schema.tag not in tags:
             return None
         tags.remove(tag_schema.tag.lower())
-        return self.social_repository.update_user(
+        return await self.social_repository.update_user(
             user_id,
             UserPartialUpdateSchema(tags=tags).model_dump_json(
                 exclude_none=True
@@ -254,59 +282,84 @@ class SocialService:
         )
 
     async def get_subscribed_tags(self, user_id) -> List[str]:
-        social_user = self.social_repository.get_social_user(user_id)
-        return social_user["tags"]
+        return await self.social_repository.get_subscribed_tags(user_id)
+
+    async def get_trending_tags(
+        self, limit: int, window_hours: int
+    ) -> List[TrendingTagSchema]:
+        tags = await self.trending.top(limit, window_hours)
+        return TRENDING_TAGS_ADAPTER.validate_python(tags)
 
     async def like_post(self,
                         user_id: int,
                         post_id: str) -> Optional[int]:
-        return self.social_repository.like_post(user_id, post_id)
+        return await self.social_repository.like_post(user_id, post_id)
 
     async def unlike_post(self,
                           user_id: int,
                           post_id: str) -> Optional[int]:
-        return self.social_repository.unlike_post(user_id, post_id)
+        return await self.social_repository.unlike_post(user_id, post_id)
+
+    async def get_post_likers(self, post_id: str,
+                              query_params: Dict[str, Any]) -> List[UserSchema]:
+        """
+        Get a page of the users that liked a post, most recent likes first.
+        """
+        likers = await self.social_repository.get_likers_of(
+            post_id, query_params.get('offset'), query_params.get('limit')
+        )
+        users = await UserLoader().load_many(likers, ignore_missing=True)
+        return [
+            UserSchema(
+                _id=user.id,
+                name=user.name,
+                photo=user.photo,
+                nickname=user.nickname
+            ) for user in users.values()
+        ]
 
     async def comment_post(self, post_id, author_id, comment_body) -> PostCommentSchema:
-        post: Post = self.social_repository.get_post(post_id)
-        if post is None:
-            raise ItemNotFound("Post", post_id)
-
-        comment: PostCommentSchema = {
+        # Validated before being stored: an invalid comment embedded in the
+        # post would break every read of it
+        comment = PostCommentSchema.model_validate({
             "id": str(uuid.uuid4()),
             "author": author_id,
             "content": comment_body,
             "created_at": datetime.now()
-        }
-        comments = post["comments"]
-        comments.append(comment)
-        comments_count = post["comments_count"] + 1
-        updates = PostPartialUpdateSchema(comments=comments,
-                                          comments_count=comments_count)
-        await self.update_post(author_id, post_id, updates)
-        return PostCommentSchema.model_validate(comment)
+        })
+        await self.social_repository.add_comment(post_id, comment.model_dump())
+        return comment
 
     async def delete_post_comment(self, user_id, post_id, comment_id) -> str:
-        post: Post = self.social_repository.get_post(post_id)
-        if post is None:
-            raise ItemNotFound("Post", post_id)
-
-        comment = find_comment_by_id(post, comment_id)
-
-        if comment is None:
+        if not await self.social_repository.delete_comment(post_id, comment_id):
             return None
-
-        comments = post["comments"]
-        for comment in comments:
-            if comment["id"] == comment_id:
-                comments.remove(comment)
-
-        comments_count = post["comments_count"] - 1
-        updates = PostPartialUpdateSchema(comments=comments,
-                                          comments_count=comments_count)
-        await self.update_post(user_id, post_id, updates)
         return comment_id
 
+    async def get_post_comments(
+        self, post_id: str, pagination: CommentPagination
+    ) -> List[GetPostCommentSchema]:
+        """
+        Get a page of the comments of a post, most recent first. The post
+        itself only includes its newest comments.
+        """
+        comments = await self.social_repository.get_comments(post_id, pagination)
+        authors = await UserLoader().load_many(
+            comment["author"] for comment in comments
+        )
+        authors = {
+            author_id: ReducedUser.from_pydantic(author)
+            for author_id, author in authors.items()
+        }
+        return [
+            GetPostCommentSchema(
+                id=comment["id"],
+                author=authors[comment["author"]],
+                content=comment["content"],
+                created_at=comment["created_at"],
+            )
+            for comment in comments
+        ]
+
     async def get_user_followers(self,
                                  query_params: Dict[str, Any]) -> List[UserSchema]:
         offset = query_params.get('offset')
@@ -317,21 +370,22 @@ class SocialService:
         if not user_id:
             raise BadRequestException("User ID is required")
 
-        followers = self.social_repository.get_followers_of(user_id, offset, limit)
+        followers = await self.social_repository.get_followers_of(
+            user_id, offset, limit
+        )
         if not followers:
             return []
 
-        user_query_params = {
-            'ids': ','.join(map(str, followers)),
-            'offset': offset,
-            'limit': limit
-        }
-
-        filtered_followers = await UserService.get_users(user_query_params)
+        # The page of followers is already cut by the repository
+        loaded = await UserLoader().load_many(followers, ignore_missing=True)
+        filtered_followers = list(loaded.values())
 
         if nickname:
-            user_query_params['nickname'] = nickname
-            del user_query_params['ids']
+            user_query_params = {
+                'offset': offset,
+                'limit': limit,
+                'nickname': nickname
+            }
             filtered_by_nickname = await UserService.get_users(user_query_params)
 
             ids_filtered_followers = {follower.id for follower in filtered_followers}
@@ -377,19 +431,6 @@ class SocialService:
         ]
 
 
-def find_comment_by_id(post: Post, comment_id: str) -> Optional[PostCommentSchema]:
-    for comment in post["comments"]:
-        if comment["id"] == comment_id:
-            return comment
-    return None
-
-
 def map_author_user_id(user, created_post):
     created_post["author"] = user
     created_post.pop("author_user_id")
-
-
-def check_if_user_liked_the_post(user_id: int, created_post: Post):
-    created_post["liked_by_me"] = any(
-        map(lambda id: id == user_id, created_post["users_who_gave_like"])
-    )
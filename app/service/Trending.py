@@ -0,0 +1,100 @@
+import heapq
+import logging
+from datetime import datetime, timedelta
+from os import environ
+from typing import Callable, List, Optional
+from app.repository.SocialRepository import SocialRepository
+from app.utils.cache import TTLCache
+
+logger = logging.getLogger("app")
+logger.setLevel("DEBUG")
+
+# Window of the trending tags when none is asked for, and the longest one.
+# Tag activity older than the longest window is deleted.
+TRENDING_WINDOW_HOURS = int(environ.get("TRENDING_WINDOW_HOURS", 168))
+TRENDING_MAX_WINDOW_HOURS = int(environ.get("TRENDING_MAX_WINDOW_HOURS", 720))
+
+# Seconds each ranking is served from memory before being computed again.
+TRENDING_REFRESH_SECONDS = float(environ.get("TRENDING_REFRESH_SECONDS", 60))
+
+# Hourly tag buckets older than this are rolled into daily buckets. Windows
+# longer than this count their first day whole.
+TRENDING_HOURLY_RETENTION_HOURS = int(
+    environ.get("TRENDING_HOURLY_RETENTION_HOURS", 48)
+)
+
+# Tags kept in each ranking: the most a request can ask for.
+TRENDING_MAX_TAGS = 100
+
+# A post with the tag weighs as much as this many likes of posts with it.
+POST_WEIGHT = 3
+LIKE_WEIGHT = 1
+
+COMPACT_INTERVAL = timedelta(hours=1)
+
+
+class TrendingTags:
+    """
+    Most active tags of the last hours, by the posts and likes counted in
+    the tag buckets of the repository (see SocialMongoDB.get_tag_activity).
+
+    The top TRENDING_MAX_TAGS of each window are kept in memory for
+    `refresh_seconds`; the request that finds them expired computes them
+    again (once, however many requests are waiting) and, at most every hour,
+    compacts the old buckets first.
+    """
+
+    def __init__(
+        self,
+        repository: SocialRepository,
+        refresh_seconds: float = TRENDING_REFRESH_SECONDS,
+        hourly_retention_hours: int = TRENDING_HOURLY_RETENTION_HOURS,
+        max_window_hours: int = TRENDING_MAX_WINDOW_HOURS,
+        clock: Callable[[], datetime] = datetime.now,
+    ):
+        self.repository = repository
+        self.hourly_retention = timedelta(hours=hourly_retention_hours)
+        self.max_window = timedelta(hours=max_window_hours)
+        self.clock = clock
+        self.rankings = TTLCache("trending_tags", 32, refresh_seconds)
+        self._compacted_at: Optional[datetime] = None
+
+    async def top(self, limit: int, window_hours: int) -> List[dict]:
+        ranking = await self.rankings.get_or_load(
+            window_hours, lambda: self._rank(window_hours)
+        )
+        return ranking[:limit]
+
+    async def compact(self) -> int:
+        """
+        Roll the hourly buckets older than the hourly retention into daily
+        ones, and delete the buckets older than the longest window.
+        Returns:
+            int: number of hourly buckets compacted
+        """
+        now = self.clock()
+        compacted = await self.repository.compact_tag_activity(
+            now - self.hourly_retention, now - self.max_window - timedelta(days=1)
+        )
+        self._compacted_at = now
+        return compacted
+
+    async def _rank(self, window_hours: int) -> List[dict]:
+        now = self.clock()
+        if self._compacted_at is None or now - self._compacted_at >= COMPACT_INTERVAL:
+            try:
+                await self.compact()
+            except Exception as err:
+                # Ranking does not need it: try again on the next refresh
+                logger.error(f"[TRENDING]: could not compact the tag buckets: {err}")
+
+        activity = await self.repository.get_tag_activity(
+            now - timedelta(hours=window_hours)
+        )
+        for tag in activity:
+            tag["score"] = tag["posts"] * POST_WEIGHT + tag["likes"] * LIKE_WEIGHT
+        # Ties are ranked alphabetically
+        activity.sort(key=lambda tag: tag["tag"])
+        return heapq.nlargest(
+            TRENDING_MAX_TAGS, activity, key=lambda tag: tag["score"]
+        )
@@ -0,0 +1,137 @@
+from asyncio import create_task, gather, sleep
+import pytest
+
+from app.utils.cache import MISSING, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_given_expired_entry_when_get_then_return_missing():
+    # Given
+    clock = FakeClock()
+    cache = TTLCache("test", maxsize=10, ttl=5, clock=clock)
+    cache.set("key", "value")
+
+    # When
+    clock.now = 4.9
+    before_expiring = cache.get("key")
+    clock.now = 5
+    after_expiring = cache.get("key")
+
+    # Then
+    assert before_expiring == "value"
+    assert after_expiring is MISSING
+    assert len(cache) == 0
+
+
+def test_given_entry_with_own_expiration_when_get_then_expire_at_it():
+    # Given
+    clock = FakeClock()
+    cache = TTLCache("test", maxsize=10, ttl=5, clock=clock)
+    cache.set("key", "value", expires_at=1)
+
+    # When
+    clock.now = 1
+
+    # Then
+    assert cache.get("key") is MISSING
+
+
+def test_given_full_cache_when_set_then_evict_least_recently_used():
+    # Given
+    cache = TTLCache("test", maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+
+    # When
+    cache.set("c", 3)
+
+    # Then
+    assert cache.get("a") == 1
+    assert cache.get("b") is MISSING
+    assert cache.get("c") == 3
+
+
+@pytest.mark.asyncio
+async def test_given_concurrent_misses_when_get_or_load_then_load_once():
+    # Given
+    cache = TTLCache("test", maxsize=10, ttl=60)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await sleep(0.01)
+        return "value"
+
+    # When
+    values = await gather(*[cache.get_or_load("key", loader) for _ in range(20)])
+
+    # Then
+    assert values == ["value"] * 20
+    assert len(calls) == 1
+    assert cache.get("key") == "value"
+
+
+@pytest.mark.asyncio
+async def test_given_failing_loader_when_get_or_load_then_do_not_cache_the_error():
+    # Given
+    cache = TTLCache("test", maxsize=10, ttl=60)
+
+    async def failing_loader():
+        raise ValueError("boom")
+
+    async def loader():
+        return "value"
+
+    # When
+    results = await gather(
+        cache.get_or_load("key", failing_loader),
+        cache.get_or_load("key", failing_loader),
+        return_exceptions=True,
+    )
+
+    # Then
+    assert all(isinstance(result, ValueError) for result in results)
+    assert await cache.get_or_load("key", loader) == "value"
+
+
+@pytest.mark.asyncio
+async def test_given_entry_invalidated_while_loading_when_loaded_then_do_not_cache_it():
+    # Given
+    cache = TTLCache("test", maxsize=10, ttl=60)
+
+    async def loader():
+        await sleep(0.01)
+        return "stale"
+
+    # When
+    load = create_task(cache.get_or_load("key", loader))
+    await sleep(0)
+    cache.invalidate("key")
+    value = await load
+
+    # Then
+    assert value == "stale"
+    assert cache.get("key") is MISSING
+
+
+def test_given_hits_and_misses_when_stats_then_report_hit_ratio():
+    # Given
+    cache = TTLCache("stats_test", maxsize=10, ttl=60)
+    cache.set("key", "value")
+
+    # When
+    cache.get("key")
+    cache.get("key")
+    cache.get("other")
+    cache.get("other")
+
+    # Then
+    assert cache.stats() == {"size": 1, "hits": 2, "misses": 2, "hit_ratio": 0.5}
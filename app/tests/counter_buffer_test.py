@@ -0,0 +1,135 @@
+from asyncio import sleep
+from unittest.mock import AsyncMock
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from app.repository.CounterBuffer import COUNTER_WRITES_SAVED, CounterBuffer
+
+
+async def posts_with_counters(*ids):
+    collection = AsyncMongoMockClient()["social_service"]["posts"]
+    await collection.insert_many([{"_id": id, "likes_count": 0} for id in ids])
+    return collection
+
+
+async def likes_count(collection, id):
+    return (await collection.find_one({"_id": id}))["likes_count"]
+
+
+@pytest.mark.asyncio
+async def test_given_many_increments_when_flush_then_write_each_document_once():
+    # Given
+    collection = await posts_with_counters(1, 2, 3)
+    buffer = CounterBuffer(collection, flush_interval=60, max_events=10000)
+    saved_before = COUNTER_WRITES_SAVED.labels("posts").value
+    bulk_write = AsyncMock(wraps=collection.bulk_write)
+    collection.bulk_write = bulk_write
+
+    # When
+    for _ in range(500):
+        buffer.inc(1, "likes_count")
+    for _ in range(300):
+        buffer.inc(2, "likes_count")
+        buffer.inc(2, "likes_count", -1)
+    buffer.inc(3, "likes_count", 2)
+    written = await buffer.flush()
+
+    # Then
+    assert written == 2
+    assert bulk_write.await_count == 1
+    assert [await likes_count(collection, id) for id in (1, 2, 3)] == [500, 0, 2]
+    assert COUNTER_WRITES_SAVED.labels("posts").value == saved_before + 1101 - 2
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_given_max_events_pending_when_inc_then_flush_without_waiting():
+    # Given
+    collection = await posts_with_counters(1)
+    buffer = CounterBuffer(collection, flush_interval=60, max_events=10)
+
+    # When
+    for _ in range(10):
+        buffer.inc(1, "likes_count")
+    await sleep(0.01)
+
+    # Then
+    assert await likes_count(collection, 1) == 10
+    assert buffer.pending(1, "likes_count") == 0
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_given_pending_increments_when_interval_elapses_then_flush_them():
+    # Given
+    collection = await posts_with_counters(1)
+    buffer = CounterBuffer(collection, flush_interval=0.01, max_events=10000)
+
+    # When
+    buffer.inc(1, "likes_count")
+    before_flush = await likes_count(collection, 1)
+    await sleep(0.05)
+
+    # Then
+    assert before_flush == 0
+    assert await likes_count(collection, 1) == 1
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_given_pending_increments_when_close_then_flush_them():
+    # Given
+    collection = await posts_with_counters(1)
+    buffer = CounterBuffer(collection, flush_interval=60, max_events=10000)
+    buffer.inc(1, "likes_count", 3)
+
+    # When
+    await buffer.close()
+
+    # Then
+    assert await likes_count(collection, 1) == 3
+
+
+@pytest.mark.asyncio
+async def test_given_failing_flush_when_flush_again_then_keep_the_increments():
+    # Given
+    collection = await posts_with_counters(1)
+    buffer = CounterBuffer(collection, flush_interval=60, max_events=10000)
+    bulk_write = collection.bulk_write
+    collection.bulk_write = AsyncMock(side_effect=RuntimeError("down"))
+    buffer.inc(1, "likes_count", 2)
+
+    # When
+    with pytest.raises(RuntimeError):
+        await buffer.flush()
+    buffer.inc(1, "likes_count")
+    collection.bulk_write = bulk_write
+    await buffer.flush()
+
+    # Then
+    assert await likes_count(collection, 1) == 3
+    await buffer.close()
+
+
+@pytest.mark.asyncio
+async def test_given_failing_flush_on_max_events_when_inc_then_log_and_keep_them(
+    caplog,
+):
+    # Given
+    collection = await posts_with_counters(1)
+    buffer = CounterBuffer(collection, flush_interval=60, max_events=3)
+    bulk_write = collection.bulk_write
+    collection.bulk_write = AsyncMock(side_effect=RuntimeError("down"))
+
+    # When
+    for _ in range(3):
+        buffer.inc(1, "likes_count")
+    await sleep(0.01)
+
+    # Then
+    assert buffer._flushing.done() and buffer._flushing.exception() is None
+    assert "could not flush posts" in caplog.text
+    assert buffer.pending(1, "likes_count") == 3
+    collection.bulk_write = bulk_write
+    await buffer.close()
+    assert await likes_count(collection, 1) == 3
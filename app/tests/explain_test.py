@@ -0,0 +1,217 @@
+from datetime import datetime, timedelta
+from os import environ
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.repository.MongoIndexes import MongoIndexManager
+from app.repository.SocialMongo import (
+    posts_page_pipeline, pulled_authors_query, term_postings_query
+)
+from app.schemas.Post import PostFilters, PostPagination, SearchCursor
+from app.utils.text_search import index_terms
+
+# mongomock has no query planner: these tests need a real MongoDB, e.g.
+# MONGO_URL=mongodb://localhost:27017 poetry run pytest app/tests/explain_test.py
+pytestmark = pytest.mark.skipif(
+    not environ.get("MONGO_URL"), reason="needs a MongoDB server in MONGO_URL"
+)
+
+DATABASE = "social_service_explain_test"
+COMMON_TAGS = ["plantas", "jardin", "huerta"]
+
+
+async def seed_posts(posts: int = 5000):
+    """
+    Posts where the tags and authors filtered by are selective, as in
+    production, so the planner can tell the indexes apart.
+    """
+    client = AsyncIOMotorClient(environ["MONGO_URL"])
+    await client.drop_database(DATABASE)
+    database = client[DATABASE]
+    await MongoIndexManager(database).ensure_indexes()
+    now = datetime.now()
+    await database["posts"].insert_many([
+        {
+            "author_user_id": index % 500 + 1,
+            "content": f"Post {index}",
+            "likes_count": 0,
+            "created_at": now - timedelta(minutes=index),
+            "updated_at": now - timedelta(minutes=index),
+            "tags": [COMMON_TAGS[index % 3]]
+            + (["rosas"] if index % 50 == 0 else [])
+            + (["cactus"] if index % 70 == 0 else []),
+            "photo_links": [],
+            "comments": [],
+            "comments_count": 0,
+        }
+        for index in range(posts)
+    ])
+    postings = []
+    async for post in database["posts"].find():
+        postings += [
+            {
+                "term": term,
+                "post_id": post["_id"],
+                "weight": weight,
+                "created_at": post["created_at"],
+            }
+            for term, weight in index_terms(post["content"], post["tags"]).items()
+        ]
+    await database["post_terms"].insert_many(postings)
+    return client, database
+
+
+async def explain_term_search(database, search) -> dict:
+    term, cursor = search
+    match, sort = term_postings_query(term, cursor)
+    return await database.command({
+        "explain": {
+            "find": "post_terms",
+            "filter": match,
+            "sort": dict(sort),
+            "limit": 30,
+        },
+        "verbosity": "queryPlanner",
+    })
+
+
+async def explain(database, filters: PostFilters) -> dict:
+    return await database.command({
+        "explain": {
+            "aggregate": "posts",
+            "pipeline": posts_page_pipeline(filters),
+            "cursor": {},
+        },
+        "verbosity": "queryPlanner",
+    })
+
+
+def winning_plans(explained) -> list:
+    """
+    The winning plans of an explain output, wherever the server version puts
+    them (at the top level, in the $cursor stage, by shard...).
+    """
+    plans = []
+    if isinstance(explained, dict):
+        for key, value in explained.items():
+            if key == "winningPlan":
+                plans.append(value)
+            else:
+                plans += winning_plans(value)
+    elif isinstance(explained, list):
+        for item in explained:
+            plans += winning_plans(item)
+    return plans
+
+
+def plan_stages(plan) -> list:
+    """
+    (stage, index name) of every stage of a plan.
+    """
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append((plan["stage"], plan.get("indexName")))
+        for value in plan.values():
+            stages += plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages += plan_stages(item)
+    return stages
+
+
+def make_filters(**kwargs) -> PostFilters:
+    pagination = PostPagination(time_offset=datetime.now(), page=1, per_page=30)
+    return PostFilters(pagination=pagination, **{"tags": None, **kwargs})
+
+
+async def assert_served_by_index(filters, index_name: str, explain=explain):
+    client, database = await seed_posts()
+    try:
+        plans = winning_plans(await explain(database, filters))
+    finally:
+        await client.drop_database(DATABASE)
+        client.close()
+
+    stages = [stage for plan in plans for stage in plan_stages(plan)]
+    names = [name for name, _ in stages]
+    assert plans
+    assert "COLLSCAN" not in names
+    # A blocking sort would read every matching post before the first page
+    assert "SORT" not in names
+    assert ("IXSCAN", index_name) in stages
+
+
+@pytest.mark.asyncio
+async def test_given_one_tag_when_explain_posts_page_then_scan_the_tags_index():
+    await assert_served_by_index(make_filters(tags="rosas"), "tags_created_at_id")
+
+
+@pytest.mark.asyncio
+async def test_given_any_tags_when_explain_posts_page_then_merge_tags_index_scans():
+    await assert_served_by_index(
+        make_filters(any_tags=["rosas", "cactus"]), "tags_created_at_id"
+    )
+
+
+@pytest.mark.asyncio
+async def test_given_all_tags_when_explain_posts_page_then_scan_the_tags_index():
+    await assert_served_by_index(
+        make_filters(all_tags=["rosas", "cactus"]), "tags_created_at_id"
+    )
+
+
+@pytest.mark.asyncio
+async def test_given_authors_when_explain_posts_page_then_scan_the_authors_index():
+    await assert_served_by_index(
+        make_filters(users=[7, 8, 9]), "author_user_id_created_at_id"
+    )
+
+
+@pytest.mark.asyncio
+async def test_given_term_when_explain_search_then_scan_the_term_index_in_order():
+    await assert_served_by_index(
+        ("rosas", None), "term_weight_created_at_post_id", explain=explain_term_search
+    )
+
+
+@pytest.mark.asyncio
+async def test_given_term_and_cursor_when_explain_search_then_scan_the_term_index():
+    cursor = SearchCursor(
+        score=1, created_at=datetime.now(), id="6650b3a2e4b0f2a1c3d4e5f6"
+    )
+    await assert_served_by_index(
+        ("rosas", cursor), "term_weight_created_at_post_id",
+        explain=explain_term_search,
+    )
+
+
+@pytest.mark.asyncio
+async def test_given_threshold_when_explain_pulled_authors_then_scan_users_indexes():
+    # Given
+    client = AsyncIOMotorClient(environ["MONGO_URL"])
+    await client.drop_database(DATABASE)
+    database = client[DATABASE]
+    await MongoIndexManager(database).ensure_indexes()
+    await database["users"].insert_many([
+        {"_id": user_id, "tags": [], "followers_count": user_id % 100}
+        | ({"feed_pulled": True} if user_id % 1000 == 0 else {})
+        for user_id in range(1, 5001)
+    ])
+
+    # When
+    try:
+        plans = winning_plans(await database.command({
+            "explain": {"find": "users", "filter": pulled_authors_query(98)},
+            "verbosity": "queryPlanner",
+        }))
+    finally:
+        await client.drop_database(DATABASE)
+        client.close()
+
+    # Then
+    stages = [stage for plan in plans for stage in plan_stages(plan)]
+    assert plans
+    assert "COLLSCAN" not in [name for name, _ in stages]
+    assert ("IXSCAN", "followers_count") in stages
+    assert ("IXSCAN", "feed_pulled") in stages
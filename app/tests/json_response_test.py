@@ -0,0 +1,41 @@
+from datetime import datetime
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.schemas.Post import GetPostCommentSchema, PostInFeedSchema
+from app.schemas.RealUser import ReducedUser
+from app.schemas.SocialUser import UserSchema
+from app.utils.json_response import PydanticJSONResponse
+
+
+def test_given_feed_page_when_render_then_same_body_as_jsonable_encoder():
+    # Given
+    author = ReducedUser(id=1, name="John Doe", photo=None, nickname="johndoe")
+    page = [
+        PostInFeedSchema(
+            id=str(i),
+            author=author,
+            content="Hello ñandú",
+            likes_count=i,
+            liked_by_me=bool(i % 2),
+            created_at=datetime(2024, 5, 1, 10, i, 0, 123456),
+            updated_at=datetime(2024, 5, 1, 10, i),
+            tags=["petunias"],
+            comments=[{"id": "c", "author": 5, "content": "hi",
+                       "created_at": datetime(2024, 5, 1)}],
+            comments_count=1,
+            main_photo_link="https://example.com/photo.jpg",
+        )
+        for i in range(3)
+    ]
+    comments = [
+        GetPostCommentSchema(id="c", author=author, content="hi",
+                             created_at=datetime(2024, 5, 1))
+    ]
+
+    # When / Then
+    for content in (page, comments, [], UserSchema(_id=3, name="Lisa",
+                                                   photo=None, nickname=None)):
+        assert PydanticJSONResponse(content=content).body == JSONResponse(
+            content=jsonable_encoder(content)
+        ).body
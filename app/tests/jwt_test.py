@@ -0,0 +1,84 @@
+import asyncio
+import time
+from unittest.mock import patch
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+from starlette.requests import Request
+
+from app.security import JWTBearer as security
+from app.security.JWTBearer import (
+    CLAIMS_CACHE,
+    JWTBearer,
+    decode_claims,
+    get_current_user_id,
+)
+
+SECRET = "secret"
+
+
+@pytest.fixture(autouse=True)
+def jwt_settings(monkeypatch):
+    monkeypatch.setattr(security, "JWT_SECRET", SECRET)
+    monkeypatch.setattr(security, "HASH_ALGORITHM", "HS256")
+    CLAIMS_CACHE.invalidate()
+    yield
+    CLAIMS_CACHE.invalidate()
+
+
+def make_token(user_id=1, expires_in=3600):
+    claims = {"user_id": user_id, "exp": int(time.time()) + expires_in}
+    return jwt.encode(claims, SECRET, algorithm="HS256")
+
+
+def make_request(token):
+    headers = [(b"authorization", f"Bearer {token}".encode())]
+    return Request({"type": "http", "headers": headers})
+
+
+@pytest.mark.asyncio
+async def test_given_a_token_when_authenticating_many_requests_then_decode_once():
+    # Given
+    token = make_token(user_id=7)
+    hits_before = CLAIMS_CACHE.stats()["hits"]
+
+    # When
+    with patch.object(security.jwt, "decode", wraps=jwt.decode) as decode:
+        user_ids = [
+            await get_current_user_id(await JWTBearer()(make_request(token)))
+            for _ in range(5)
+        ]
+
+    # Then
+    assert user_ids == [7] * 5
+    assert decode.call_count == 1
+    assert CLAIMS_CACHE.stats()["hits"] == hits_before + 4
+
+
+@pytest.mark.asyncio
+async def test_given_an_invalid_token_when_authenticating_then_unauthorized():
+    # Given
+    token = make_token()[:-2] + "xx"
+
+    # When
+    with pytest.raises(HTTPException) as error:
+        await JWTBearer()(make_request(token))
+
+    # Then
+    assert error.value.status_code == 401
+    assert len(CLAIMS_CACHE) == 0
+
+
+@pytest.mark.asyncio
+async def test_given_a_cached_token_when_it_expires_then_evict_it():
+    # Given
+    token = make_token(expires_in=1)
+
+    # When
+    with patch.object(security.jwt, "decode", wraps=jwt.decode) as decode:
+        decode_claims(token)
+        await asyncio.sleep(1.1)
+        decode_claims(token)
+
+    # Then
+    assert decode.call_count == 2
@@ -0,0 +1,110 @@
+import pytest
+from fastapi import FastAPI, HTTPException
+from httpx import ASGITransport, AsyncClient
+
+from app.utils.cache import TTLCache
+from app.utils.http_metrics import (
+    HTTP_REQUEST_DURATION,
+    HTTP_REQUESTS,
+    HTTPMetricsMiddleware,
+)
+from app.utils.metrics import REGISTRY, MetricsRegistry, timed_methods
+
+
+def make_app():
+    app = FastAPI()
+    app.add_middleware(HTTPMetricsMiddleware)
+
+    @app.get("/metrics_test/items/{item_id}")
+    async def get_item(item_id: int):
+        if item_id == 0:
+            raise HTTPException(status_code=404)
+        return {"id": item_id}
+
+    return app
+
+
+def test_given_histogram_when_exposition_then_render_cumulative_buckets():
+    # Given
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency", ["route"],
+                                   buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3):
+        histogram.labels("/posts").observe(value)
+
+    # When
+    exposition = registry.exposition()
+
+    # Then
+    assert exposition.splitlines() == [
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/posts",le="0.1"} 1.0',
+        'latency_seconds_bucket{route="/posts",le="1.0"} 3.0',
+        'latency_seconds_bucket{route="/posts",le="+Inf"} 4.0',
+        'latency_seconds_sum{route="/posts"} 4.25',
+        'latency_seconds_count{route="/posts"} 4.0',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_given_requests_when_handled_then_count_them_by_route_template():
+    # Given
+    route = "/metrics_test/items/{item_id}"
+    client = AsyncClient(transport=ASGITransport(make_app()), base_url="http://test")
+
+    # When
+    async with client:
+        for item_id in (1, 2, 0):
+            await client.get(f"/metrics_test/items/{item_id}")
+        await client.get("/metrics_test/unknown")
+
+    # Then
+    assert HTTP_REQUESTS.labels("GET", route, 200).value == 2
+    assert HTTP_REQUESTS.labels("GET", route, 404).value == 1
+    assert HTTP_REQUEST_DURATION.labels("GET", route).count == 3
+    assert ("GET", "/metrics_test/items/1", "200") not in dict(
+        HTTP_REQUESTS.children()
+    )
+    assert HTTP_REQUESTS.labels("GET", "unmatched", 404).value >= 1
+
+
+@pytest.mark.asyncio
+async def test_given_timed_class_when_methods_run_then_time_them_and_count_errors():
+    # Given
+    registry = MetricsRegistry()
+    duration = registry.histogram("duration_seconds", "Duration", ["method"])
+    errors = registry.counter("errors_total", "Errors", ["method"])
+
+    @timed_methods(duration, errors)
+    class Repository:
+        async def find(self):
+            return 1
+
+        async def fail(self):
+            raise RuntimeError("down")
+
+    # When
+    await Repository().find()
+    with pytest.raises(RuntimeError):
+        await Repository().fail()
+
+    # Then
+    assert duration.labels("find").count == 1
+    assert duration.labels("fail").count == 1
+    assert errors.labels("find").value == 0
+    assert errors.labels("fail").value == 1
+
+
+def test_given_cache_lookups_when_exposition_then_expose_hit_ratio():
+    # Given
+    cache = TTLCache("metrics_test", maxsize=10, ttl=60)
+    cache.set(1, "one")
+
+    # When
+    for key in (1, 1, 1, 2):
+        cache.get(key)
+    exposition = REGISTRY.exposition()
+
+    # Then
+    assert 'social_cache_hit_ratio{cache="metrics_test"} 0.75' in exposition
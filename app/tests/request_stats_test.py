@@ -0,0 +1,107 @@
+import logging
+from datetime import timedelta
+import pytest
+from fastapi import FastAPI
+from httpx import ASGITransport, AsyncClient
+from pymongo.monitoring import CommandStartedEvent, CommandSucceededEvent
+
+from app.repository.CommandMonitor import CommandMonitor, filter_shape
+from app.utils.request_stats import (
+    BudgetExceeded,
+    RequestStatsMiddleware,
+    query_budget,
+    record_users_call,
+    track_request,
+)
+
+CONNECTION = ("localhost", 27017)
+
+
+def run_command(monitor, request_id, command, milliseconds=1):
+    monitor.started(CommandStartedEvent(
+        command, "social_service", request_id, CONNECTION, request_id
+    ))
+    monitor.succeeded(CommandSucceededEvent(
+        timedelta(milliseconds=milliseconds), {"ok": 1}, next(iter(command)),
+        request_id, CONNECTION, request_id
+    ))
+
+
+def test_given_commands_in_a_request_when_they_finish_then_attribute_them_to_it():
+    # Given
+    monitor = CommandMonitor(slow_command_ms=100)
+
+    # When
+    with track_request("GET /social/posts") as stats:
+        run_command(monitor, 1, {"find": "posts", "filter": {}}, milliseconds=3)
+        run_command(monitor, 2, {"find": "likes", "filter": {}}, milliseconds=2)
+    run_command(monitor, 3, {"find": "posts", "filter": {}})
+
+    # Then
+    assert [(name, collection) for name, collection, _ in stats.mongo_commands] \
+        == [("find", "posts"), ("find", "likes")]
+    assert stats.mongo_time == pytest.approx(0.005)
+
+
+def test_given_slow_command_when_it_finishes_then_log_its_filter_shape(caplog):
+    # Given
+    monitor = CommandMonitor(slow_command_ms=10)
+    command = {
+        "find": "posts",
+        "filter": {"author_user_id": {"$in": [1, 2, 3]}, "tags": "rosas"},
+        "sort": {"created_at": -1},
+    }
+
+    # When
+    with caplog.at_level(logging.WARNING, logger="app"):
+        with track_request("GET /social/posts"):
+            run_command(monitor, 1, command, milliseconds=25)
+
+    # Then
+    assert "slow find on posts (25.0 ms) in GET /social/posts" in caplog.text
+    assert filter_shape("find", command) == {
+        "filter": {"author_user_id": {"$in": "?"}, "tags": "?"},
+        "sort": {"created_at": "?"},
+    }
+
+
+def test_given_query_budget_when_exceeded_then_fail():
+    # Given
+    monitor = CommandMonitor()
+
+    # When / Then
+    with pytest.raises(BudgetExceeded):
+        with query_budget(mongo=1, users=1):
+            run_command(monitor, 1, {"find": "posts", "filter": {}})
+            record_users_call()
+            record_users_call()
+
+    with query_budget(mongo=1, users=1) as stats:
+        run_command(monitor, 2, {"find": "posts", "filter": {}})
+        record_users_call()
+    assert len(stats.mongo_commands) == 1
+
+
+@pytest.mark.asyncio
+async def test_given_strict_budget_when_request_exceeds_it_then_fail_the_request():
+    # Given
+    app = FastAPI()
+    app.add_middleware(RequestStatsMiddleware, users_budget=2, strict=True)
+
+    @app.get("/request_stats_test/{calls}")
+    async def endpoint(calls: int):
+        for _ in range(calls):
+            record_users_call()
+        return {}
+
+    client = AsyncClient(transport=ASGITransport(app), base_url="http://test")
+
+    # When
+    async with client:
+        within_budget = await client.get("/request_stats_test/2")
+        over_budget = await client.get("/request_stats_test/3")
+
+    # Then
+    assert within_budget.status_code == 200
+    assert over_budget.status_code == 500
+    assert "3 users service calls > 2" in over_budget.json()["detail"]
@@ -1,22 +1,37 @@
-from asyncio import sleep
+from asyncio import Event, gather, sleep
 from datetime import datetime, timedelta
-from unittest.mock import AsyncMock, patch, MagicMock
+from uuid import uuid4
+from unittest.mock import AsyncMock, patch
 import pytest
 import logging
-import mongomock
+from mongomock_motor import AsyncMongoMockClient
 import re
 
 from dotenv import load_dotenv
+from bson import ObjectId
+from app.repository.CounterBuffer import CounterBuffer
 from app.repository.SocialMongo import SocialMongoDB
-from httpx import Response
+from httpx import ASGITransport, AsyncClient, MockTransport, Response
+from pydantic import ValidationError
+from app.controller.Social import SocialController
+from app.security.JWTBearer import get_current_user_id
+from app.external.Users import USERS_CACHE, UserLoader, UserService
 from app.schemas.Post import (
+    CommentCursor,
+    CommentPagination,
     PostCommentSchema,
     PostCreateSchema,
+    PostCursor,
+    PostFilters,
     PostPagination,
     PostPartialUpdateSchema,
     PostSchema,
+    SearchCursor,
+    SearchPagination,
 )
+from app.manage import migrate_follows
 from app.service.Social import SocialService
+from app.service.Feed import FEED_PAGE_AUTHORS
 from app.schemas.RealUser import ReducedUser
 from app.exceptions.InternalServerErrorException \
     import InternalServerErrorException
@@ -32,6 +47,9 @@ load_dotenv()
 logger = logging.getLogger("app")
 logger.setLevel("DEBUG")
 
+# Saved before the autouse fixture replaces it with a mock
+users_service_get = UserService.get
+
 
 async def mock_get_user_service_with_three_valid_ids(*args, **kwargs):
     response = Response(status_code=200)
@@ -123,7 +141,7 @@ def test(monkeypatch):
         mock_get_user_service_with_three_valid_ids
     )
     # Mocking MongoClient!
-    db = mongomock.MongoClient()
+    db = AsyncMongoMockClient()
 
     def fake_mongo(*args, **kwargs):
         return db
@@ -132,6 +150,8 @@ def test(monkeypatch):
         "app.repository.SocialMongo.SocialMongoDB.get_client", fake_mongo
     )
 
+    USERS_CACHE.invalidate()
+
     social_repository = SocialMongoDB()
     global social_service
     social_service = SocialService(social_repository)
@@ -334,7 +354,7 @@ async def test_given_post_id_when_delete_post_then_return_one_as_number_of_rows_
     post_id = res_create_post.id
 
     # When
-    res_delete_post = social_service.delete_post(post_id)
+    res_delete_post = await social_service.delete_post(post_id)
 
     # Then
     assert res_delete_post == 1
@@ -346,7 +366,7 @@ async def test_given_post_id_inexistent_when_delete_post_then_return_zero_as_num
     post_id_inexistent = "123c252869510e3f2d442b7e"
 
     # When
-    res_delete_post = social_service.delete_post(post_id_inexistent)
+    res_delete_post = await social_service.delete_post(post_id_inexistent)
 
     # Then
     assert res_delete_post == 0
@@ -363,6 +383,7 @@ async def test_given_user_id_exists_when_create_social_user_then_return_social_u
     # Then
     assert res_create_user.id == 1
     assert res_create_user.followers == []
+    assert res_create_user.followers_count == 0
     assert res_create_user.following == []
     assert res_create_user.tags == []
 
@@ -393,6 +414,7 @@ async def test_given_social_user_when_get_social_user_then_return_user_schema():
     # Then
     assert res_get_user.id == 1
     assert res_get_user.followers == []
+    assert res_get_user.followers_count == 0
     assert res_get_user.following == []
     assert res_get_user.tags == []
     assert res_get_user.name == "John Doe"
@@ -430,7 +452,9 @@ async def test_given_social_user_when_follow_social_user_then_follow_user():
     res_get_user_2 = await social_service.get_social_user(res_create_user_2.id)
     assert res_get_user_1.following == [5]
     assert res_get_user_1.followers == []
+    assert res_get_user_1.followers_count == 0
     assert res_get_user_2.followers == [1]
+    assert res_get_user_2.followers_count == 1
     assert res_get_user_2.following == []
 
 
@@ -453,10 +477,72 @@ async def test_given_two_social_users_when_follow_mutual_then_follow_each_other(
     res_get_user_2 = await social_service.get_social_user(res_create_user_2.id)
     assert res_get_user_1.following == [5]
     assert res_get_user_1.followers == [5]
+    assert res_get_user_1.followers_count == 1
     assert res_get_user_2.followers == [1]
+    assert res_get_user_2.followers_count == 1
     assert res_get_user_2.following == [1]
 
 
+@pytest.mark.asyncio
+async def test_given_followed_social_user_when_get_social_user_then_return_first_followers(
+    monkeypatch,
+):
+    # Given
+    followed = await social_service.create_social_user(SocialUserCreateSchema(id=5))
+    followers_ids = list(range(100, 120))
+    await social_service.social_repository.users_collection.insert_many(
+        [{"_id": follower_id, "tags": []} for follower_id in followers_ids]
+    )
+    for follower_id in followers_ids:
+        await social_service.follow_social_user(follower_id, followed.id)
+
+    monkeypatch.setattr("app.repository.SocialMongo.USER_FOLLOWS_PREVIEW", 5)
+
+    # When
+    res_get_user = await social_service.get_social_user(followed.id)
+
+    # Then
+    assert res_get_user.followers == followers_ids[:5]
+    assert res_get_user.followers_count == 20
+    assert res_get_user.following_count == 0
+
+
+@pytest.mark.asyncio
+async def test_given_followed_social_user_when_get_follows_with_limit_zero_or_less_then_return_none():
+    # Given
+    follower = await social_service.create_social_user(SocialUserCreateSchema(id=1))
+    followed = await social_service.create_social_user(SocialUserCreateSchema(id=5))
+    await social_service.follow_social_user(follower.id, followed.id)
+    repository = social_service.social_repository
+
+    # When
+    followers = [await repository.get_followers_of(followed.id, 0, limit)
+                 for limit in [0, -1]]
+    following = [await repository.get_following_of(follower.id, 0, limit)
+                 for limit in [0, -1]]
+
+    # Then
+    assert followers == [[], []]
+    assert following == [[], []]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path", ["/social/user/followers", "/social/user"])
+@pytest.mark.parametrize("limit", [0, -1, 201])
+async def test_given_out_of_range_limit_when_list_users_then_return_422(path, limit):
+    # Given
+    from app import main
+
+    # When
+    async with AsyncClient(
+        transport=ASGITransport(main.app), base_url="http://test"
+    ) as client:
+        response = await client.get(path, params={"user_id": 5, "limit": limit})
+
+    # Then
+    assert response.status_code == 422
+
+
 @pytest.mark.asyncio
 async def test_given_social_user_when_follow_itself_then_raise_bad_request_exception():
     # Given
@@ -507,7 +593,9 @@ async def test_given_social_followed_user_when_unfollow_then_unfollow_user():
     res_get_user_2 = await social_service.get_social_user(res_create_user_2.id)
     assert res_get_user_1.following == []
     assert res_get_user_1.followers == []
+    assert res_get_user_1.followers_count == 0
     assert res_get_user_2.followers == []
+    assert res_get_user_2.followers_count == 0
     assert res_get_user_2.following == []
 
 
@@ -536,7 +624,9 @@ async def test_given_social_user_mutual_followed_when_unfollow_then_unfollow_eac
     res_get_user_2 = await social_service.get_social_user(res_create_user_2.id)
     assert res_get_user_1.following == []
     assert res_get_user_1.followers == []
+    assert res_get_user_1.followers_count == 0
     assert res_get_user_2.followers == []
+    assert res_get_user_2.followers_count == 0
     assert res_get_user_2.following == []
 
 
@@ -857,6 +947,406 @@ async def test_given_user_with_posts_and_users_followed_when_get_my_feed_with_ti
     assert res_get_my_feed[1].content == "Hello world 1"
 
 
+@pytest.mark.asyncio
+async def test_given_user_with_posts_when_get_my_feed_with_cursor_then_return_next_page_without_shifting():
+    # Given
+    user = await social_service.create_social_user(SocialUserCreateSchema(id=1))
+    for i in range(3):
+        await social_service.create_post(
+            PostCreateSchema(author_user_id=user.id, content=f"Hello world {i + 1}")
+        )
+        await sleep(0.01)
+    first_page_pagination = PostPagination(
+        time_offset=datetime.now(), page=1, per_page=2
+    )
+    first_page = await social_service.get_my_feed(user.id, first_page_pagination)
+    cursor = first_page_pagination.next_cursor(first_page)
+
+    # A new post arrives between both requests
+    await social_service.create_post(
+        PostCreateSchema(author_user_id=user.id, content="Hello world 4")
+    )
+
+    # When
+    second_page_pagination = PostPagination(
+        time_offset=datetime.now(),
+        page=1,
+        per_page=2,
+        cursor=PostCursor.decode(cursor),
+    )
+    second_page = await social_service.get_my_feed(user.id, second_page_pagination)
+
+    # Then
+    assert [post.content for post in first_page] == ["Hello world 3",
+                                                     "Hello world 2"]
+    assert [post.content for post in second_page] == ["Hello world 1"]
+    assert second_page_pagination.next_cursor(second_page) is None
+
+
+@pytest.mark.asyncio
+async def test_given_posts_created_at_the_same_time_when_paginate_with_cursor_then_return_each_post_once():
+    # Given
+    same_time = datetime(2024, 5, 1, 12, 0, 0)
+    await social_service.social_repository.posts_collection.insert_many([
+        {"author_user_id": 1, "content": f"Post {i}", "likes_count": 0,
+         "users_who_gave_like": [], "created_at": same_time,
+         "updated_at": same_time, "tags": [], "photo_links": [],
+         "comments": [], "comments_count": 0}
+        for i in range(5)
+    ])
+    pagination = PostPagination(time_offset=datetime.now(), page=1, per_page=2)
+    filters = PostFilters(pagination=pagination, users=[1], tags=None)
+    seen = []
+
+    # When
+    while True:
+        page = await social_service._get_all(filters, 1)
+        seen += [post.id for post in page]
+        cursor = pagination.next_cursor(page)
+        if cursor is None:
+            break
+        pagination = PostPagination(time_offset=datetime.now(), page=1,
+                                    per_page=2, cursor=PostCursor.decode(cursor))
+        filters = PostFilters(pagination=pagination, users=[1], tags=None)
+
+    # Then
+    assert len(seen) == 5
+    assert len(set(seen)) == 5
+
+
+def test_given_invalid_cursor_when_decode_then_raise_bad_request_exception():
+    with pytest.raises(BadRequestException) as excinfo:
+        PostCursor.decode("not-a-cursor")
+
+    assert str(excinfo.value) == "400: Bad request: invalid cursor"
+
+
+@pytest.mark.asyncio
+async def test_given_user_with_posts_when_followed_then_its_posts_are_backfilled_to_the_follower_feed():
+    # Given
+    follower = await social_service.create_social_user(SocialUserCreateSchema(id=1))
+    author = await social_service.create_social_user(SocialUserCreateSchema(id=5))
+    await social_service.create_post(
+        PostCreateSchema(author_user_id=author.id, content="Before follow")
+    )
+
+    # When
+    await social_service.follow_social_user(follower.id, author.id)
+
+    # Then
+    feed = await social_service.get_my_feed(
+        follower.id,
+        PostPagination(time_offset=datetime.now(), page=1, per_page=5),
+    )
+    assert [post.content for post in feed] == ["Before follow"]
+
+
+async def create_for_you_dataset():
+    user = await social_service.create_social_user(SocialUserCreateSchema(id=1))
+    followed = await social_service.create_social_user(SocialUserCreateSchema(id=5))
+    other = await social_service.create_social_user(SocialUserCreateSchema(id=10))
+    await social_service.follow_social_user(user.id, followed.id)
+    await social_service.subscribe_to_tag(user.id, TagSchema(tag="rosas"))
+    posts = [
+        (user.id, "Own post", None),
+        (followed.id, "Followed post", None),
+        (other.id, "Tagged post", ["rosas"]),
+        (other.id, "Other tag post", ["cactus"]),
+        (followed.id, "Followed tagged post", ["rosas", "cactus"]),
+        (other.id, "Untagged post", None),
+    ]
+    for author_id, content, tags in posts:
+        await social_service.create_post(
+            PostCreateSchema(author_user_id=author_id, content=content, tags=tags)
+        )
+        await sleep(0.002)
+    return user
+
+
+@pytest.mark.asyncio
+async def test_given_followed_users_and_subscribed_tags_when_get_for_you_feed_then_return_posts_of_both_once():
+    # Given
+    user = await create_for_you_dataset()
+
+    # When
+    feed = await social_service.get_for_you_feed(
+        user.id, PostPagination(time_offset=datetime.now(), page=1, per_page=10)
+    )
+
+    # Then
+    assert [post.content for post in feed] == [
+        "Followed tagged post", "Tagged post", "Followed post", "Own post"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_given_for_you_feed_when_paginate_with_cursor_then_return_each_post_once():
+    # Given
+    user = await create_for_you_dataset()
+    pagination = PostPagination(time_offset=datetime.now(), page=1, per_page=3)
+    seen = []
+
+    # When
+    while True:
+        page = await social_service.get_for_you_feed(user.id, pagination)
+        seen += [post.content for post in page]
+        cursor = pagination.next_cursor(page)
+        if cursor is None:
+            break
+        pagination = PostPagination(time_offset=datetime.now(), page=1,
+                                    per_page=3, cursor=PostCursor.decode(cursor))
+
+    # Then
+    assert seen == [
+        "Followed tagged post", "Tagged post", "Followed post", "Own post"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_given_user_without_subscribed_tags_when_get_for_you_feed_then_return_my_feed():
+    # Given
+    user = await social_service.create_social_user(SocialUserCreateSchema(id=1))
+    other = await social_service.create_social_user(SocialUserCreateSchema(id=5))
+    await social_service.create_post(
+        PostCreateSchema(author_user_id=user.id, content="Own post", tags=["rosas"])
+    )
+    await social_service.create_post(
+        PostCreateSchema(author_user_id=other.id, content="Other post", tags=["rosas"])
+    )
+    pagination = PostPagination(time_offset=datetime.now(), page=1, per_page=10)
+
+    # When
+    for_you = await social_service.get_for_you_feed(user.id, pagination)
+
+    # Then
+    assert [post.content for post in for_you] == ["Own post"]
+
+
+async def create_tagged_posts():
+    posts = [
+        (1, "Roses", ["rosas"]),
+        (5, "Cactus", ["cactus"]),
+        (10, "Roses and cactus", ["rosas", "cactus"]),
+        (1, "Vegetables", ["huerta"]),
+    ]
+    for author_id, content, tags in posts:
+        await social_service.create_post(
+            PostCreateSchema(author_user_id=author_id, content=content, tags=tags)
+        )
+        await sleep(0.002)
+
+
+def filter_posts(**kwargs):
+    pagination = PostPagination(time_offset=datetime.now(), page=1, per_page=10)
+    return PostFilters(pagination=pagination, **{"tags": None, **kwargs})
+
+
+@pytest.mark.asyncio
+async def test_given_tagged_posts_when_get_all_with_any_tags_then_return_posts_with_any_of_them():
+    # Given
+    await create_tagged_posts()
+
+    # When
+    posts = await social_service._get_all(
+        filter_posts(any_tags=["rosas", "cactus"]), 1
+    )
+
+    # Then
+    assert [post.content for post in posts] == ["Roses and cactus", "Cactus", "Roses"]
+
+
+@pytest.mark.asyncio
+async def test_given_tagged_posts_when_get_all_with_all_tags_then_return_posts_with_every_one():
+    # Given
+    await create_tagged_posts()
+
+    # When
+    posts = await social_service._get_all(
+        filter_posts(all_tags=["rosas", "cactus"]), 1
+    )
+
+    # Then
+    assert [post.content for post in posts] == ["Roses and cactus"]
+
+
+@pytest.mark.asyncio
+async def test_given_tagged_posts_when_get_all_with_tags_and_authors_then_return_posts_matching_both():
+    # Given
+    await create_tagged_posts()
+
+    # When
+    posts = await social_service._get_all(
+        filter_posts(any_tags=["rosas", "huerta"], users=[1, 5]), 1
+    )
+
+    # Then
+    assert [post.content for post in posts] == ["Vegetables", "Roses"]
+
+
+@pytest.mark.asyncio
+async def test_given_followed_user_when_unfollowed_then_its_posts_are_evicted_from_the_feed():
+    # Given
+    follower = await social_service.create_social_user(SocialUserCreateSchema(id=1))
+    author = await social_service.create_social_user(SocialUserCreateSchema(id=5))
+    await social_service.follow_social_user(follower.id, author.id)
+    await social_service.create_post(
+        PostCreateSchema(author_user_id=follower.id, content="Mine")
+    )
+    await social_service.create_post(
+        PostCreateSchema(author_user_id=author.id, content="Followed")
+    )
+
+    # When
+    await social_service.unfollow_social_user(follower.id, author.id)
+
+    # Then
+    feed = await social_service.get_my_feed(
+        follower.id,
+        PostPagination(time_offset=datetime.now(), page=1, per_page=5),
+    )
+    assert [post.content for post in feed] == ["Mine"]
+
+
+@pytest.mark.asyncio
+async def test_given_post_in_followers_feed_when_deleted_then_it_is_removed_from_the_feed():
+    # Given
+    follower = await social_service.create_social_user(SocialUserCreateSchema(id=1))
+    author = await social_service.create_social_user(SocialUserCreateSchema(id=5))
+    await social_service.follow_social_user(follower.id, author.id)
+    post = await social_service.create_post(
+        PostCreateSchema(author_user_id=author.id, content="Followed")
+    )
+
+    # When
+    await social_service.delete_post(post.id)
+
+    # Then
+    feed = await social_service.get_my_feed(
+        follower.id,
+        PostPagination(time_offset=datetime.now(), page=1, per_page=5),
+    )
+    assert feed == []
+    assert await social_service.social_repository.timelines_collection \
+        .count_documents({}) == 0
+
+@pytest.mark.asyncio
+async def test_given_followed_popular_user_when_get_my_feed_then_its_posts_are_pulled_and_merged():
+    # Given
+    social_service.feed.pull_threshold = 0
+    follower = await social_service.create_social_user(SocialUserCreateSchema(id=1))
+    popular = await social_service.create_social_user(SocialUserCreateSchema(id=5))
+    await social_service.follow_social_user(follower.id, popular.id)
+    for author_id, content in [(follower.id, "Mine 1"), (popular.id, "Popular 1"),
+                               (follower.id, "Mine 2"), (popular.id, "Popular 2")]:
+        await social_service.create_post(
+            PostCreateSchema(author_user_id=author_id, content=content)
+        )
+        await sleep(0.01)
+    pulled_pages_before = FEED_PAGE_AUTHORS.labels("pull").count
+    pulled_authors_before = FEED_PAGE_AUTHORS.labels("pull").sum
+
+    # When
+    pagination = PostPagination(time_offset=datetime.now(), page=1, per_page=3)
+    first_page = await social_service.get_my_feed(follower.id, pagination)
+    second_page = await social_service.get_my_feed(
+        follower.id,
+        PostPagination(time_offset=datetime.now(), page=1, per_page=3,
+                       cursor=PostCursor.decode(pagination.next_cursor(first_page)))
+    )
+
+    # Then
+    assert [post.content for post in first_page] == ["Popular 2", "Mine 2",
+                                                     "Popular 1"]
+    assert [post.content for post in second_page] == ["Mine 1"]
+    assert await social_service.social_repository.timelines_collection \
+        .count_documents({"owner_id": follower.id, "author_id": popular.id}) == 0
+    assert FEED_PAGE_AUTHORS.labels("pull").count == pulled_pages_before + 2
+    assert FEED_PAGE_AUTHORS.labels("pull").sum == pulled_authors_before + 1
+
+
+@pytest.mark.asyncio
+async def test_given_user_that_became_popular_when_get_my_feed_then_posts_are_not_duplicated():
+    # Given
+    follower = await social_service.create_social_user(SocialUserCreateSchema(id=1))
+    author = await social_service.create_social_user(SocialUserCreateSchema(id=5))
+    await social_service.follow_social_user(follower.id, author.id)
+    await social_service.create_post(
+        PostCreateSchema(author_user_id=author.id, content="Pushed")
+    )
+    await sleep(0.01)
+    social_service.feed.pull_threshold = 0
+    await social_service.create_post(
+        PostCreateSchema(author_user_id=author.id, content="Pulled")
+    )
+
+    # When
+    feed = await social_service.get_my_feed(
+        follower.id,
+        PostPagination(time_offset=datetime.now(), page=1, per_page=5),
+    )
+
+    # Then
+    assert [post.content for post in feed] == ["Pulled", "Pushed"]
+
+
+@pytest.mark.asyncio
+async def test_given_followed_popular_user_when_get_my_feed_then_do_not_read_all_follows(
+    monkeypatch,
+):
+    # Given
+    social_service.feed.pull_threshold = 0
+    follower = await social_service.create_social_user(SocialUserCreateSchema(id=1))
+    popular = await social_service.create_social_user(SocialUserCreateSchema(id=5))
+    await social_service.follow_social_user(follower.id, popular.id)
+    await social_service.create_post(
+        PostCreateSchema(author_user_id=popular.id, content="Popular")
+    )
+    get_following_of = AsyncMock(side_effect=AssertionError("full scan"))
+    monkeypatch.setattr(social_service.social_repository, "get_following_of",
+                        get_following_of)
+
+    # When
+    feed = await social_service.get_my_feed(
+        follower.id,
+        PostPagination(time_offset=datetime.now(), page=1, per_page=5),
+    )
+
+    # Then
+    assert [post.content for post in feed] == ["Popular"]
+    get_following_of.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_given_user_no_longer_popular_when_get_my_feed_then_its_pulled_posts_are_kept():
+    # Given
+    social_service.feed.pull_threshold = 1
+    follower = await social_service.create_social_user(SocialUserCreateSchema(id=1))
+    other_follower = await social_service.create_social_user(
+        SocialUserCreateSchema(id=10)
+    )
+    author = await social_service.create_social_user(SocialUserCreateSchema(id=5))
+    await social_service.follow_social_user(follower.id, author.id)
+    await social_service.follow_social_user(other_follower.id, author.id)
+    await social_service.create_post(
+        PostCreateSchema(author_user_id=author.id, content="While popular")
+    )
+    await sleep(0.01)
+    await social_service.unfollow_social_user(other_follower.id, author.id)
+    await social_service.create_post(
+        PostCreateSchema(author_user_id=author.id, content="After")
+    )
+
+    # When
+    feed = await social_service.get_my_feed(
+        follower.id,
+        PostPagination(time_offset=datetime.now(), page=1, per_page=5),
+    )
+
+    # Then
+    assert [post.content for post in feed] == ["After", "While popular"]
+    assert await social_service.social_repository.timelines_collection \
+        .count_documents({"owner_id": follower.id, "author_id": author.id}) == 0
+
 @pytest.mark.asyncio
 async def test_given_social_user_when_subscribe_to_tag_then_subscribe_to_tag():
     # Given
@@ -962,7 +1452,8 @@ async def test_given_post_when_user_like_it_then_post_is_updated():
     # Then
     assert post.liked_by_me
     assert post.likes_count == 1
-    assert post.users_who_gave_like.index(5) == 0
+    likers = await social_service.get_post_likers(new_post.id, {})
+    assert [user.id for user in likers] == [5]
 
 
 @pytest.mark.asyncio
@@ -984,7 +1475,43 @@ async def test_given_post_when_user_unlike_it_then_post_is_updated():
     # Then
     assert not post.liked_by_me
     assert post.likes_count == 0
-    assert len(post.users_who_gave_like) == 0
+    assert await social_service.get_post_likers(new_post.id, {}) == []
+
+
+@pytest.mark.asyncio
+async def test_given_liked_post_when_get_likers_with_limit_zero_or_less_then_return_none():
+    # Given
+    post = await social_service.create_post(
+        PostCreateSchema(author_user_id=1, content="Hello world")
+    )
+    await social_service.like_post(5, post.id)
+    await social_service.like_post(10, post.id)
+    repository = social_service.social_repository
+
+    # When
+    likers = [await repository.get_likers_of(post.id, 0, limit)
+              for limit in [0, -1]]
+
+    # Then
+    assert likers == [[], []]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("limit", [0, -1, 201])
+async def test_given_out_of_range_limit_when_get_post_likes_then_return_422(limit):
+    # Given
+    from app import main
+
+    # When
+    async with AsyncClient(
+        transport=ASGITransport(main.app), base_url="http://test"
+    ) as client:
+        response = await client.get(
+            "/social/posts/6626f2f2c0d5a1b2c3d4e5f6/likes", params={"limit": limit}
+        )
+
+    # Then
+    assert response.status_code == 422
 
 
 async def test_given_post_when_commented_then_increase_comment_count():
@@ -1026,6 +1553,52 @@ async def test_given_post_when_deleted_comment_then_decrease_comment_count():
     assert res_get_post.comments_count == 0
 
 
+@pytest.mark.asyncio
+async def test_given_too_long_comment_when_comment_post_then_reject_it_before_storing():
+    # Given
+    post = await social_service.create_post(
+        PostCreateSchema(author_user_id=1, content="Hello world")
+    )
+
+    # When
+    with pytest.raises(ValidationError):
+        await social_service.comment_post(post.id, 1, "x" * 513)
+
+    # Then
+    res_get_post: PostSchema = await social_service.get_post(post.id, 1)
+    assert res_get_post.comments_count == 0
+    assert res_get_post.comments == []
+
+
+@pytest.mark.asyncio
+async def test_given_too_long_comment_when_post_it_then_return_422_and_keep_post_readable(
+    monkeypatch,
+):
+    # Given
+    from app import main
+    monkeypatch.setattr(main, "social_controller", SocialController(social_service))
+    main.app.dependency_overrides[get_current_user_id] = lambda: 1
+    post = await social_service.create_post(
+        PostCreateSchema(author_user_id=1, content="Hello world")
+    )
+
+    # When
+    try:
+        async with AsyncClient(
+            transport=ASGITransport(main.app), base_url="http://test"
+        ) as client:
+            response = await client.post(
+                f"/social/posts/{post.id}/comments", json={"body": "x" * 513}
+            )
+    finally:
+        main.app.dependency_overrides.clear()
+
+    # Then
+    assert response.status_code == 422
+    res_get_post: PostSchema = await social_service.get_post(post.id, 1)
+    assert res_get_post.comments_count == 0
+
+
 @pytest.mark.asyncio
 async def test_get_user_followers_with_no_query(monkeypatch):
     # Given
@@ -1040,12 +1613,12 @@ async def test_get_user_followers_with_no_query(monkeypatch):
                             photo="photo2.jpg",
                             nickname="jane")
 
-    mock_get_followers_of = MagicMock(return_value=followers_ids)
+    mock_get_followers_of = AsyncMock(return_value=followers_ids)
     monkeypatch.setattr(social_service.social_repository,
                         "get_followers_of",
                         mock_get_followers_of)
 
-    with patch("app.external.Users.UserService.get_users", new=AsyncMock(
+    with patch("app.external.Users.UserService.get_users_by_ids", new=AsyncMock(
         return_value=[follower_1, follower_2])
     ):
         # When
@@ -1064,7 +1637,7 @@ async def test_get_user_followers_returning_empty(monkeypatch):
     # Given
     user_id = 1
 
-    mock_get_followers_of = MagicMock(return_value=[])
+    mock_get_followers_of = AsyncMock(return_value=[])
     monkeypatch.setattr(social_service.social_repository,
                         "get_followers_of",
                         mock_get_followers_of)
@@ -1105,3 +1678,872 @@ async def test_given_social_user_when_get_tags_then_return_user_subscriptions():
     # Then
     print(response)
     assert response == ["tag1"]
+
+
+@pytest.mark.asyncio
+async def test_given_user_with_posts_when_get_my_feed_concurrently_then_all_requests_return_posts():
+    # Given
+    user = await social_service.create_social_user(SocialUserCreateSchema(id=1))
+    await social_service.create_post(
+        PostCreateSchema(author_user_id=user.id, content="Hello world 1")
+    )
+    await sleep(0.1)
+    await social_service.create_post(
+        PostCreateSchema(author_user_id=user.id, content="Hello world 2")
+    )
+
+    # When
+    feeds = await gather(*[
+        social_service.get_my_feed(
+            user.id,
+            PostPagination(time_offset=datetime.now(), page=1, per_page=20),
+        )
+        for _ in range(100)
+    ])
+
+    # Then
+    assert len(feeds) == 100
+    for feed in feeds:
+        assert [post.content for post in feed] == ["Hello world 2", "Hello world 1"]
+
+
+@pytest.mark.asyncio
+async def test_given_empty_database_when_ensure_indexes_then_declared_indexes_exist():
+    # Given
+    repository = social_service.social_repository
+    drift = await repository.detect_index_drift()
+    assert "author_user_id_created_at_id" in drift.missing["posts"]
+    assert drift.has_drift()
+
+    # When
+    await repository.ensure_indexes()
+    await repository.ensure_indexes()
+
+    # Then
+    drift = await repository.detect_index_drift()
+    assert not drift.has_drift()
+    assert drift.missing["posts"] == []
+    assert drift.undeclared["posts"] == []
+    assert drift.unused is None
+
+
+@pytest.mark.asyncio
+async def test_given_undeclared_index_when_detect_index_drift_then_report_it():
+    # Given
+    repository = social_service.social_repository
+    await repository.ensure_indexes()
+    await repository.posts_collection.create_index("content", name="content_1")
+
+    # When
+    drift = await repository.detect_index_drift()
+
+    # Then
+    assert not drift.has_drift()
+    assert drift.undeclared["posts"] == ["content_1"]
+
+
+@pytest.mark.asyncio
+async def test_given_user_service_client_when_get_many_times_then_reuse_it_until_shutdown(
+    monkeypatch
+):
+    # Given
+    monkeypatch.setattr("app.external.Users.USERS_SERVICE_URL", "http://users")
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return Response(status_code=200, json={"message": []})
+
+    client = AsyncClient(transport=MockTransport(handler))
+    UserService.client = client
+
+    # When
+    await gather(*[users_service_get("/users?ids=1") for _ in range(5)])
+
+    # Then
+    assert UserService.client is client
+    assert len(requests) == 5
+
+    # When
+    await UserService.shutdown()
+
+    # Then
+    assert UserService.client is None
+    assert client.is_closed
+
+
+@pytest.mark.asyncio
+async def test_given_cached_user_when_get_user_concurrently_then_fetch_it_once(
+    monkeypatch
+):
+    # Given
+    fetch = AsyncMock(wraps=mock_get_user_service_with_three_valid_ids)
+    monkeypatch.setattr("app.external.Users.UserService.get", fetch)
+
+    # When
+    users = await gather(*[UserService.get_user(5) for _ in range(10)])
+    await UserService.get_user(5)
+
+    # Then
+    assert fetch.await_count == 1
+    assert all(user.id == 5 for user in users)
+
+    # When
+    UserService.invalidate_user(5)
+    await UserService.get_user(5)
+
+    # Then
+    assert fetch.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_given_posts_of_many_authors_when_get_all_then_fetch_authors_once(
+    monkeypatch
+):
+    # Given
+    for author_id in [1, 5, 10, 5, 1]:
+        await social_service.create_post(
+            PostCreateSchema(author_user_id=author_id, content="Hello world")
+        )
+    USERS_CACHE.invalidate()
+    fetch = AsyncMock(wraps=mock_get_user_service_with_three_valid_ids)
+    monkeypatch.setattr("app.external.Users.UserService.get", fetch)
+    filters = PostFilters(
+        pagination=PostPagination(time_offset=datetime.now(), page=1, per_page=10),
+        users=None,
+        tags=None,
+    )
+
+    # When
+    posts = await social_service._get_all(filters, 1)
+
+    # Then
+    assert len(posts) == 5
+    assert {post.author.id for post in posts} == {1, 5, 10}
+    assert fetch.await_count == 1
+    assert fetch.await_args.args[0].startswith("/users?ids=")
+
+    # When
+    await social_service._get_all(filters, 1)
+
+    # Then
+    assert fetch.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_given_user_loader_when_load_in_same_tick_then_batch_in_chunks(
+    monkeypatch
+):
+    # Given
+    fetch = AsyncMock(wraps=mock_get_user_service_with_three_valid_ids)
+    monkeypatch.setattr("app.external.Users.UserService.get", fetch)
+    loader = UserLoader(batch_size=2)
+
+    # When
+    users = await gather(loader.load(1), loader.load(5), loader.load(10),
+                         loader.load(1))
+
+    # Then
+    assert [user.id for user in users] == [1, 5, 10, 1]
+    assert fetch.await_count == 2
+
+    # When
+    USERS_CACHE.invalidate()
+    with pytest.raises(ItemNotFound):
+        await UserLoader().load_many([1, 2])
+    USERS_CACHE.invalidate()
+    loaded = await UserLoader().load_many([1, 3], ignore_missing=True)
+
+    # Then
+    assert list(loaded) == [1]
+
+
+@pytest.mark.asyncio
+async def test_given_only_missing_users_when_load_many_then_raise_item_not_found():
+    # Given
+    USERS_CACHE.invalidate()
+
+    # When
+    with pytest.raises(ItemNotFound):
+        await UserLoader().load_many([2, 3])
+    loaded = await UserLoader().load_many([2, 3], ignore_missing=True)
+
+    # Then
+    assert loaded == {}
+
+
+@pytest.mark.asyncio
+async def test_given_failing_chunk_when_load_many_then_only_fail_its_users(
+    monkeypatch
+):
+    # Given
+    USERS_CACHE.invalidate()
+    get_users_by_ids = UserService.get_users_by_ids
+    released = Event()
+
+    async def fail_for_ten(users_ids):
+        await released.wait()
+        if 10 in users_ids:
+            raise InternalServerErrorException("User service")
+        return await get_users_by_ids(users_ids)
+
+    monkeypatch.setattr("app.external.Users.UserService.get_users_by_ids",
+                        fail_for_ten)
+    loader = UserLoader(batch_size=1)
+
+    # When
+    loads = gather(loader.load(1), loader.load(10), return_exceptions=True)
+    await sleep(0)
+    in_flight = len(loader._dispatches)
+    released.set()
+    user, error = await loads
+
+    # Then
+    assert in_flight == 1
+    assert loader._dispatches == set()
+    assert user.id == 1
+    assert isinstance(error, InternalServerErrorException)
+
+
+@pytest.mark.asyncio
+async def test_given_post_of_deleted_user_when_get_my_feed_then_leave_it_out(
+    monkeypatch
+):
+    # Given
+    follower = await social_service.create_social_user(SocialUserCreateSchema(id=1))
+    for author_id in [5, 10]:
+        await social_service.create_social_user(SocialUserCreateSchema(id=author_id))
+        await social_service.follow_social_user(follower.id, author_id)
+        await social_service.create_post(
+            PostCreateSchema(author_user_id=author_id, content=f"By {author_id}")
+        )
+    USERS_CACHE.invalidate()
+    get_users_by_ids = UserService.get_users_by_ids
+
+    async def without_ten(users_ids):
+        users = await get_users_by_ids(users_ids)
+        return [user for user in users if user.id != 10]
+
+    monkeypatch.setattr("app.external.Users.UserService.get_users_by_ids",
+                        without_ten)
+
+    # When
+    feed = await social_service.get_my_feed(
+        follower.id,
+        PostPagination(time_offset=datetime.now(), page=1, per_page=5),
+    )
+
+    # Then
+    assert [post.content for post in feed] == ["By 5"]
+
+
+@pytest.mark.asyncio
+async def test_given_many_users_when_follow_concurrently_then_no_follow_is_lost():
+    # Given
+    await social_service.social_repository.ensure_indexes()
+    followed = await social_service.create_social_user(SocialUserCreateSchema(id=5))
+    followers_ids = list(range(100, 120))
+    await social_service.social_repository.users_collection.insert_many(
+        [{"_id": follower_id, "tags": []} for follower_id in followers_ids]
+    )
+
+    # When
+    await gather(*[
+        social_service.follow_social_user(follower_id, followed.id)
+        for follower_id in followers_ids + followers_ids
+    ])
+
+    # Then
+    followers = await social_service.social_repository.get_followers_of(
+        followed.id, 0, None
+    )
+    assert sorted(followers) == followers_ids
+    assert await social_service.social_repository.count_followers_of(
+        followed.id
+    ) == 20
+
+
+@pytest.mark.asyncio
+async def test_given_users_with_embedded_follows_when_migrate_then_create_follows():
+    # Given
+    repository = social_service.social_repository
+    await repository.ensure_indexes()
+    await repository.users_collection.insert_many([
+        {"_id": 1, "following": [5, 10], "followers": [5], "tags": []},
+        {"_id": 5, "following": [1], "followers": [1], "tags": []},
+        {"_id": 10, "following": [], "followers": [1], "tags": []},
+    ])
+
+    # When
+    await migrate_follows(repository, None)
+    await migrate_follows(repository, None)
+
+    # Then
+    assert await repository.follows_collection.count_documents({}) == 3
+    assert sorted(await repository.get_following_of(1)) == [5, 10]
+    assert await repository.get_followers_of(1) == [5]
+    assert await repository.users_collection.count_documents(
+        {"following": {"$exists": True}}
+    ) == 0
+    assert await repository.count_followers_of(1) == 1
+    assert await repository.count_followers_of(10) == 1
+    assert (await repository.users_collection.find_one({"_id": 1}))[
+        "following_count"
+    ] == 2
+
+
+@pytest.mark.asyncio
+async def test_given_social_user_when_follow_and_unfollow_then_update_counters_once(
+    monkeypatch
+):
+    # Given
+    repository = social_service.social_repository
+    await repository.ensure_indexes()
+    follower = await social_service.create_social_user(SocialUserCreateSchema(id=1))
+    followed = await social_service.create_social_user(SocialUserCreateSchema(id=5))
+    USERS_CACHE.invalidate()
+    fetch = AsyncMock(wraps=mock_get_user_service_with_three_valid_ids)
+    monkeypatch.setattr("app.external.Users.UserService.get", fetch)
+
+    # When
+    followed_first = await social_service.follow_social_user(follower.id, followed.id)
+    followed_again = await social_service.follow_social_user(follower.id, followed.id)
+
+    # Then
+    assert (followed_first, followed_again) == (True, False)
+    assert fetch.await_count == 1
+    assert await repository.count_followers_of(followed.id) == 1
+    assert (await repository.users_collection.find_one({"_id": follower.id}))[
+        "following_count"
+    ] == 1
+
+    # When
+    unfollowed_first = await social_service.unfollow_social_user(
+        follower.id, followed.id
+    )
+    unfollowed_again = await social_service.unfollow_social_user(
+        follower.id, followed.id
+    )
+
+    # Then
+    assert (unfollowed_first, unfollowed_again) == (True, False)
+    assert await repository.count_followers_of(followed.id) == 0
+
+
+@pytest.mark.asyncio
+async def test_given_inexistent_social_user_when_follow_then_raise_and_keep_counters():
+    # Given
+    repository = social_service.social_repository
+    followed = await social_service.create_social_user(SocialUserCreateSchema(id=5))
+
+    # When
+    with pytest.raises(ItemNotFound):
+        await social_service.follow_social_user(1, followed.id)
+
+    # Then
+    assert await repository.follows_collection.count_documents({}) == 0
+    assert await repository.count_followers_of(followed.id) == 0
+
+
+@pytest.mark.asyncio
+async def test_given_post_when_liked_and_unliked_concurrently_then_count_matches_likes():
+    # Given
+    await social_service.social_repository.ensure_indexes()
+    new_post = await social_service.create_post(
+        PostCreateSchema(author_user_id=1, content="mock_post")
+    )
+    users_ids = list(range(100, 150))
+
+    # When
+    await gather(*[
+        operation(user_id, new_post.id)
+        for user_id in users_ids
+        for operation in (social_service.like_post, social_service.like_post,
+                          social_service.unlike_post, social_service.like_post)
+    ])
+    await gather(*[
+        social_service.unlike_post(user_id, new_post.id)
+        for user_id in users_ids[:10] * 2
+    ])
+
+    # Then
+    repository = social_service.social_repository
+    post = await repository.get_post(new_post.id)
+    assert post["likes_count"] == len(
+        await repository.get_likers_of(new_post.id, 0, None)
+    ) == 40
+    assert await social_service.like_post(users_ids[-1], new_post.id) == 0
+
+
+@pytest.mark.asyncio
+async def test_given_liked_posts_when_get_all_then_resolve_liked_by_me_in_one_query(
+    monkeypatch
+):
+    # Given
+    repository = social_service.social_repository
+    posts = [
+        await social_service.create_post(
+            PostCreateSchema(author_user_id=1, content=f"Post {i}")
+        )
+        for i in range(3)
+    ]
+    await social_service.like_post(5, posts[1].id)
+    await social_service.like_post(10, posts[2].id)
+    get_liked_posts = AsyncMock(wraps=repository.get_liked_posts)
+    monkeypatch.setattr(repository, "get_liked_posts", get_liked_posts)
+
+    # When
+    feed = await social_service._get_all(PostFilters(
+        pagination=PostPagination(time_offset=datetime.now(), page=1, per_page=10),
+        users=None,
+        tags=None,
+    ), 5)
+
+    # Then
+    assert get_liked_posts.await_count == 1
+    assert {post.id: post.liked_by_me for post in feed} == {
+        posts[0].id: False, posts[1].id: True, posts[2].id: False
+    }
+
+
+@pytest.mark.asyncio
+async def test_given_posts_with_embedded_likes_when_migrate_then_create_likes():
+    # Given
+    repository = social_service.social_repository
+    await repository.ensure_indexes()
+    result = await repository.posts_collection.insert_one({
+        "author_user_id": 1, "content": "Old post", "likes_count": 1,
+        "users_who_gave_like": [5, 10], "created_at": datetime.now(),
+        "updated_at": datetime.now(), "tags": [], "photo_links": [],
+        "comments": [], "comments_count": 0,
+    })
+    post_id = str(result.inserted_id)
+
+    # When
+    await repository.migrate_embedded_likes()
+    await repository.migrate_embedded_likes()
+
+    # Then
+    post = await repository.get_post(post_id)
+    assert "users_who_gave_like" not in post
+    assert post["likes_count"] == 2
+    assert sorted(await repository.get_likers_of(post_id)) == [5, 10]
+    assert await repository.get_liked_posts(5, [post_id]) == [post_id]
+
+
+@pytest.mark.asyncio
+async def test_given_post_with_photos_and_comments_when_get_all_then_return_feed_card():
+    # Given
+    repository = social_service.social_repository
+    comments = [
+        {"id": str(i), "author": 5, "content": f"Comment {i}",
+         "created_at": datetime.now()}
+        for i in range(5)
+    ]
+    await repository.posts_collection.insert_one({
+        "author_user_id": 1, "content": "Post", "likes_count": 0,
+        "created_at": datetime.now(), "updated_at": datetime.now(), "tags": [],
+        "photo_links": ["https://example.com/1.jpg", "https://example.com/2.jpg"],
+        "comments": comments, "comments_count": 5,
+    })
+    filters = PostFilters(
+        pagination=PostPagination(time_offset=datetime.now(), page=1, per_page=10),
+        users=None,
+        tags=None,
+    )
+
+    # When
+    cards = await repository.get_posts_by(filters)
+    feed = await social_service._get_all(filters, 1)
+
+    # Then
+    assert "photo_links" not in cards[0]
+    assert [comment["id"] for comment in cards[0]["comments"]] == ["2", "3", "4"]
+    assert feed[0].main_photo_link == "https://example.com/1.jpg"
+    assert feed[0].comments_count == 5
+    assert len(feed[0].comments) == 3
+
+
+@pytest.mark.asyncio
+async def test_given_post_with_many_comments_when_get_comments_then_paginate_them():
+    # Given
+    post = await social_service.create_post(
+        PostCreateSchema(author_user_id=1, content="Post")
+    )
+    comments = []
+    for i in range(12):
+        comments.append(await social_service.comment_post(post.id, 5, f"Comment {i}"))
+        await sleep(0.002)
+
+    # When
+    pages = []
+    pagination = CommentPagination(per_page=5)
+    while True:
+        page = await social_service.get_post_comments(post.id, pagination)
+        pages.append(page)
+        next_cursor = pagination.next_cursor(page)
+        if next_cursor is None:
+            break
+        pagination = CommentPagination(
+            per_page=5, cursor=CommentCursor.decode(next_cursor)
+        )
+
+    # Then
+    assert [len(page) for page in pages] == [5, 5, 2]
+    assert [comment.id for page in pages for comment in page] == [
+        comment.id for comment in reversed(comments)
+    ]
+    assert pages[0][0].author.id == 5
+    post_doc = await social_service.social_repository.get_post(post.id)
+    assert post_doc["comments_count"] == 12
+    assert [comment["id"] for comment in post_doc["comments"]] == [
+        comment.id for comment in comments[2:]
+    ]
+
+
+@pytest.mark.asyncio
+async def test_given_embedded_comment_when_deleted_then_refill_newest_comments():
+    # Given
+    post = await social_service.create_post(
+        PostCreateSchema(author_user_id=1, content="Post")
+    )
+    comments = []
+    for i in range(12):
+        comments.append(await social_service.comment_post(post.id, 5, f"Comment {i}"))
+        await sleep(0.002)
+
+    # When
+    deleted = await social_service.delete_post_comment(1, post.id, comments[-1].id)
+    deleted_again = await social_service.delete_post_comment(
+        1, post.id, comments[-1].id
+    )
+
+    # Then
+    assert (deleted, deleted_again) == (comments[-1].id, None)
+    post_doc = await social_service.social_repository.get_post(post.id)
+    assert post_doc["comments_count"] == 11
+    assert [comment["id"] for comment in post_doc["comments"]] == [
+        comment.id for comment in comments[1:-1]
+    ]
+    with pytest.raises(ItemNotFound):
+        await social_service.comment_post("6626f2f2c0d5a1b2c3d4e5f6", 5, "Hi")
+
+
+@pytest.mark.asyncio
+async def test_given_posts_with_embedded_comments_when_migrate_then_move_them():
+    # Given
+    repository = social_service.social_repository
+    comments = [
+        {"id": str(uuid4()), "author": 5, "content": f"Comment {i}",
+         "created_at": datetime.now() + timedelta(seconds=i)}
+        for i in range(12)
+    ]
+    result = await repository.posts_collection.insert_one({
+        "author_user_id": 1, "content": "Old post", "likes_count": 0,
+        "created_at": datetime.now(), "updated_at": datetime.now(), "tags": [],
+        "photo_links": [], "comments": comments, "comments_count": 12,
+    })
+
+    # When
+    await repository.migrate_embedded_comments()
+    await repository.migrate_embedded_comments()
+
+    # Then
+    post = await repository.get_post(str(result.inserted_id))
+    assert post["comments_count"] == 12
+    assert [comment["id"] for comment in post["comments"]] == [
+        comment["id"] for comment in comments[2:]
+    ]
+    assert await repository.comments_collection.count_documents({}) == 12
+
+
+@pytest.mark.asyncio
+async def test_given_buffered_counters_when_like_then_count_before_and_after_flush():
+    # Given
+    repository = social_service.social_repository
+    repository.posts_counters = CounterBuffer(
+        repository.posts_collection, flush_interval=60, max_events=10000
+    )
+    post = await social_service.create_post(
+        PostCreateSchema(author_user_id=1, content="Viral post")
+    )
+
+    # When
+    for user_id in range(100, 110):
+        await social_service.like_post(user_id, post.id)
+    await social_service.unlike_post(100, post.id)
+    stored = await repository.posts_collection.find_one({"_id": ObjectId(post.id)})
+
+    # Then
+    assert stored["likes_count"] == 0
+    assert (await social_service.get_post(post.id, 101)).likes_count == 9
+
+    # When
+    await repository.flush_counters()
+
+    # Then
+    stored = await repository.posts_collection.find_one({"_id": ObjectId(post.id)})
+    assert stored["likes_count"] == 9
+
+
+async def create_trending_dataset():
+    posts = [
+        ["rosas", "cactus"],
+        ["rosas"],
+        ["Cactus"],
+        ["helechos"],
+    ]
+    created = []
+    for tags in posts:
+        created.append(await social_service.create_post(
+            PostCreateSchema(author_user_id=1, content="Trending post", tags=tags)
+        ))
+    for user_id in range(100, 104):
+        await social_service.like_post(user_id, created[3].id)
+    await social_service.unlike_post(100, created[3].id)
+    return created
+
+
+@pytest.mark.asyncio
+async def test_given_posts_and_likes_when_get_trending_tags_then_rank_tags_by_activity():
+    # Given
+    await create_trending_dataset()
+
+    # When
+    trending = await social_service.get_trending_tags(limit=10, window_hours=24)
+
+    # Then
+    assert [tag.model_dump() for tag in trending] == [
+        {"tag": "helechos", "score": 7, "posts": 1, "likes": 4},
+        {"tag": "cactus", "score": 6, "posts": 2, "likes": 0},
+        {"tag": "rosas", "score": 6, "posts": 2, "likes": 0},
+    ]
+    assert [tag.tag for tag in await social_service.get_trending_tags(1, 24)] == [
+        "helechos"
+    ]
+
+
+@pytest.mark.asyncio
+async def test_given_trending_tags_ranked_when_new_activity_then_serve_ranking_until_refresh():
+    # Given
+    await create_trending_dataset()
+    await social_service.get_trending_tags(limit=10, window_hours=24)
+    repository = social_service.social_repository
+
+    # When
+    await social_service.create_post(
+        PostCreateSchema(author_user_id=1, content="New post", tags=["huerta"])
+    )
+    with patch.object(
+        repository, "get_tag_activity", wraps=repository.get_tag_activity
+    ) as get_tag_activity:
+        cached = await social_service.get_trending_tags(limit=10, window_hours=24)
+        social_service.trending.rankings.invalidate()
+        refreshed = await social_service.get_trending_tags(limit=10, window_hours=24)
+
+    # Then
+    assert "huerta" not in [tag.tag for tag in cached]
+    assert "huerta" in [tag.tag for tag in refreshed]
+    assert get_tag_activity.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_given_buffered_tag_counters_when_flush_then_count_tag_activity():
+    # Given
+    repository = social_service.social_repository
+    repository.tags_counters = CounterBuffer(
+        repository.tag_buckets_collection, flush_interval=60, max_events=10000,
+        upsert=True,
+    )
+    await create_trending_dataset()
+    assert await repository.get_tag_activity(datetime.now() - timedelta(hours=1)) == []
+
+    # When
+    await repository.flush_counters()
+
+    # Then
+    activity = await repository.get_tag_activity(datetime.now() - timedelta(hours=1))
+    assert sorted(activity, key=lambda tag: tag["tag"]) == [
+        {"tag": "cactus", "posts": 2, "likes": 0},
+        {"tag": "helechos", "posts": 1, "likes": 4},
+        {"tag": "rosas", "posts": 2, "likes": 0},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_given_old_hourly_tag_buckets_when_compact_then_roll_them_into_days():
+    # Given
+    repository = social_service.social_repository
+    await repository.tag_buckets_collection.insert_many([
+        {"_id": "hour:2026-01-10T08:rosas", "posts": 1, "likes": 2},
+        {"_id": "hour:2026-01-10T21:rosas", "posts": 2, "likes": 1},
+        {"_id": "hour:2026-01-11T03:rosas", "posts": 0, "likes": 5},
+        {"_id": "hour:2026-01-12T10:rosas", "posts": 1, "likes": 0},
+        {"_id": "day:2025-12-01:rosas", "posts": 9, "likes": 9},
+    ])
+
+    # When
+    compacted = await repository.compact_tag_activity(
+        hourly_before=datetime(2026, 1, 12), expire_before=datetime(2025, 12, 10)
+    )
+
+    # Then
+    assert compacted == 3
+    buckets = await repository.tag_buckets_collection.find().to_list(None)
+    assert sorted(buckets, key=lambda bucket: bucket["_id"]) == [
+        {"_id": "day:2026-01-10:rosas", "posts": 3, "likes": 3},
+        {"_id": "day:2026-01-11:rosas", "posts": 0, "likes": 5},
+        {"_id": "hour:2026-01-12T10:rosas", "posts": 1, "likes": 0},
+    ]
+    assert await repository.get_tag_activity(datetime(2026, 1, 11, 12)) == [
+        {"tag": "rosas", "posts": 1, "likes": 5}
+    ]
+
+
+async def create_search_dataset():
+    posts = [
+        ("Mis rosas florecieron", None),
+        ("Regué las rosas y el cactus", None),
+        ("Foto del jardín", ["rosas"]),
+        ("Un cactus enorme", ["cactus"]),
+        ("Rosas, rosas, rosas y más rosas", None),
+        ("Nada que ver", ["helechos"]),
+    ]
+    created = {}
+    for content, tags in posts:
+        post = await social_service.create_post(
+            PostCreateSchema(author_user_id=1, content=content, tags=tags)
+        )
+        created[content] = post
+        await sleep(0.002)
+    return created
+
+
+@pytest.mark.asyncio
+async def test_given_posts_when_search_one_term_then_rank_by_weight_then_recency():
+    # Given
+    await create_search_dataset()
+
+    # When
+    results = await social_service.search_posts(
+        "ROSAS", SearchPagination(per_page=10), user_id=1
+    )
+
+    # Then
+    assert [(post.content, post.score) for post in results] == [
+        ("Rosas, rosas, rosas y más rosas", 3),
+        ("Foto del jardín", 3),
+        ("Regué las rosas y el cactus", 1),
+        ("Mis rosas florecieron", 1),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_given_posts_when_search_several_terms_then_sum_their_weights():
+    # Given
+    await create_search_dataset()
+
+    # When
+    results = await social_service.search_posts(
+        "cactus rosas jardin", SearchPagination(per_page=10), user_id=1
+    )
+
+    # Then
+    assert [(post.content, post.score) for post in results] == [
+        ("Un cactus enorme", 4),
+        ("Foto del jardín", 4),
+        ("Rosas, rosas, rosas y más rosas", 3),
+        ("Regué las rosas y el cactus", 2),
+        ("Mis rosas florecieron", 1),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_given_search_results_when_paginate_with_cursor_then_return_each_post_once():
+    # Given
+    await create_search_dataset()
+
+    for query in ["rosas", "rosas cactus"]:
+        expected = await social_service.search_posts(
+            query, SearchPagination(per_page=10), user_id=1
+        )
+        pagination = SearchPagination(per_page=2)
+        pages = []
+
+        # When
+        while True:
+            page = await social_service.search_posts(query, pagination, user_id=1)
+            pages.append(page)
+            cursor = pagination.next_cursor(page)
+            if cursor is None:
+                break
+            pagination = SearchPagination(
+                per_page=2, cursor=SearchCursor.decode(cursor)
+            )
+
+        # Then
+        assert [post.id for page in pages for post in page] == [
+            post.id for post in expected
+        ]
+        assert all(len(page) <= 2 for page in pages)
+
+
+@pytest.mark.asyncio
+async def test_given_post_updated_or_deleted_when_search_then_use_its_current_content():
+    # Given
+    created = await create_search_dataset()
+
+    # When
+    await social_service.update_post(
+        1,
+        created["Un cactus enorme"].id,
+        PostPartialUpdateSchema(content="Una suculenta enorme", tags=["suculentas"]),
+    )
+    await social_service.delete_post(created["Mis rosas florecieron"].id)
+
+    # Then
+    cactus = await social_service.search_posts(
+        "cactus", SearchPagination(per_page=10), user_id=1
+    )
+    assert [post.content for post in cactus] == ["Regué las rosas y el cactus"]
+    suculentas = await social_service.search_posts(
+        "suculenta", SearchPagination(per_page=10), user_id=1
+    )
+    assert [post.content for post in suculentas] == ["Una suculenta enorme"]
+    rosas = await social_service.search_posts(
+        "rosas", SearchPagination(per_page=10), user_id=1
+    )
+    assert "Mis rosas florecieron" not in [post.content for post in rosas]
+
+
+@pytest.mark.asyncio
+async def test_given_query_of_stopwords_when_search_then_return_no_posts():
+    # Given
+    await create_search_dataset()
+
+    # When
+    results = await social_service.search_posts(
+        "y de la", SearchPagination(per_page=10), user_id=1
+    )
+
+    # Then
+    assert results == []
+
+
+@pytest.mark.asyncio
+async def test_given_posts_without_postings_when_reindex_then_find_them():
+    # Given
+    await create_search_dataset()
+    repository = social_service.social_repository
+    await repository.post_terms_collection.delete_many({})
+
+    # When
+    indexed = await repository.reindex_posts()
+    await repository.reindex_posts()
+
+    # Then
+    assert indexed == 6
+    results = await social_service.search_posts(
+        "helechos", SearchPagination(per_page=10), user_id=1
+    )
+    assert [post.content for post in results] == ["Nada que ver"]
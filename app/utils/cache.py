@@ -0,0 +1,126 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from app.utils.metrics import REGISTRY
+
+CACHE_HITS = REGISTRY.counter(
+    "social_cache_hits_total", "Lookups served from an in-process cache", ["cache"]
+)
+CACHE_MISSES = REGISTRY.counter(
+    "social_cache_misses_total",
+    "Lookups not found (or expired) in an in-process cache",
+    ["cache"],
+)
+CACHE_HIT_RATIO = REGISTRY.gauge(
+    "social_cache_hit_ratio",
+    "Fraction of the lookups of an in-process cache served from it",
+    ["cache"],
+)
+
+
+def collect_hit_ratios():
+    for (name,), hits in CACHE_HITS.children():
+        lookups = hits.value + CACHE_MISSES.labels(name).value
+        CACHE_HIT_RATIO.labels(name).set(hits.value / lookups if lookups else 0.0)
+
+
+REGISTRY.on_collect(collect_hit_ratios)
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Bounded in-process cache. Entries expire `ttl` seconds after being set
+    (or at the given `expires_at`), and the least recently used entry is
+    evicted when the cache is full.
+
+    `get_or_load` also collapses concurrent misses of the same key into a
+    single call to the loader (single-flight): the rest of the callers await
+    its result. Errors of the loader are not cached.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        ttl: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._hits = CACHE_HITS.labels(name)
+        self._misses = CACHE_MISSES.labels(name)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > self.clock():
+                self._entries.move_to_end(key)
+                self._hits.inc()
+                return value
+            del self._entries[key]
+        self._misses.inc()
+        return default
+
+    def set(self, key: Hashable, value: Any, expires_at: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        if expires_at is None:
+            expires_at = self.clock() + self.ttl
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def get_or_load(
+        self, key: Hashable, loader: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(loader())
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._on_loaded(key, done))
+        # A cancelled caller must not cancel the load the others are awaiting
+        return await asyncio.shield(future)
+
+    def invalidate(self, key: Hashable = MISSING):
+        """
+        Drop an entry, or every entry if no key is given.
+        """
+        if key is MISSING:
+            self._entries.clear()
+            self._inflight.clear()
+        else:
+            self._entries.pop(key, None)
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        hits, misses = self._hits.value, self._misses.value
+        return {
+            "size": len(self._entries),
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / (hits + misses) if hits + misses else 0.0,
+        }
+
+    def _on_loaded(self, key: Hashable, future: asyncio.Future):
+        if self._inflight.get(key) is not future:
+            # Invalidated while loading: the value may already be stale
+            return
+        del self._inflight[key]
+        if not future.cancelled() and future.exception() is None:
+            self.set(key, future.result())
@@ -0,0 +1,82 @@
+from time import perf_counter
+from typing import Dict, Tuple
+from app.utils.metrics import REGISTRY, Counter, Histogram
+
+HTTP_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "social_http_requests_total",
+    "Requests handled, by route template and status code",
+    ["method", "route", "status"],
+)
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "social_http_request_duration_seconds",
+    "Time to handle a request, by route template",
+    ["method", "route"],
+    buckets=HTTP_BUCKETS,
+)
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "social_http_requests_in_flight",
+    "Requests being handled",
+    ["method"],
+)
+
+# Label of the requests that did not match any route, so unknown paths do not
+# create new series
+UNMATCHED_ROUTE = "unmatched"
+
+
+class HTTPMetricsMiddleware:
+    """
+    ASGI middleware that counts and times every request by its route template
+    (e.g. /social/posts/{post_id}/like, never the actual path). A plain ASGI
+    middleware instead of BaseHTTPMiddleware, which runs the app in another
+    task and costs far more than the metrics themselves.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._series: Dict[Tuple[str, str, int], Tuple[Counter, Histogram]] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        method = scope["method"]
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        started_at = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = perf_counter() - started_at
+            in_flight.dec()
+            # The router leaves the matched route in the scope
+            route = scope.get("route")
+            requests, duration = self._get_series(
+                method, route.path if route is not None else UNMATCHED_ROUTE, status
+            )
+            requests.inc()
+            duration.observe(elapsed)
+
+    def _get_series(self, method: str, route: str, status: int):
+        key = (method, route, status)
+        series = self._series.get(key)
+        if series is None:
+            series = (
+                HTTP_REQUESTS.labels(method, route, status),
+                HTTP_REQUEST_DURATION.labels(method, route),
+            )
+            self._series[key] = series
+        return series
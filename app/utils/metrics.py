@@ -0,0 +1,230 @@
+import functools
+import inspect
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Metric:
+    """
+    Base of the in-process metrics. A metric with label names keeps one child
+    per combination of label values; `labels` returns (and creates) it.
+    """
+
+    type: str
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "Metric"] = {}
+        self._lock = Lock()
+
+    def labels(self, *values, **kwvalues):
+        if kwvalues:
+            values = tuple(kwvalues[name] for name in self.labelnames)
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def children(self) -> List[Tuple[Tuple[str, ...], "Metric"]]:
+        if not self.labelnames:
+            return [((), self)]
+        return list(self._children.items())
+
+    def _new_child(self) -> "Metric":
+        raise NotImplementedError
+
+    def samples(self, labels: str) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for values, child in sorted(self.children()):
+            labels = ",".join(
+                f'{name}="{escape_label(value)}"'
+                for name, value in zip(self.labelnames, values)
+            )
+            lines.extend(child.samples(labels))
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def _new_child(self):
+        return Counter(self.name, self.documentation)
+
+    def samples(self, labels: str) -> List[str]:
+        return [sample(self.name, labels, self.value)]
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def _new_child(self):
+        return Gauge(self.name, self.documentation)
+
+    def samples(self, labels: str) -> List[str]:
+        return [sample(self.name, labels, self.value)]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # The last count is the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def _new_child(self):
+        return Histogram(self.name, self.documentation, buckets=self.buckets)
+
+    def samples(self, labels: str) -> List[str]:
+        separator = "," if labels else ""
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            lines.append(sample(
+                f"{self.name}_bucket", f'{labels}{separator}le="{le}"', cumulative
+            ))
+        lines.append(sample(f"{self.name}_sum", labels, self.sum))
+        lines.append(sample(f"{self.name}_count", labels, self.count))
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        Register a metric, or return the one already registered with its name
+        (so modules can be reloaded, e.g. by the tests).
+        """
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str,
+                labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str,
+              labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str,
+                  labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def on_collect(self, collector: Callable[[], None]):
+        """
+        Register a function called before every exposition, to update the
+        metrics that are derived from others (e.g. ratios).
+        """
+        if collector not in self._collectors:
+            self._collectors.append(collector)
+
+    def exposition(self) -> str:
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for name in sorted(self.metrics):
+            lines.extend(self.metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def sample(name: str, labels: str, value: float) -> str:
+    if labels:
+        name = f"{name}{{{labels}}}"
+    return f"{name} {float(value)!r}"
+
+
+def timed_methods(duration: Histogram, errors: Counter):
+    """
+    Class decorator that times every public coroutine method of the class in
+    `duration` and counts the exceptions it raises in `errors`, both labelled
+    with the name of the method.
+    """
+
+    def decorator(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith("_") or not inspect.iscoroutinefunction(method):
+                continue
+            setattr(cls, name, timed(method, duration.labels(name),
+                                     errors.labels(name)))
+        return cls
+
+    return decorator
+
+
+def timed(method, duration: Histogram, errors: Counter):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        started_at = perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            duration.observe(perf_counter() - started_at)
+
+    return wrapper
+
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,189 @@
+import json
+import logging
+from collections import Counter as Tally
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import environ
+from typing import List, Optional, Tuple
+from app.exceptions.InternalServerErrorException import InternalServerErrorException
+from app.utils.metrics import REGISTRY
+
+logger = logging.getLogger("app")
+logger.setLevel("DEBUG")
+
+# Maximum Mongo commands (round trips) and users service calls a request may
+# issue; 0 disables the check. Exceeding them is logged and counted, and also
+# fails the request if REQUEST_BUDGET_STRICT is enabled (meant for tests).
+MONGO_REQUEST_BUDGET = int(environ.get("MONGO_REQUEST_BUDGET", 0))
+USERS_REQUEST_BUDGET = int(environ.get("USERS_REQUEST_BUDGET", 0))
+REQUEST_BUDGET_STRICT = environ.get("REQUEST_BUDGET_STRICT", "false") == "true"
+
+BUDGET_EXCEEDED = REGISTRY.counter(
+    "social_request_budget_exceeded_total",
+    "Requests that issued more Mongo commands or users service calls than "
+    "their budget",
+    ["route", "resource"],
+)
+
+
+class BudgetExceeded(InternalServerErrorException):
+    def __init__(self, detail: str):
+        super().__init__(detail=detail)
+
+
+class RequestStats:
+    """
+    What a request (or any other unit of work) did: the Mongo commands it
+    issued, with their duration, and its calls to the users service.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        # (command name, collection, seconds). Appended from the threads of
+        # the Mongo driver, list.append is atomic.
+        self.mongo_commands: List[Tuple[str, str, float]] = []
+        self.users_calls = 0
+
+    @property
+    def mongo_time(self) -> float:
+        return sum(seconds for _, _, seconds in self.mongo_commands)
+
+    def summary(self) -> str:
+        commands = Tally(
+            f"{name} {collection}" for name, collection, _ in self.mongo_commands
+        )
+        return (f"{len(self.mongo_commands)} mongo commands "
+                f"({self.mongo_time * 1000:.1f} ms: {dict(commands)}), "
+                f"{self.users_calls} users service calls")
+
+
+# Stats of the request being handled. The Mongo driver copies the context to
+# the threads it runs the commands on, so its listeners see it too.
+CURRENT_REQUEST: ContextVar[Optional[RequestStats]] = ContextVar(
+    "current_request", default=None
+)
+
+
+def current_request() -> Optional[RequestStats]:
+    return CURRENT_REQUEST.get()
+
+
+def record_users_call():
+    stats = CURRENT_REQUEST.get()
+    if stats is not None:
+        stats.users_calls += 1
+
+
+@contextmanager
+def track_request(name: str):
+    stats = RequestStats(name)
+    token = CURRENT_REQUEST.set(stats)
+    try:
+        yield stats
+    finally:
+        CURRENT_REQUEST.reset(token)
+
+
+def check_budget(stats: RequestStats, mongo: int, users: int, strict: bool):
+    """
+    Log (and raise BudgetExceeded, if strict) if the request issued more
+    Mongo commands or users service calls than allowed. 0 means no limit.
+    """
+    exceeded = []
+    if mongo and len(stats.mongo_commands) > mongo:
+        exceeded.append(f"{len(stats.mongo_commands)} mongo commands > {mongo}")
+        BUDGET_EXCEEDED.labels(stats.name, "mongo").inc()
+    if users and stats.users_calls > users:
+        exceeded.append(f"{stats.users_calls} users service calls > {users}")
+        BUDGET_EXCEEDED.labels(stats.name, "users").inc()
+    if not exceeded:
+        return
+
+    message = (f"{stats.name} exceeded its budget ({', '.join(exceeded)}): "
+               f"{stats.summary()}")
+    logger.warning(f"[REQUEST BUDGET]: {message}")
+    if strict:
+        raise BudgetExceeded(message)
+
+
+@contextmanager
+def query_budget(mongo: int = 0, users: int = 0, name: str = "query_budget"):
+    """
+    Fail with BudgetExceeded if the code in the block issues more Mongo
+    commands or users service calls than given, e.g. in a test (see the
+    README for what a feed page sends):
+
+        with query_budget(mongo=6, users=1):
+            await social_service.get_my_feed(user_id, pagination)
+    """
+    with track_request(name) as stats:
+        yield stats
+    check_budget(stats, mongo, users, strict=True)
+
+
+class RequestStatsMiddleware:
+    """
+    ASGI middleware that tracks the Mongo commands and users service calls of
+    each request and checks them against MONGO_REQUEST_BUDGET and
+    USERS_REQUEST_BUDGET.
+
+    The budget is checked when the response starts, before anything is sent,
+    so in strict mode the request fails with a 500 instead of its response.
+    Commands issued after that (e.g. by background tasks) are not counted.
+    """
+
+    def __init__(self, app, mongo_budget: int = MONGO_REQUEST_BUDGET,
+                 users_budget: int = USERS_REQUEST_BUDGET,
+                 strict: bool = REQUEST_BUDGET_STRICT):
+        self.app = app
+        self.mongo_budget = mongo_budget
+        self.users_budget = users_budget
+        self.strict = strict
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        checked = False
+        failed = False
+
+        async def send_checked(message):
+            nonlocal checked, failed
+            if message["type"] == "http.response.start":
+                checked = True
+                try:
+                    self._check(scope, stats)
+                except BudgetExceeded as err:
+                    failed = True
+                    await send_error(send, err)
+                    return
+            elif failed:
+                # Drop the body of the response replaced by the error
+                return
+            await send(message)
+
+        with track_request(f"{scope['method']} {scope['path']}") as stats:
+            await self.app(scope, receive, send_checked)
+        if not checked:
+            # No response was started (the app raised): still log it
+            self._check(scope, stats)
+
+    def _check(self, scope, stats: RequestStats):
+        route = scope.get("route")
+        if route is not None:
+            stats.name = f"{scope['method']} {route.path}"
+        check_budget(stats, self.mongo_budget, self.users_budget, self.strict)
+
+
+async def send_error(send, err: BudgetExceeded):
+    body = json.dumps({"detail": err.detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": err.status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,61 @@
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+# A tag of the post weighs as much as this many occurrences in its content
+TAG_WEIGHT = 3
+# Occurrences of a term in the content counted towards its weight, so
+# repeating a word does not push a post to the top
+MAX_TERM_FREQUENCY = 3
+# Longer words are cut to this length, both when indexing and searching
+MAX_TERM_LENGTH = 32
+# Terms of a query looked up, the rest are ignored
+MAX_QUERY_TERMS = 8
+
+WORD = re.compile(r"\w+")
+
+# Words too common to tell posts apart: indexing them would only make the
+# longest postings lists longer
+STOPWORDS = frozenset("""
+    a al algo como con de del el en es esta este esto ha la las le lo los me
+    mi mis muy mas no nos o para pero por que se si sin son su sus te tu un una
+    uno unos y ya yo
+    an and are as at be by for from has have i in is it its my of on or so
+    that the this to was we with you
+""".split())
+
+
+def normalize(text: str) -> str:
+    """
+    Lowercase the text and strip its accents, so "Número" matches "numero".
+    """
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        word[:MAX_TERM_LENGTH]
+        for word in WORD.findall(normalize(text))
+        if len(word) > 1 and word not in STOPWORDS
+    ]
+
+
+def index_terms(content: str, tags: Optional[Iterable[str]]) -> Dict[str, int]:
+    """
+    Weight of each term of a post: the (capped) occurrences of the term in
+    its content, plus TAG_WEIGHT if it is one of its tags.
+    """
+    weights: Dict[str, int] = {}
+    for term in tokenize(content or ""):
+        weights[term] = min(weights.get(term, 0) + 1, MAX_TERM_FREQUENCY)
+    for tag in set(tokenize(" ".join(tags or []))):
+        weights[tag] = weights.get(tag, 0) + TAG_WEIGHT
+    return weights
+
+
+def query_terms(query: str) -> List[str]:
+    """
+    Distinct terms of a search query, in the order they were written.
+    """
+    return list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
@@ -17,8 +17,8 @@ def updatedAtTrigger(collection_name: str):
 
     def decorator(func):
         @wraps(func)
-        def wrapper(*args, **kwargs):
-            result = func(*args, **kwargs)
+        async def wrapper(*args, **kwargs):
+            result = await func(*args, **kwargs)
 
             if result and result == 1:
                 id_post = args[1]
@@ -28,7 +28,7 @@ def updatedAtTrigger(collection_name: str):
                     if collection_name == "posts"
                     else args[0].users_collection
                 )
-                collection.update_one(
+                await collection.update_one(
                     {"_id": ObjectId(id_post)},
                     {"$set": {"updated_at": datetime.now()}},
                 )
@@ -0,0 +1,81 @@
+"""
+Compares building the posts of a feed page from documents of the posts
+collection: validating them twice (PostSchema, then PostInFeedSchema.from_post),
+once per post (the previous path of the service), once per page with a cached
+TypeAdapter (the current path), and constructing them without validation.
+
+Usage:
+    python -m benchmarks.construction [--posts 30] [--comments 3]
+"""
+import argparse
+import timeit
+import warnings
+from pydantic_core import to_json
+from app.schemas.Post import (
+    FEED_PAGE_ADAPTER,
+    PostCommentSchema,
+    PostInFeedSchema,
+    PostSchema,
+)
+from benchmarks.fixtures import make_author, make_post_document
+
+
+def make_documents(posts: int, comments: int) -> list[dict]:
+    documents = []
+    for index in range(posts):
+        document = make_post_document(index, comments)
+        document["author"] = make_author(document.pop("author_user_id"))
+        documents.append(document)
+    return documents
+
+
+def construct(card: dict) -> PostInFeedSchema:
+    return PostInFeedSchema.model_construct(**{
+        **card,
+        "comments": [
+            PostCommentSchema.model_construct(**comment)
+            for comment in card["comments"]
+        ],
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.construction")
+    parser.add_argument("--posts", type=int, default=30)
+    parser.add_argument("--comments", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    # See benchmarks.serialization
+    warnings.simplefilter("ignore", UserWarning)
+    documents = make_documents(args.posts, args.comments)
+    cards = [
+        {key: value for key, value in document.items() if key != "photo_links"}
+        for document in documents
+    ]
+
+    candidates = {
+        "validate twice (from_post)": lambda: [
+            PostInFeedSchema.from_post(PostSchema.model_validate(document))
+            for document in documents
+        ],
+        "validate each post": lambda: [
+            PostInFeedSchema.model_validate(card) for card in cards
+        ],
+        "validate the page": lambda: FEED_PAGE_ADAPTER.validate_python(cards),
+        "model_construct": lambda: [construct(card) for card in cards],
+    }
+    renders = {name: to_json(build()) for name, build in candidates.items()}
+    assert len(set(renders.values())) == 1
+
+    print(f"{args.posts} posts with {args.comments} comments each")
+    baseline = None
+    for name, build in candidates.items():
+        seconds = min(timeit.repeat(build, number=args.repeat, repeat=5))
+        per_post = seconds / args.repeat / args.posts * 1e6
+        baseline = baseline or per_post
+        print(f"{name:>32}: {per_post:8.2f} µs/post  x{baseline / per_post:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""
+End-to-end benchmark of the hot endpoints of the service: the FastAPI app is
+driven in-process through httpx, against mongomock (or a local MongoDB with
+--mongo-url) and a fake users service that answers after --users-latency-ms.
+A dataset of users, follows, posts, likes and comments is seeded first, then
+each scenario is run with --concurrency clients and its p50/p95/p99 latency
+and throughput are reported, and saved as JSON to compare runs across commits.
+
+Usage:
+    python -m benchmarks.e2e [--users 200] [--requests 500] [--concurrency 16]
+                             [--users-latency-ms 5] [--output results.json]
+                             [--baseline previous.json]
+
+With --mongo-url the social_service database of that server is DROPPED and
+seeded again: only point it to a throwaway MongoDB.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+from datetime import datetime, timezone
+
+# The settings of the service are read when its modules are imported
+os.environ.setdefault("USERS_SERVICE_URL", "http://users.benchmark")
+os.environ.setdefault("JWT_SECRET", "benchmark")
+os.environ.setdefault("HASH_ALGORITHM", "HS256")
+
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+from jose import jwt  # noqa: E402
+from starlette.applications import Starlette  # noqa: E402
+from starlette.responses import JSONResponse, Response  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+
+TAGS = ["petunias", "mandarinas", "cactus", "helechos", "rosas", "huerta"]
+SCENARIOS = [
+    "feed",
+    "get_post",
+    "get_comments",
+    "follow",
+    "unfollow",
+    "like",
+    "comment",
+]
+
+
+def make_profile(user_id: int) -> dict:
+    return {
+        "id": user_id,
+        "name": f"User {user_id}",
+        "email": f"user_{user_id}@example.com",
+        "gender": None,
+        "photo": f"https://example.com/users/{user_id}.jpg",
+        "birthdate": None,
+        "location": None,
+        "nickname": f"user_{user_id}",
+        "biography": None,
+    }
+
+
+def make_users_service(users: int, latency: float) -> Starlette:
+    """
+    Stand-in of the users service that answers after `latency` seconds.
+    """
+
+    async def get_user(request):
+        await asyncio.sleep(latency)
+        user_id = int(request.path_params["user_id"])
+        if not 1 <= user_id <= users:
+            return JSONResponse({"detail": "Not found"}, status_code=404)
+        return JSONResponse({"message": make_profile(user_id)})
+
+    async def get_users(request):
+        await asyncio.sleep(latency)
+        ids = request.query_params.get("ids")
+        if not ids:
+            return Response(status_code=204)
+        found = [int(id) for id in ids.split(",") if 1 <= int(id) <= users]
+        if not found:
+            return JSONResponse({"detail": "Not found"}, status_code=404)
+        return JSONResponse({"message": [make_profile(id) for id in found]})
+
+    return Starlette(routes=[
+        Route("/users/{user_id:int}", get_user),
+        Route("/users", get_users),
+    ])
+
+
+def make_token(user_id: int) -> str:
+    claims = {"user_id": user_id, "exp": int(time.time()) + 24 * 3600}
+    return jwt.encode(
+        claims, os.environ["JWT_SECRET"], algorithm=os.environ["HASH_ALGORITHM"]
+    )
+
+
+def load_app(mongo_url: str | None):
+    if mongo_url:
+        os.environ["MONGO_URL"] = mongo_url
+    from app.repository.SocialMongo import SocialMongoDB
+    if not mongo_url:
+        from mongomock_motor import AsyncMongoMockClient
+        SocialMongoDB.client = AsyncMongoMockClient()
+    from app import main
+    return main
+
+
+async def seed(main, args, rng: random.Random) -> list[str]:
+    """
+    Seed through the service, so the timelines and counters are filled the
+    same way as in production. Returns the ids of the posts.
+    """
+    from app.schemas.Post import PostCreateSchema
+    from app.schemas.SocialUser import SocialUserCreateSchema
+
+    service = main.social_service
+    repository = main.social_repository
+    await repository.database.client.drop_database("social_service")
+    await main.start_up()
+
+    users = range(1, args.users + 1)
+    for user_id in users:
+        await service.create_social_user(SocialUserCreateSchema(id=user_id))
+    for user_id in users:
+        followees = rng.sample(users, min(args.follows_per_user, args.users - 1))
+        for followee in followees:
+            if followee != user_id:
+                await service.follow_social_user(user_id, followee)
+
+    posts = []
+    for index in range(args.users * args.posts_per_user):
+        post = await service.create_post(PostCreateSchema(
+            author_user_id=rng.choice(users),
+            content=f"Mi planta número {index} creció un montón esta semana",
+            tags=rng.sample(TAGS, 2),
+            photo_links=[f"https://example.com/photos/{index}/0.jpg"],
+        ))
+        posts.append(post.id)
+        for liker in rng.sample(users, min(args.likes_per_post, args.users)):
+            await repository.like_post(liker, post.id)
+        for _ in range(args.comments_per_post):
+            await service.comment_post(post.id, rng.choice(users), "Hermosa!")
+    await repository.flush_counters()
+    return posts
+
+
+def make_scenarios(args, posts: list[str], tokens: dict[int, str]):
+    def auth(user_id):
+        return {"Authorization": f"Bearer {tokens[user_id]}"}
+
+    def other_users(rng):
+        return rng.sample(range(1, args.users + 1), 2)
+
+    def feed(client, rng):
+        user_id = rng.randint(1, args.users)
+        return client.get("/social/users/me/feed", headers=auth(user_id))
+
+    def get_post(client, rng):
+        user_id = rng.randint(1, args.users)
+        return client.get(f"/social/posts/{rng.choice(posts)}", headers=auth(user_id))
+
+    def get_comments(client, rng):
+        return client.get(f"/social/posts/{rng.choice(posts)}/comments")
+
+    def follow(client, rng):
+        user_id, followee = other_users(rng)
+        return client.post(
+            "/social/users/follow", headers=auth(user_id), json={"user_id": followee}
+        )
+
+    def unfollow(client, rng):
+        user_id, followee = other_users(rng)
+        return client.post(
+            "/social/users/unfollow", headers=auth(user_id), json={"user_id": followee}
+        )
+
+    def like(client, rng):
+        user_id = rng.randint(1, args.users)
+        return client.post(
+            f"/social/posts/{rng.choice(posts)}/like", headers=auth(user_id)
+        )
+
+    def comment(client, rng):
+        user_id = rng.randint(1, args.users)
+        return client.post(
+            f"/social/posts/{rng.choice(posts)}/comments",
+            headers=auth(user_id),
+            json={"body": "Qué lindas hojas"},
+        )
+
+    return {
+        "feed": feed,
+        "get_post": get_post,
+        "get_comments": get_comments,
+        "follow": follow,
+        "unfollow": unfollow,
+        "like": like,
+        "comment": comment,
+    }
+
+
+async def run_scenario(client, request, requests: int, concurrency: int, seed: int):
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def worker(worker_id):
+        nonlocal errors
+        rng = random.Random(seed * 1000 + worker_id)
+        for _ in remaining:
+            started_at = time.perf_counter()
+            response = await request(client, rng)
+            latencies.append(time.perf_counter() - started_at)
+            if response.status_code >= 400:
+                errors += 1
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker(id) for id in range(concurrency)))
+    elapsed = time.perf_counter() - started_at
+    return summarize(latencies, errors, elapsed)
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "max_ms": round(max(latencies) * 1000, 3),
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: dict, baseline: dict | None):
+    print(f"{'scenario':>14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'req/s':>9} {'errors':>7}")
+    for name, result in results.items():
+        line = (f"{name:>14} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f} "
+                f"{result['p99_ms']:9.2f} {result['throughput_rps']:9.1f} "
+                f"{result['errors']:7d}")
+        previous = (baseline or {}).get(name)
+        if previous:
+            speedup = previous["p50_ms"] / result["p50_ms"]
+            gain = result["throughput_rps"] / previous["throughput_rps"]
+            line += f"  p50 x{speedup:.2f}  req/s x{gain:.2f}"
+        print(line)
+
+
+async def benchmark(args) -> dict:
+    main = load_app(args.mongo_url)
+    from app.external.Users import UserService
+
+    UserService.client = AsyncClient(transport=ASGITransport(
+        make_users_service(args.users, args.users_latency_ms / 1000)
+    ))
+    rng = random.Random(args.seed)
+    started_at = time.perf_counter()
+    posts = await seed(main, args, rng)
+    print(f"seeded {args.users} users and {len(posts)} posts "
+          f"in {time.perf_counter() - started_at:.1f} s", file=sys.stderr)
+
+    tokens = {user_id: make_token(user_id) for user_id in range(1, args.users + 1)}
+    scenarios = make_scenarios(args, posts, tokens)
+    results = {}
+    async with AsyncClient(
+        transport=ASGITransport(main.app), base_url="http://social.benchmark"
+    ) as client:
+        for index, name in enumerate(args.scenarios):
+            await run_scenario(
+                client, scenarios[name], args.warmup, args.concurrency, -index
+            )
+            results[name] = await run_scenario(
+                client, scenarios[name], args.requests, args.concurrency, index
+            )
+    await main.shutdown_db_client()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.e2e")
+    parser.add_argument("--mongo-url", default=None,
+                        help="MongoDB to run against instead of mongomock "
+                             "(its social_service database is dropped)")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--follows-per-user", type=int, default=20)
+    parser.add_argument("--posts-per-user", type=int, default=5)
+    parser.add_argument("--likes-per-post", type=int, default=5)
+    parser.add_argument("--comments-per-post", type=int, default=2)
+    parser.add_argument("--users-latency-ms", type=float, default=5)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS,
+                        default=SCENARIOS)
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results of this "
+                                           "JSON file (saved with --output)")
+    args = parser.parse_args()
+
+    # See benchmarks.serialization. The service also prints while handling
+    # some requests: keep it out of the report.
+    warnings.simplefilter("ignore", UserWarning)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = asyncio.run(benchmark(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        config = vars(args).copy()
+        del config["output"], config["baseline"]
+        with open(args.output, "w") as file:
+            json.dump({
+                "commit": git_commit(),
+                "date": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "mongo": "mongodb" if args.mongo_url else "mongomock",
+                "config": config,
+                "results": results,
+            }, file, indent=2)
+        print(f"saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
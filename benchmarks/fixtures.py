@@ -0,0 +1,59 @@
+"""
+Synthetic data shaped like the documents and responses of the service.
+"""
+from datetime import datetime, timedelta
+import uuid
+from bson import ObjectId
+from app.schemas.Post import PostInFeedSchema
+from app.schemas.RealUser import ReducedUser
+
+
+def make_post_document(index: int, comments: int = 3, photos: int = 3) -> dict:
+    """
+    A post as stored in the posts collection, already projected to a feed card
+    (see feed_card_projection) unless `photos` are kept.
+    """
+    created_at = datetime(2024, 5, 1) - timedelta(minutes=index)
+    return {
+        "id": str(ObjectId()),
+        "author_user_id": index % 50 + 1,
+        "content": f"Mi planta número {index} creció un montón esta semana " * 4,
+        "likes_count": index * 7,
+        "liked_by_me": index % 3 == 0,
+        "created_at": created_at,
+        "updated_at": created_at,
+        "tags": ["petunias", "mandarinas", f"tag_{index % 10}"],
+        "main_photo_link": f"https://example.com/photos/{index}/0.jpg",
+        "photo_links": [
+            f"https://example.com/photos/{index}/{photo}.jpg"
+            for photo in range(photos)
+        ],
+        "comments": [
+            {
+                "id": str(uuid.uuid4()),
+                "author": comment + 1,
+                "content": f"Comentario {comment}",
+                "created_at": created_at + timedelta(seconds=comment),
+            }
+            for comment in range(comments)
+        ],
+        "comments_count": comments,
+    }
+
+
+def make_author(user_id: int) -> ReducedUser:
+    return ReducedUser(
+        id=user_id,
+        name=f"User {user_id}",
+        photo=f"https://example.com/users/{user_id}.jpg",
+        nickname=f"user_{user_id}",
+    )
+
+
+def make_feed_page(posts: int = 30, comments: int = 3) -> list[PostInFeedSchema]:
+    page = []
+    for index in range(posts):
+        document = make_post_document(index, comments)
+        document["author"] = make_author(document.pop("author_user_id"))
+        page.append(PostInFeedSchema.model_validate(document))
+    return page
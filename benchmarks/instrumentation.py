@@ -0,0 +1,77 @@
+"""
+Measures the overhead the metrics add: HTTPMetricsMiddleware around an ASGI
+app that answers right away, and the wrapper timed_methods puts around each
+method of the repository.
+
+Usage:
+    python -m benchmarks.instrumentation [--requests 20000]
+"""
+import argparse
+import asyncio
+import time
+from app.utils.http_metrics import HTTPMetricsMiddleware
+from app.utils.metrics import MetricsRegistry, timed_methods
+
+
+class Route:
+    path = "/social/posts/{post_id}"
+
+
+async def endpoint(scope, receive, send):
+    scope["route"] = Route
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def receive():
+    return {"type": "http.request", "body": b""}
+
+
+async def send(message):
+    pass
+
+
+class Repository:
+    async def get_post(self):
+        return None
+
+
+async def per_call(call, calls: int) -> float:
+    best = float("inf")
+    for _ in range(5):
+        started_at = time.perf_counter()
+        for _ in range(calls):
+            await call()
+        best = min(best, time.perf_counter() - started_at)
+    return best / calls * 1e6
+
+
+async def benchmark(calls: int):
+    scope = {"type": "http", "method": "GET", "path": "/social/posts/1"}
+    middleware = HTTPMetricsMiddleware(endpoint)
+    bare = await per_call(lambda: endpoint(dict(scope), receive, send), calls)
+    measured = await per_call(lambda: middleware(dict(scope), receive, send), calls)
+    print(f"{'request':>12}: {bare:6.2f} µs bare, {measured:6.2f} µs with "
+          f"HTTPMetricsMiddleware (+{measured - bare:.2f} µs)")
+
+    registry = MetricsRegistry()
+    plain = Repository()
+    timed = timed_methods(
+        registry.histogram("duration_seconds", "", ["method"]),
+        registry.counter("errors_total", "", ["method"]),
+    )(type("TimedRepository", (Repository,), {"get_post": Repository.get_post}))()
+    bare = await per_call(plain.get_post, calls)
+    measured = await per_call(timed.get_post, calls)
+    print(f"{'repository':>12}: {bare:6.2f} µs bare, {measured:6.2f} µs with "
+          f"timed_methods (+{measured - bare:.2f} µs)")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.instrumentation")
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(benchmark(args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Latency of the post search (SocialMongoDB.search_posts) on a synthetic dataset:
+posts whose words follow a Zipf distribution over a vocabulary, like natural
+text, so a few terms are in a large part of the posts and most are rare. The
+posts are inserted, indexed with reindex_posts, and then each kind of query is
+run --queries times, reporting its p50/p95/p99 latency.
+
+Usage:
+    python -m benchmarks.search --mongo-url mongodb://localhost:27017
+                                [--posts 1000000] [--queries 200]
+                                [--output results.json] [--baseline previous.json]
+
+The 1M posts dataset needs a MongoDB, whose social_service database is DROPPED
+and seeded again: only point it to a throwaway one. Without --mongo-url it runs
+against mongomock with 1000 posts and 10 queries by default, which checks the
+benchmark works but does not measure MongoDB (mongomock has no indexes in use:
+it scans every posting in Python).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import random
+import sys
+import time
+import warnings
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.e2e import TAGS, git_commit, load_app, summarize
+
+# Most frequent words first; the rest of the vocabulary is made up
+COMMON_WORDS = [
+    "planta", "hojas", "riego", "maceta", "sol", "tierra", "flores", "semillas",
+    "rosas", "cactus", "sustrato", "poda", "abono", "brotes", "raices", "luz",
+    "helechos", "petunias", "mandarinas", "huerta", "tomates", "orquideas",
+]
+QUERY_KINDS = ["rare_term", "common_term", "two_terms", "three_terms", "next_page"]
+
+
+def make_vocabulary(size: int) -> list[str]:
+    return COMMON_WORDS + [
+        f"palabra{rank}" for rank in range(len(COMMON_WORDS), size)
+    ]
+
+
+def make_posts(rng: random.Random, vocabulary: list[str], posts: int,
+               start: int, words_weights: list[float]):
+    now = datetime.now()
+    for index in range(start, start + posts):
+        words = rng.choices(vocabulary, cum_weights=words_weights,
+                            k=rng.randint(8, 40))
+        created_at = now - timedelta(seconds=index * 7)
+        yield {
+            "author_user_id": index % 5000 + 1,
+            "content": " ".join(words),
+            "likes_count": 0,
+            "created_at": created_at,
+            "updated_at": created_at,
+            "tags": rng.sample(TAGS, rng.randint(0, 2)),
+            "photo_links": [],
+            "comments": [],
+            "comments_count": 0,
+        }
+
+
+async def seed(repository, args, rng: random.Random, vocabulary: list[str]):
+    await repository.database.client.drop_database("social_service")
+    if args.mongo_url:
+        # mongomock checks its unique indexes scanning the whole collection
+        await repository.ensure_indexes()
+    # Zipf: the frequency of a word is inversely proportional to its rank
+    words_weights = list(itertools.accumulate(
+        1 / rank ** args.zipf for rank in range(1, len(vocabulary) + 1)
+    ))
+    inserted = 0
+    while inserted < args.posts:
+        batch = list(make_posts(
+            rng, vocabulary, min(args.batch, args.posts - inserted), inserted,
+            words_weights,
+        ))
+        await repository.posts_collection.insert_many(batch)
+        inserted += len(batch)
+
+    started_at = time.perf_counter()
+    await repository.reindex_posts(batch_size=args.batch)
+    return time.perf_counter() - started_at
+
+
+def make_queries(rng: random.Random, vocabulary: list[str]) -> dict:
+    common = vocabulary[:10]
+    middle = vocabulary[len(COMMON_WORDS):len(COMMON_WORDS) + 500]
+    rare = vocabulary[len(vocabulary) // 2:]
+    return {
+        "rare_term": lambda: [rng.choice(rare)],
+        "common_term": lambda: [rng.choice(common)],
+        "two_terms": lambda: [rng.choice(common), rng.choice(middle)],
+        "three_terms": lambda: [
+            rng.choice(common), rng.choice(middle), rng.choice(rare)
+        ],
+        "next_page": lambda: [rng.choice(common)],
+    }
+
+
+async def run_queries(repository, kind: str, make_terms, args) -> dict:
+    from app.schemas.Post import SearchCursor, SearchPagination
+
+    latencies = []
+    started_at = time.perf_counter()
+    for _ in range(args.queries):
+        terms = make_terms()
+        pagination = SearchPagination(per_page=args.per_page)
+        if kind == "next_page":
+            first = await repository.search_posts(terms, pagination)
+            if first:
+                last = first[-1]
+                pagination = SearchPagination(
+                    per_page=args.per_page,
+                    cursor=SearchCursor(score=last["score"],
+                                        created_at=last["created_at"],
+                                        id=last["id"]),
+                )
+        query_started_at = time.perf_counter()
+        await repository.search_posts(terms, pagination)
+        latencies.append(time.perf_counter() - query_started_at)
+    return summarize(latencies, 0, time.perf_counter() - started_at)
+
+
+async def benchmark(args) -> dict:
+    main = load_app(args.mongo_url)
+    repository = main.social_repository
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(args.vocabulary)
+
+    started_at = time.perf_counter()
+    reindex_seconds = await seed(repository, args, rng, vocabulary)
+    postings = await repository.post_terms_collection.count_documents({})
+    print(f"seeded {args.posts} posts ({postings} postings) in "
+          f"{time.perf_counter() - started_at:.1f} s, indexed in "
+          f"{reindex_seconds:.1f} s", file=sys.stderr)
+
+    queries = make_queries(rng, vocabulary)
+    results = {}
+    for kind in args.kinds:
+        results[kind] = await run_queries(repository, kind, queries[kind], args)
+    repository.shutdown()
+    return {"reindex_seconds": round(reindex_seconds, 1), "postings": postings,
+            "queries": results}
+
+
+def print_results(results: dict, baseline: dict | None):
+    print(f"{'query':>14} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for kind, result in results["queries"].items():
+        line = (f"{kind:>14} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f} "
+                f"{result['p99_ms']:9.2f} {result['max_ms']:9.2f}")
+        previous = (baseline or {}).get("queries", {}).get(kind)
+        if previous:
+            line += f"  p50 x{previous['p50_ms'] / result['p50_ms']:.2f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.search")
+    parser.add_argument("--mongo-url", default=None,
+                        help="MongoDB to run against instead of mongomock "
+                             "(its social_service database is dropped)")
+    parser.add_argument("--posts", type=int, default=None,
+                        help="default: 1000000 with --mongo-url, 1000 without")
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--zipf", type=float, default=1.1,
+                        help="exponent of the distribution of the words")
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=None,
+                        help="default: 200 with --mongo-url, 10 without")
+    parser.add_argument("--per-page", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--kinds", nargs="+", choices=QUERY_KINDS,
+                        default=QUERY_KINDS)
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results of this "
+                                           "JSON file (saved with --output)")
+    args = parser.parse_args()
+    if args.posts is None:
+        args.posts = 1_000_000 if args.mongo_url else 1000
+    if args.queries is None:
+        args.queries = 200 if args.mongo_url else 10
+
+    # See benchmarks.serialization
+    warnings.simplefilter("ignore", UserWarning)
+    results = asyncio.run(benchmark(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        config = vars(args).copy()
+        del config["output"], config["baseline"]
+        with open(args.output, "w") as file:
+            json.dump({
+                "commit": git_commit(),
+                "date": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "mongo": "mongodb" if args.mongo_url else "mongomock",
+                "config": config,
+                "results": results,
+            }, file, indent=2)
+        print(f"saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
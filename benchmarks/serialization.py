@@ -0,0 +1,50 @@
+"""
+Compares rendering a feed page with JSONResponse(jsonable_encoder(...)), the
+previous path of the controller, against PydanticJSONResponse.
+
+Usage:
+    python -m benchmarks.serialization [--posts 30] [--comments 3]
+"""
+import argparse
+import json
+import timeit
+import warnings
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from app.utils.json_response import PydanticJSONResponse
+from benchmarks.fixtures import make_feed_page
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.serialization")
+    parser.add_argument("--posts", type=int, default=30)
+    parser.add_argument("--comments", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    # The photo links are validated to str but annotated as urls, which makes
+    # pydantic warn on every dump; the warnings would dominate the timings.
+    warnings.simplefilter("ignore", UserWarning)
+    page = make_feed_page(args.posts, args.comments)
+
+    candidates = {
+        "jsonable_encoder + json.dumps": lambda: JSONResponse(
+            content=jsonable_encoder(page)
+        ).body,
+        "pydantic-core to_json": lambda: PydanticJSONResponse(content=page).body,
+    }
+    bodies = {name: render() for name, render in candidates.items()}
+    assert len({json.dumps(json.loads(body)) for body in bodies.values()}) == 1
+
+    print(f"feed page of {args.posts} posts with {args.comments} comments each")
+    baseline = None
+    for name, render in candidates.items():
+        seconds = min(timeit.repeat(render, number=args.repeat, repeat=5))
+        per_page = seconds / args.repeat * 1e6
+        baseline = baseline or per_page
+        print(f"{name:>32}: {per_page:8.1f} µs/page  "
+              f"{len(bodies[name]):6d} bytes  x{baseline / per_page:.1f}")
+
+
+if __name__ == "__main__":
+    main()